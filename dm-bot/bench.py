@@ -0,0 +1,659 @@
+"""
+DM-Bot benchmarks: python3 dm-bot/bench.py <name> [--rounds N] [--capture synthetic]
+
+Development only — install.sh ships bot.py alone. Benchmarks drive the real
+bot module; the Bot API ones run against a local stand-in server, so none of
+them need a token or the network.
+"""
+
+import json
+import logging
+import os
+import queue
+import subprocess
+import tempfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Callable, Optional
+from urllib.parse import urlsplit
+
+import mss
+import mss.tools
+import telebot
+from telebot import types
+
+import bot as dm
+from bot import (
+    CAPTURE_BACKENDS, COMMAND_WORKERS, DATA_DIR, OUTBOX_NOTIFY, OUTBOX_REJECT, OUTBOX_REPLY,
+    RECORD_QUEUE_DEPTH, SYNTHETIC_SCENES, UPLOAD_ATTEMPTS, VIDEO_FPS, __version__,
+    DMBot, FileIdCache, HandlerLanes, SyntheticBackend, UpdateLatency, UploadManager, WebhookServer,
+    _human, commands, encode_image, format_record_stats, get_capabilities, get_capture,
+    get_system_info, get_x11, grab_screen, make_http_session, monitor_count, processes,
+    record_screen, run_command, take_overview, take_screenshots, windows,
+)
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Local Bot API stand-in
+# ─────────────────────────────────────────────────────────────────────────────
+
+class _FakeTelegram(ThreadingHTTPServer):
+    """
+    Local stand-in for api.telegram.org: getUpdates long-polls a queue of
+    synthetic updates, getMe returns a bot user, send* methods return a
+    message (with a photo/video/document carrying a new file_id for an
+    upload, or the one it was sent by), every other method answers
+    {"ok": true}. Point telebot.apihelper.API_URL at it to drive a bot
+    without the network. `latency` delays every answer; each entry put on
+    `failures` ("500", "429" or "drop", which hangs up mid-request) spoils
+    one request; with `chat_limit`, a chat's send* beyond that many within
+    a second gets a 429 the way Telegram's flood control answers.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, latency: float = 0.0) -> None:
+        super().__init__(("127.0.0.1", 0), _FakeTelegramHandler)
+        self.updates: queue.Queue = queue.Queue()
+        self.failures: queue.Queue = queue.Queue()
+        self.latency     = latency
+        self.connections = 0  # TCP connections accepted
+        self.received    = 0  # request body bytes read
+        self.files       = 0  # file_ids handed out for uploads
+        self.chat_limit  = 0  # send* per chat per second; 0 = unlimited
+        self.sends       = 0  # send* requests answered
+        self.limited     = 0  # of which refused with a 429
+        self.recent: dict[int, deque] = {}
+        self.lock = threading.Lock()
+        self.api_url = f"http://127.0.0.1:{self.server_port}/bot{{0}}/{{1}}"
+        threading.Thread(target=self.serve_forever, name="dm-bot-fake-api", daemon=True).start()
+
+    @staticmethod
+    def update(update_id: int, text: str = "/ping") -> dict:
+        return {"update_id": update_id, "message": {
+            "message_id": update_id, "date": int(time.time()), "text": text,
+            "chat": {"id": 1, "type": "private"},
+            "from": {"id": 1, "is_bot": False, "first_name": "bench"},
+            "entities": [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}],
+        }}
+
+
+class _FakeTelegramHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    TOO_MANY = {"ok": False, "error_code": 429, "description": "Too Many Requests: retry after 1",
+                "parameters": {"retry_after": 1}}
+
+    def setup(self) -> None:
+        super().setup()
+        self.server.connections += 1
+
+    def _answer(self, code: int, payload: dict) -> None:
+        body = json.dumps(payload).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _message(self, params: dict, kind: str, source: Optional[str]) -> dict:
+        message = {"message_id": 1, "date": int(time.time()),
+                   "chat": {"id": int(params.get("chat_id", 1)), "type": "private"}}
+        if kind in ("photo", "video", "document"):
+            if not source or source.startswith("attach://"):
+                self.server.files += 1
+                source = f"bench-file-{self.server.files}"
+            media = {"file_id": source, "file_unique_id": source}
+            if kind == "photo":
+                message["photo"] = [{**media, "width": 1, "height": 1}]
+            elif kind == "video":
+                message["video"] = {**media, "width": 1, "height": 1, "duration": 1}
+            else:
+                message["document"] = media
+        return message
+
+    def _flooded(self, params: dict) -> bool:
+        server = self.server
+        with server.lock:
+            server.sends += 1
+            if not server.chat_limit:
+                return False
+            now    = time.monotonic()
+            recent = server.recent.setdefault(int(params.get("chat_id", 1)), deque())
+            while recent and recent[0] < now - 1:
+                recent.popleft()
+            if len(recent) >= server.chat_limit:
+                server.limited += 1
+                return True
+            recent.append(now)
+            return False
+
+    def _handle(self) -> None:
+        from urllib.parse import parse_qs
+        length = int(self.headers.get("Content-Length") or 0)
+        params = {k: v[0] for k, v in parse_qs(urlsplit(self.path).query).items()}
+        try:
+            failure = self.server.failures.get_nowait()
+        except queue.Empty:
+            failure = None
+        if failure == "drop":
+            self.rfile.read(length // 2)
+            self.close_connection = True
+            return
+        body = self.rfile.read(length) if length else b""
+        self.server.received += len(body)
+        if self.headers.get("Content-Type", "").startswith("application/x-www-form-urlencoded"):
+            params.update({k: v[0] for k, v in parse_qs(body.decode()).items()})
+        time.sleep(self.server.latency)
+        if failure == "500":
+            self._answer(500, {"ok": False, "error_code": 500, "description": "Internal Server Error"})
+            return
+        if failure == "429":
+            self._answer(429, self.TOO_MANY)
+            return
+        method = urlsplit(self.path).path.rsplit("/", 1)[-1]
+        if method.startswith("send") and method != "sendChatAction" and self._flooded(params):
+            self._answer(429, self.TOO_MANY)
+            return
+        result = True
+        if method == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "DM-Bot", "username": "dm_bot_bench"}
+        elif method == "sendMediaGroup":
+            result = [self._message(params, item["type"], item["media"])
+                      for item in json.loads(params.get("media", "[]"))]
+        elif method.startswith("send"):
+            kind   = method[4:].lower()
+            result = self._message(params, kind, params.get(kind))
+        elif method == "getUpdates":
+            result = []
+            try:
+                result.append(self.server.updates.get(timeout=float(params.get("timeout", 0)) or 0.01))
+                while True:
+                    result.append(self.server.updates.get_nowait())
+            except queue.Empty:
+                pass
+        self._answer(200, {"ok": True, "result": result})
+
+    do_GET = do_POST = _handle
+
+    def log_message(self, fmt: str, *args) -> None:
+        pass
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Benchmarks
+# ─────────────────────────────────────────────────────────────────────────────
+
+def _ms(seconds: float) -> str:
+    return f"{seconds * 1000:8.1f} ms"
+
+
+def bench_screenshot(rounds: int) -> None:
+    """Capture / encode / total latency per screenshot format, plus the old disk path."""
+    print(f"{'format':<14}{'capture':>12}{'encode':>12}{'total':>12}{'size':>12}")
+
+    # Baseline: pure-Python PNG written to DATA_DIR and read back (needs a real mss session)
+    cap = get_capture()
+    cap.monitors()
+    if cap.backend == "mss":
+        capture = encode = 0.0
+        size = 0
+        for _ in range(rounds):
+            t0 = time.perf_counter()
+            with mss.mss() as sct:
+                sct_img = sct.grab(sct.monitors[1])
+            t1 = time.perf_counter()
+            outfile = DATA_DIR / "dm-bot-bench.png"
+            mss.tools.to_png(sct_img.rgb, sct_img.size, output=str(outfile))
+            size = len(outfile.read_bytes())
+            outfile.unlink(missing_ok=True)
+            capture += t1 - t0
+            encode  += time.perf_counter() - t1
+        print(f"{'png (disk)':<14}{_ms(capture / rounds):>12}{_ms(encode / rounds):>12}"
+              f"{_ms((capture + encode) / rounds):>12}{size // 1024:>9} KB")
+
+    variants = [("png", 1), ("png", 6), ("jpeg", 85), ("jpeg", 70), ("webp", 85), ("webp", 70)]
+    for fmt, quality in variants:
+        capture = encode = 0.0
+        for _ in range(rounds):
+            t0 = time.perf_counter()
+            img = grab_screen()
+            t1 = time.perf_counter()
+            size = len(encode_image(img, fmt, quality))
+            capture += t1 - t0
+            encode  += time.perf_counter() - t1
+        print(f"{f'{fmt}:{quality}':<14}{_ms(capture / rounds):>12}{_ms(encode / rounds):>12}"
+              f"{_ms((capture + encode) / rounds):>12}{size // 1024:>9} KB")
+
+    # Window-sized region (800x600 at the monitor origin) vs the full monitor above
+    mon = get_capture().monitors()[1]
+    region = {"left": mon["left"], "top": mon["top"], "width": 800, "height": 600}
+    capture = encode = 0.0
+    for _ in range(rounds):
+        t0 = time.perf_counter()
+        img = get_capture().grab_region(region)
+        t1 = time.perf_counter()
+        size = len(encode_image(img, "png", 1))
+        capture += t1 - t0
+        encode  += time.perf_counter() - t1
+    print(f"{'png:1 800x600':<14}{_ms(capture / rounds):>12}{_ms(encode / rounds):>12}"
+          f"{_ms((capture + encode) / rounds):>12}{size // 1024:>9} KB")
+
+
+def bench_backends(rounds: int) -> None:
+    """Grab latency of monitor 1 for every capture backend available here, plus synthetic."""
+    for name in dict.fromkeys(get_capabilities()["capture"] + ["synthetic"]):
+        try:
+            backend = CAPTURE_BACKENDS[name]()
+        except Exception as exc:
+            print(f"{name:<28}unavailable ({exc})")
+            continue
+        try:
+            t0 = time.perf_counter()
+            for _ in range(rounds):
+                backend.grab(backend.monitors[1])
+            print(f"{name:<28}{_ms((time.perf_counter() - t0) / rounds)}")
+        finally:
+            backend.close()
+
+
+def bench_capture(rounds: int) -> None:
+    """Repeated-grab latency: a fresh backend session per call vs the shared CaptureService."""
+    cap = get_capture()
+    cap.grab(1)  # connect outside the timed loop, as run() does at startup
+    t0 = time.perf_counter()
+    for _ in range(rounds):
+        backend = CAPTURE_BACKENDS[cap.backend]()
+        backend.grab(backend.monitors[1])
+        backend.close()
+    fresh = (time.perf_counter() - t0) / rounds
+
+    t0 = time.perf_counter()
+    for _ in range(rounds):
+        cap.grab(1)
+    shared = (time.perf_counter() - t0) / rounds
+
+    frame = cap.grab_array(1)
+    t0 = time.perf_counter()
+    for _ in range(rounds):
+        frame = cap.grab_array(1, out=frame)
+    reused = (time.perf_counter() - t0) / rounds
+
+    print(f"{f'new {cap.backend} per grab':<28}{_ms(fresh)}")
+    print(f"{'CaptureService.grab':<28}{_ms(shared)}")
+    print(f"{'grab_array (reused buffer)':<28}{_ms(reused)}")
+
+
+def bench_monitors(rounds: int) -> None:
+    """One monitor vs all monitors encoded serially vs all monitors via take_screenshots()."""
+    count = monitor_count()
+    cap = get_capture()
+    rows = []
+    t0 = time.perf_counter()
+    for _ in range(rounds):
+        encode_image(cap.grab_image(1))
+    rows.append(("monitor 1", time.perf_counter() - t0))
+    t0 = time.perf_counter()
+    for _ in range(rounds):
+        for m in range(1, count + 1):
+            encode_image(cap.grab_image(m))
+    rows.append((f"{count} monitors, serial", time.perf_counter() - t0))
+    t0 = time.perf_counter()
+    for _ in range(rounds):
+        take_screenshots()
+    rows.append((f"{count} monitors, parallel", time.perf_counter() - t0))
+    t0 = time.perf_counter()
+    for _ in range(rounds):
+        take_overview()
+    rows.append(("overview", time.perf_counter() - t0))
+    for label, total in rows:
+        print(f"{label:<28}{_ms(total / rounds)}")
+
+
+def bench_record(rounds: int) -> None:
+    """Record `rounds` seconds of the primary monitor and report the frame clock stats."""
+    path, stats, err = record_screen(rounds)
+    if err:
+        print(err)
+        return
+    size = Path(path).stat().st_size
+    Path(path).unlink(missing_ok=True)
+    print(f"{rounds}s @ {VIDEO_FPS} fps, queue depth {RECORD_QUEUE_DEPTH}: "
+          f"{format_record_stats(stats)} · {size // 1024} KB")
+
+
+def bench_vfr(rounds: int) -> None:
+    """
+    Constant-rate vs damage-only recording of the same `rounds` seconds: CPU
+    and size. With the synthetic backend both the moving and the mostly idle
+    scene are recorded, since VFR only pays off when the screen is still.
+    """
+    import resource
+    cap = get_capture()
+    cap.grab(1)  # resolve the backend before deciding which scenes to run
+    scenes = SYNTHETIC_SCENES if cap.backend == "synthetic" else (cap.backend,)
+    for scene in scenes:
+        for vfr in (False, True):
+            if cap.backend == "synthetic":
+                cap._sct = SyntheticBackend(scene=scene)  # restart the scene; nothing else is grabbing
+            child0 = resource.getrusage(resource.RUSAGE_CHILDREN)
+            path, stats, err = record_screen(rounds, vfr=vfr)
+            child1 = resource.getrusage(resource.RUSAGE_CHILDREN)
+            if err:
+                print(err)
+                return
+            size = Path(path).stat().st_size
+            Path(path).unlink(missing_ok=True)
+            ffmpeg_cpu = (child1.ru_utime + child1.ru_stime) - (child0.ru_utime + child0.ru_stime)
+            print(f"{scene} {'vfr' if vfr else 'cfr'}: {stats.get('unique', stats['frames'])} encoded frames · "
+                  f"bot CPU {stats['cpu']:.1f}s · ffmpeg CPU {ffmpeg_cpu:.1f}s · {size // 1024} KB")
+
+
+def bench_sysinfo(rounds: int) -> None:
+    """/sysinfo cost: the old uptime/free/df/top forks vs the /proc collector."""
+    legacy = [["uptime", "-p"], ["free", "-h", "--si"],
+              ["df", "-h", "--output=used,size,target", "/"], ["top", "-bn1"]]
+    t0 = time.perf_counter()
+    for _ in range(rounds):
+        for cmd in legacy:
+            run_command(cmd)
+    forks = (time.perf_counter() - t0) / rounds
+
+    get_system_info()  # prime the cached sample, as run() does
+    t0 = time.perf_counter()
+    for _ in range(rounds):
+        get_system_info()
+    native = (time.perf_counter() - t0) / rounds
+
+    print(f"{'4 subprocess forks':<24}{_ms(forks)}")
+    print(f"{'/proc collector':<24}{_ms(native)}")
+
+
+def bench_top(rounds: int) -> None:
+    """Full /proc scan cost for /top, with and without per-process I/O counters."""
+    count = len(processes.scan())
+    for with_io in (False, True):
+        t0 = time.perf_counter()
+        for _ in range(rounds):
+            processes.scan(with_io=with_io)
+        print(f"{count} processes{' + io' if with_io else '':<6}  {_ms((time.perf_counter() - t0) / rounds)}")
+
+
+def bench_windows(rounds: int) -> None:
+    """Window listing: native X11 batch vs wmctrl vs the xdotool per-window forks."""
+    x11 = get_x11()
+    if x11:
+        t0 = time.perf_counter()
+        for _ in range(rounds):
+            count = len(x11.list())
+        print(f"{'X11 (' + str(count) + ' windows)':<28}{_ms((time.perf_counter() - t0) / rounds)}")
+    for label, cmd in (("wmctrl -l", ["wmctrl", "-l"]), ("xdotool search", ["xdotool", "search", "--name", ""])):
+        t0 = time.perf_counter()
+        for _ in range(rounds):
+            out, err = run_command(cmd)
+            if label.startswith("xdotool"):
+                for wid in out.splitlines():
+                    run_command(["xdotool", "getwindowname", wid])
+        print(f"{label:<28}{_ms((time.perf_counter() - t0) / rounds)}{'  (' + err + ')' if err else ''}")
+
+    windows.current()
+    t0 = time.perf_counter()
+    for _ in range(rounds):
+        windows.current()
+    print(f"{'inventory (cached)':<28}{_ms((time.perf_counter() - t0) / rounds)}")
+
+
+def bench_commands(rounds: int) -> None:
+    """Per-command overhead, and N slow commands serial (old path) vs through the runner."""
+    for label, fn in (("subprocess.run", lambda c: subprocess.run(c, capture_output=True, text=True)),
+                      ("CommandRunner", lambda c: commands.run(c))):
+        t0 = time.perf_counter()
+        for _ in range(rounds):
+            fn(["true"])
+        print(f"{label + ' (true)':<28}{_ms((time.perf_counter() - t0) / rounds)}")
+
+    slow = ["sleep", "0.2"]
+    t0 = time.perf_counter()
+    for _ in range(COMMAND_WORKERS):
+        subprocess.run(slow, capture_output=True)
+    print(f"{f'{COMMAND_WORKERS}x sleep 0.2 serial':<28}{_ms(time.perf_counter() - t0)}")
+    t0 = time.perf_counter()
+    for future in [commands.submit(slow) for _ in range(COMMAND_WORKERS)]:
+        future.result()
+    print(f"{f'{COMMAND_WORKERS}x sleep 0.2 runner':<28}{_ms(time.perf_counter() - t0)}")
+
+
+def bench_transport(rounds: int) -> None:
+    """Injected update → handler latency: long polling vs webhook, both against local stand-ins."""
+    import http.client
+    fake = _FakeTelegram()
+    telebot.apihelper.API_URL = fake.api_url
+    handled = threading.Semaphore(0)
+
+    def make_bot(mode: str) -> tuple[DMBot, UpdateLatency]:
+        target = DMBot("0:bench", parse_mode=None, use_class_middlewares=True)
+        meter = UpdateLatency(mode)
+        target.setup_middleware(meter)
+        target.message_handler(commands=["ping"])(lambda m: handled.release())
+        return target, meter
+
+    def measure(inject: Callable[[int], None]) -> list[float]:
+        samples = []
+        for i in range(1, rounds + 1):
+            t0 = time.perf_counter()
+            inject(i)
+            if not handled.acquire(timeout=10):
+                raise RuntimeError("update never reached its handler")
+            samples.append(time.perf_counter() - t0)
+        return sorted(samples)
+
+    def report(label: str, samples: list[float], meter: UpdateLatency) -> None:
+        print(f"{label:<10}injected→handler p50 {_ms(samples[len(samples) // 2])}  "
+              f"max {_ms(samples[-1])}  ·  {meter.describe().split(' (')[0]}")
+
+    polling_bot, meter = make_bot("polling")
+    poller = threading.Thread(target=polling_bot.infinity_polling,
+                              kwargs={"timeout": 30, "long_polling_timeout": 20}, daemon=True)
+    poller.start()
+    samples = measure(lambda i: fake.updates.put(_FakeTelegram.update(i)))
+    report("polling", samples, meter)
+    polling_bot.stop_polling()
+
+    webhook_bot, meter = make_bot("webhook")
+    server = WebhookServer(("127.0.0.1", 0), webhook_bot, "bench-secret", "/hook")
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    conn = http.client.HTTPConnection("127.0.0.1", server.server_port)
+    headers = {"Content-Type": "application/json", "X-Telegram-Bot-Api-Secret-Token": "bench-secret"}
+
+    def post(i: int, secret_headers: dict = headers) -> int:
+        conn.request("POST", "/hook", json.dumps(_FakeTelegram.update(i)), secret_headers)
+        response = conn.getresponse()
+        response.read()
+        return response.status
+
+    samples = measure(post)
+    report("webhook", samples, meter)
+    rejected = post(0, {**headers, "X-Telegram-Bot-Api-Secret-Token": "wrong"})
+    print(f"{'':<10}bad secret token → HTTP {rejected}")
+    server.shutdown()
+    fake.shutdown()
+
+
+def bench_uploads(rounds: int) -> None:
+    """
+    2 MB photo uploads against the local stand-in with 20 ms latency and a
+    failure (drop, 500, 429) injected for every third upload: telebot's
+    per-thread sessions without retries vs the pooled session + UploadManager.
+    """
+    fake = _FakeTelegram(latency=0.02)
+    telebot.apihelper.API_URL = fake.api_url
+    dm.bot = DMBot("0:bench", parse_mode=None)
+    payload = os.urandom(2 * 1024 * 1024)
+    count = rounds * 3
+    logging.disable(logging.CRITICAL)  # kept/retried uploads would flood the table
+    try:
+        for label, session, attempts in (("per-thread, no retry", None, 1),
+                                         ("pooled + retries", make_http_session(), UPLOAD_ATTEMPTS)):
+            telebot.apihelper.session = session
+            with tempfile.TemporaryDirectory() as spool:
+                manager = UploadManager(Path(spool), attempts=attempts, backoff=0.05)
+                fake.connections = 0
+                for i in range(rounds):
+                    fake.failures.put(("drop", "500", "429")[i % 3])
+                t0 = time.perf_counter()
+                with ThreadPoolExecutor(4) as pool:  # fresh threads, so no per-thread session carries over
+                    sent = sum(pool.map(lambda _: manager.send(1, "photo", payload, "bench"), range(count)))
+                elapsed = time.perf_counter() - t0
+            print(f"{label:<22}{sent}/{count} delivered, {manager.kept} kept  {_ms(elapsed)}  "
+                  f"{fake.connections} connections  ·  {manager.describe().split('; ')[1]}")
+    finally:
+        logging.disable(logging.NOTSET)
+        telebot.apihelper.session = None
+        fake.shutdown()
+
+
+def bench_file_ids(rounds: int) -> None:
+    """
+    `rounds` screenshots of an unchanged screen plus one video sent to three
+    chats, against the local stand-in with 20 ms latency: bytes uploaded and
+    time without and with the file_id cache (then reloaded from disk).
+    """
+    fake = _FakeTelegram(latency=0.02)
+    telebot.apihelper.API_URL = fake.api_url
+    telebot.apihelper.session = make_http_session()
+    dm.bot = DMBot("0:bench", parse_mode=None)
+    screenshot = os.urandom(1024 * 1024)
+    video = os.urandom(5 * 1024 * 1024)
+    logging.disable(logging.CRITICAL)  # one log line per upload would flood the table
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            cache_file = Path(tmp) / "file_ids.json"
+            for label, cache in (("no cache", None), ("file_id cache", FileIdCache(cache_file))):
+                manager = UploadManager(Path(tmp) / "spool", file_ids=cache)
+                videos = []
+                for chat in range(3):
+                    videos.append(Path(tmp) / f"video-{chat}.mp4")
+                    videos[-1].write_bytes(video)
+                received = fake.received
+                t0 = time.perf_counter()
+                for _ in range(rounds):
+                    manager.send(1, "photo", screenshot, "bench")
+                for chat, path in enumerate(videos, 1):
+                    manager.send(chat, "video", str(path), "bench")
+                elapsed = time.perf_counter() - t0
+                print(f"{label:<16}{_human(fake.received - received):>10} uploaded  {_ms(elapsed)}"
+                      + (f"  ·  {cache.describe()}" if cache else ""))
+            reloaded = FileIdCache(cache_file)
+            reloaded.load()
+            print(f"{'after restart':<16}{reloaded.describe()}")
+    finally:
+        logging.disable(logging.NOTSET)
+        telebot.apihelper.session = None
+        fake.shutdown()
+
+
+def bench_outbox(rounds: int) -> None:
+    """
+    A burst against the local stand-in, which enforces 3 messages/s per chat
+    with 429s: an alert fanned out `rounds` times to 5 users while a stranger
+    spams a sixth chat, then one reply to a user — sent directly from worker
+    threads vs through the Outbox.
+    """
+    fake = _FakeTelegram(latency=0.02)
+    fake.chat_limit = 3
+    telebot.apihelper.API_URL = fake.api_url
+    telebot.apihelper.session = make_http_session()
+    logging.disable(logging.CRITICAL)  # every 429 would be logged
+    try:
+        for label, paced in (("direct", False), ("outbox", True)):
+            dm.bot = DMBot("0:bench", parse_mode=None, paced=paced)
+            time.sleep(1.1)  # let the stand-in's per-chat windows empty
+            fake.sends = fake.limited = 0
+            burst = [(chat, f"🚨 DM-Bot alert {i}", OUTBOX_NOTIFY) for i in range(rounds) for chat in range(1, 6)]
+            burst += [(6, "🔐 DM-Bot: you are not authorized.", OUTBOX_REJECT)] * (rounds * 4)
+            t0 = time.perf_counter()
+            with ThreadPoolExecutor(16) as pool:
+                futures = [pool.submit(lambda m: dm.bot.send_later(*m).result(), m) for m in burst]
+                time.sleep(0.01)
+                t1 = time.perf_counter()
+                try:
+                    dm.bot.send_message(1, "✅ DM-Bot: reply", OUTBOX_REPLY)
+                    reply = _ms(time.perf_counter() - t1)
+                except telebot.apihelper.ApiTelegramException:
+                    reply = "429".rjust(10)
+                failed = sum(f.exception() is not None for f in futures)
+            print(f"{label:<8}{len(burst) - failed}/{len(burst)} delivered, {failed} lost to 429  "
+                  f"{fake.sends} API calls ({fake.limited} refused)  reply {reply}  "
+                  f"all {_ms(time.perf_counter() - t0)}")
+            if dm.bot.outbox:
+                print(f"{'':<8}{dm.bot.outbox.describe()}")
+    finally:
+        logging.disable(logging.NOTSET)
+        telebot.apihelper.session = None
+        fake.shutdown()
+
+
+def bench_lanes(rounds: int) -> None:
+    """/lock wait behind `rounds` slow screenshot uploads: one shared pool vs handler lanes."""
+    def message(text: str) -> types.Message:
+        return types.Message.de_json(_FakeTelegram.update(1, text)["message"])
+
+    slow = lambda m: time.sleep(0.5)  # a screenshot going out over a slow uplink
+    control_wait = []
+    quick = lambda m: control_wait.append(time.monotonic() - m.queued)
+
+    for label, pool in (("shared pool (2 workers)", HandlerLanes({"default": (2, 0)})),
+                        ("handler lanes", HandlerLanes())):
+        control_wait.clear()
+        for _ in range(rounds):
+            pool.submit(message("/screenshot"), slow)
+        lock = message("/lock")
+        lock.queued = time.monotonic()
+        pool.submit(lock, quick)
+        while not control_wait:
+            time.sleep(0.005)
+        print(f"{label:<28}/lock waited {_ms(control_wait[0])}")
+        for line in pool.describe():
+            print(f"{'':<4}{line}")
+
+
+BENCHMARKS = {
+    "backends":   bench_backends,
+    "capture":    bench_capture,
+    "commands":   bench_commands,
+    "file_ids":   bench_file_ids,
+    "lanes":      bench_lanes,
+    "monitors":   bench_monitors,
+    "outbox":     bench_outbox,
+    "record":     bench_record,
+    "vfr":        bench_vfr,
+    "screenshot": bench_screenshot,
+    "sysinfo":    bench_sysinfo,
+    "top":        bench_top,
+    "transport":  bench_transport,
+    "uploads":    bench_uploads,
+    "windows":    bench_windows,
+}
+
+
+def run_benchmark(name: str, rounds: int) -> None:
+    print(f"DM-Bot v{__version__} — benchmark '{name}' ({rounds} rounds)\n")
+    BENCHMARKS[name](rounds)
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Entry point
+# ─────────────────────────────────────────────────────────────────────────────
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(prog="bench.py", description="DM-Bot benchmarks.")
+    parser.add_argument("name", choices=sorted(BENCHMARKS), help="benchmark to run")
+    parser.add_argument("--rounds", type=int, default=5, help="iterations (default 5)")
+    parser.add_argument("--capture", choices=sorted(CAPTURE_BACKENDS),
+                        help="capture backend, e.g. 'synthetic' to benchmark without a display")
+    cli = parser.parse_args()
+    if cli.capture:
+        dm.CAPTURE_BACKEND = cli.capture
+    run_benchmark(cli.name, max(1, cli.rounds))
@@ -2,27 +2,45 @@ __version__ = "4.26.2.10"
 __app_name__ = "DM-Bot"
 
 import secrets
+import selectors
+import shutil
+import ctypes
+import ctypes.util
 import hashlib
+import hmac
+import io
 import json
 import logging
 import os
+import queue
+import random
 import sys
 import time
 import subprocess
-import tempfile
 import threading
 import signal
+import ssl
+import struct
+from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
-from functools import wraps
-from typing import Optional
+from functools import partial, wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Optional
+from urllib.parse import urlsplit
 
 import mss
 import mss.tools
-import imageio
+import imageio_ffmpeg
 import numpy as np
+import requests
 import telebot
+from PIL import Image, ImageDraw
 from telebot import types
-from requests.exceptions import ConnectionError, ReadTimeout
+from telebot.handler_backends import BaseMiddleware
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ConnectionError, ReadTimeout, RequestException
 
 # ─────────────────────────────────────────────────────────────────────────────
 # Logging
@@ -47,19 +65,132 @@ DATA_DIR.mkdir(parents=True, exist_ok=True)
 
 USER_DATA_FILE = DATA_DIR / "authorized_users.json"
 TOKEN_FILE     = DATA_DIR / "token.enc"
+CAPABILITIES_FILE = DATA_DIR / "capabilities.json"
+CAPABILITIES_FORMAT = 2
 
 ACCESS_CODE_TTL      = 120   # seconds before an access code expires
+COMMAND_WORKERS      = int(os.environ.get("DM_BOT_COMMAND_WORKERS", "4"))  # external commands run at once
+COMMAND_TIMEOUT      = 10          # default seconds before a command's process group is killed
+COMMAND_OUTPUT_MAX   = 64 * 1024   # bytes kept per stream; the rest is read and dropped
 VIDEO_DEFAULT_DURATION = 10  # seconds
 VIDEO_MAX_DURATION   = 60    # cap to prevent abuse
+VIDEO_FPS            = int(os.environ.get("DM_BOT_VIDEO_FPS", "15"))
+RECORD_QUEUE_DEPTH   = int(os.environ.get("DM_BOT_RECORD_QUEUE", "4"))  # frame buffers between capture and ffmpeg
+
+# Size-targeted encoding — /record picks bitrate, resolution and preset to fit the upload cap
+VIDEO_MAX_BYTES      = 50 * 1024 * 1024  # Bot API upload limit
+VIDEO_SIZE_BUDGET    = 0.9               # fraction of the limit aimed for (container overhead)
+VIDEO_MAX_BITRATE    = int(os.environ.get("DM_BOT_VIDEO_MAX_BITRATE", "8000000"))  # bit/s
+VIDEO_MIN_BPP        = 0.05              # bits per pixel below which we downscale instead
+VIDEO_HEIGHTS        = (2160, 1440, 1080, 720, 480, 360)
+VIDEO_MIN_HEIGHT     = 144  # lowest height accepted from `/record <n>p`
+X264_PRESETS         = ("ultrafast", "superfast", "veryfast", "faster", "fast", "medium", "slow")
+
+# Segmented recording — longer /record runs are uploaded in parts while capturing
+VIDEO_MAX_SEGMENTED_DURATION = 1800  # 30 minutes
+SEGMENT_DURATION     = int(os.environ.get("DM_BOT_SEGMENT_DURATION", "15"))  # seconds per part
+SEGMENT_MAX_PENDING  = 4   # finished parts awaiting upload before capture is stopped
+MAX_RECORDINGS       = int(os.environ.get("DM_BOT_MAX_RECORDINGS", "1"))  # concurrent /record jobs
+VIDEO_VFR            = os.environ.get("DM_BOT_VIDEO_VFR", "0") == "1"  # damage-only recording by default
+DAMAGE_ROW_STRIDE    = 4  # rows compared per frame in VFR mode (every 4th row, all columns)
+
+# Instant replay — opt-in low-rate background capture kept in a fixed-size ring
+REPLAY_ENABLED       = os.environ.get("DM_BOT_REPLAY", "0") == "1"
+REPLAY_SECONDS       = int(os.environ.get("DM_BOT_REPLAY_SECONDS", "30"))
+REPLAY_FPS           = int(os.environ.get("DM_BOT_REPLAY_FPS", "5"))
+REPLAY_HEIGHT        = int(os.environ.get("DM_BOT_REPLAY_HEIGHT", "540"))  # upper bound; integer downscale
+REPLAY_MAX_MB        = int(os.environ.get("DM_BOT_REPLAY_MAX_MB", "64"))   # ring buffer ceiling
+
+# Metrics history — background sampler feeding /stats
+STATS_INTERVAL       = int(os.environ.get("DM_BOT_STATS_INTERVAL", "60"))  # seconds per sample
+STATS_HOURS          = int(os.environ.get("DM_BOT_STATS_HOURS", "24"))     # history kept
+
+# Alerts — rules evaluated on every metrics sample, pushed to all authorized users
+ALERTS_FILE          = DATA_DIR / "alerts.json"
+ALERT_COOLDOWN       = 1800  # seconds before the same rule may fire again
+SPARK_CHARS          = "▁▂▃▄▅▆▇█"
+
+WINDOW_CACHE_TTL     = int(os.environ.get("DM_BOT_WINDOW_TTL", "5"))  # seconds, wmctrl/xdotool fallback only
+WINDOW_BUTTONS       = 30  # windows listed under /windows
+
+TOP_DEFAULT          = 10
+TOP_MAX              = 30
+TOP_BUTTONS          = 10  # processes that get kill buttons under /top
+CLK_TCK              = os.sysconf("SC_CLK_TCK")
+PAGE_SIZE            = os.sysconf("SC_PAGE_SIZE")
 MAX_FAILED_ATTEMPTS  = 5     # lockout threshold per session
 LOCKOUT_DURATION     = 300   # 5-minute lockout after brute-force
 
+# Screenshot encoding — overridable per request, e.g. `/screenshot jpeg:70`
+SCREENSHOT_FORMATS   = ("png", "jpeg", "webp")
+SCREENSHOT_FORMAT    = os.environ.get("DM_BOT_SCREENSHOT_FORMAT", "png").lower()
+SCREENSHOT_QUALITY   = int(os.environ.get("DM_BOT_SCREENSHOT_QUALITY", "85"))  # JPEG/WebP 1-100
+SCREENSHOT_PNG_LEVEL = int(os.environ.get("DM_BOT_PNG_LEVEL", "1"))            # zlib 0-9, 1 = fast
+PHOTO_MAX_BYTES      = 10 * 1024 * 1024  # Bot API limit for send_photo
+
+DISPLAY_CHECK_INTERVAL = 2.0  # seconds between monitor hotplug / layout checks
+CAPTURE_BACKEND  = os.environ.get("DM_BOT_CAPTURE_BACKEND", "auto").lower()  # auto|mss|grim|import|xwd|synthetic
+SYNTHETIC_SIZE   = os.environ.get("DM_BOT_SYNTHETIC_SIZE", "1920x1080")      # per synthetic monitor
+SYNTHETIC_MONITORS = int(os.environ.get("DM_BOT_SYNTHETIC_MONITORS", "1"))
+SYNTHETIC_SCENES = ("moving", "idle")  # idle: the box takes one step every SYNTHETIC_IDLE_EVERY grabs
+SYNTHETIC_SCENE  = os.environ.get("DM_BOT_SYNTHETIC_SCENE", "moving").lower()
+SYNTHETIC_IDLE_EVERY = 50
+ENCODE_WORKERS   = min(4, os.cpu_count() or 1)  # parallel per-monitor encodes
+OVERVIEW_MAX_WIDTH = 2560  # stitched `/screenshot overview` is downscaled to this
+ALBUM_MAX_PHOTOS   = 10    # Bot API limit for send_media_group
+
+# Media uploads — one pooled keep-alive session; failed uploads are kept for a retry
+HTTP_POOL_SIZE     = int(os.environ.get("DM_BOT_HTTP_POOL", "16"))  # open connections to the Bot API
+UPLOAD_ATTEMPTS    = int(os.environ.get("DM_BOT_UPLOAD_ATTEMPTS", "4"))
+UPLOAD_BACKOFF     = 1.0    # seconds; attempt n waits up to UPLOAD_BACKOFF * 2**n (full jitter)
+UPLOAD_BACKOFF_MAX = 30.0
+UPLOAD_KEEP        = int(os.environ.get("DM_BOT_UPLOAD_KEEP", "3600"))  # seconds a failed upload is kept
+UPLOAD_DIR         = DATA_DIR / "uploads"
+FILE_ID_CACHE_FILE = DATA_DIR / "file_ids.json"
+FILE_ID_CACHE_SIZE = int(os.environ.get("DM_BOT_FILE_ID_CACHE", "256"))  # uploads remembered; 0 disables
+FILE_ID_CACHE_TTL  = int(os.environ.get("DM_BOT_FILE_ID_TTL", "86400"))  # seconds before re-uploading anyway
+
+# Webhook transport (`dm-bot --webhook [URL]`) — Telegram pushes updates instead of long polling
+WEBHOOK_URL        = os.environ.get("DM_BOT_WEBHOOK_URL", "")  # public HTTPS URL Telegram posts to
+WEBHOOK_LISTEN     = os.environ.get("DM_BOT_WEBHOOK_LISTEN", "127.0.0.1:8443")  # host:port to bind
+WEBHOOK_SECRET     = os.environ.get("DM_BOT_WEBHOOK_SECRET", "")  # random per start if unset
+WEBHOOK_CERT       = os.environ.get("DM_BOT_WEBHOOK_CERT", "")    # serve HTTPS directly with this cert...
+WEBHOOK_KEY        = os.environ.get("DM_BOT_WEBHOOK_KEY", "")     # ...and key; else plain HTTP behind a proxy
+WEBHOOK_SELF_SIGNED = os.environ.get("DM_BOT_WEBHOOK_SELF_SIGNED", "0") == "1"  # upload the cert to Telegram
+WEBHOOK_MAX_BODY   = 1024 * 1024  # bytes; larger requests are refused unread
+LATENCY_REPORT_EVERY = 100        # updates between update→handler latency log lines
+
+# Handler lanes — separate worker pools so slow uploads never delay /lock or /shutdown
+HANDLER_LANES = {  # lane -> (workers, max queued; 0 = unbounded)
+    "control": (int(os.environ.get("DM_BOT_LANE_CONTROL", "2")), 0),
+    "default": (int(os.environ.get("DM_BOT_LANE_DEFAULT", "4")), 0),
+    "media":   (int(os.environ.get("DM_BOT_LANE_MEDIA", "2")), int(os.environ.get("DM_BOT_MEDIA_QUEUE", "8"))),
+}
+COMMAND_LANES = {
+    "start": "control", "help": "control", "version": "control", "auth": "control", "deauth": "control",
+    "lock": "control", "shutdown": "control", "confirm_shutdown": "control", "reboot": "control",
+    "stop": "control", "cleardata": "control",
+    "screenshot": "media", "record": "media", "replay": "media", "stats": "media",
+}
+CALLBACK_LANES = {"rec_stop": "control", "sig": "control", "win": "default", "upl": "media"}
+
+# Outgoing messages — paced under the Bot API limits (~30 msg/s overall, ~1 msg/s per chat)
+OUTBOX_RATE        = float(os.environ.get("DM_BOT_OUTBOX_RATE", "25"))      # messages/s across all chats
+OUTBOX_CHAT_RATE   = float(os.environ.get("DM_BOT_OUTBOX_CHAT_RATE", "1"))  # messages/s per chat...
+OUTBOX_CHAT_BURST  = 3    # ...after a burst of this many
+OUTBOX_SENDERS     = 4    # messages in flight at once (never two for the same chat)
+OUTBOX_ATTEMPTS    = 5    # sends of one message before a 429 is given up on
+OUTBOX_REPLY, OUTBOX_NOTIFY, OUTBOX_REJECT = 0, 1, 2  # priorities: handler replies, background, strangers
+TEXT_MAX_LENGTH    = 4096  # Bot API limit; coalesced messages stay under it
+
 # ─────────────────────────────────────────────────────────────────────────────
 # Globals
 # ─────────────────────────────────────────────────────────────────────────────
 
-bot: Optional[telebot.TeleBot] = None
-VIDEO_RECORDING = False
+bot: Optional["DMBot"] = None
+capture: Optional["CaptureService"] = None
+replay: Optional["ReplayBuffer"] = None
+latency: Optional["UpdateLatency"] = None
 
 # telegram_id -> {"code": hashed, "plain": raw, "issued": timestamp}
 ACCESS_CODES: dict = {}
@@ -70,6 +201,10 @@ AUTHORIZED_USERS: dict = {}
 # telegram_id -> {"count": int, "locked_until": float}
 FAILED_ATTEMPTS: dict = {}
 
+# What this host can do — see discover_capabilities()
+CAPABILITIES: dict = {}
+CAPABILITIES_LOCK = threading.RLock()  # capture thread and handler lanes both update it
+
 # ─────────────────────────────────────────────────────────────────────────────
 # User data persistence
 # ─────────────────────────────────────────────────────────────────────────────
@@ -203,14 +338,25 @@ def clear_access_code(telegram_id: str) -> None:
 # Authorization decorator
 # ─────────────────────────────────────────────────────────────────────────────
 
+def _deny(update, text: str, **kwargs) -> None:
+    """Reject a message with a message to its chat, or a callback query with an alert."""
+    if isinstance(update, types.CallbackQuery):
+        bot.answer_callback_query(update.id, text.replace("*", ""), show_alert=True)
+    else:
+        # Queued behind everyone else's messages and not waited for, so a flood
+        # of strangers cannot tie up the handler lanes. No reply target, so
+        # repeated rejections to one chat collapse into a single send.
+        bot.send_later(update.chat.id, text, OUTBOX_REJECT, **kwargs)
+
+
 def authorized(func):
     @wraps(func)
-    def wrapper(message: types.Message):
+    def wrapper(message):
         tid = str(message.from_user.id)
 
         if is_locked_out(tid):
             remaining = int(FAILED_ATTEMPTS[tid]["locked_until"] - time.time())
-            bot.reply_to(
+            _deny(
                 message,
                 f"⛔ Too many failed attempts. Try again in {remaining}s.",
             )
@@ -218,7 +364,7 @@ def authorized(func):
             return
 
         if not is_authorized(tid):
-            bot.reply_to(
+            _deny(
                 message,
                 "🔐 *DM-Bot:* you are not authorized.\n"
                 "Use /auth to start the authorization process.",
@@ -245,65 +391,1697 @@ def display_access_code_on_console(plain_code: str, telegram_id: str) -> None:
     print(f"\n    {plain_code}\n")
     print(border + "\n")
 
+# ─────────────────────────────────────────────────────────────────────────────
+# Capture service
+# ─────────────────────────────────────────────────────────────────────────────
+
+def _display_signature(backend: "CaptureBackend") -> tuple:
+    """
+    Hotplug and layout fingerprint: DRM connector state from sysfs plus the
+    monitor boxes the backend reads from the display server right now. The
+    connectors alone miss `xrandr --mode/--pos` and are empty under Xvfb,
+    VNC and most VMs.
+    """
+    sig = []
+    for conn in sorted(Path("/sys/class/drm").glob("card*-*")):
+        try:
+            sig.append((conn.name, (conn / "status").read_text().strip(),
+                        (conn / "enabled").read_text().strip()))
+        except OSError:
+            continue
+    boxes = tuple((m["left"], m["top"], m["width"], m["height"]) for m in backend.layout())
+    return tuple(sig), boxes
+
+
+class Frame:
+    """BGRA pixels exposing the parts of an mss ScreenShot the rest of the bot uses."""
+
+    __slots__ = ("width", "height", "size", "raw")
+
+    def __init__(self, pixels: np.ndarray) -> None:
+        self.height, self.width = pixels.shape[:2]
+        self.size = (self.width, self.height)
+        self.raw  = np.ascontiguousarray(pixels).data
+
+
+class CaptureBackend(ABC):
+    """
+    Source of screen pixels. `monitors` follows mss: index 0 is the whole
+    desktop, 1.. are the individual monitors. `grab` takes an mss-style
+    {left, top, width, height} box inside the desktop and returns a
+    ScreenShot-like object (width, height, size, BGRA raw).
+    """
+
+    name = "?"
+
+    @property
+    @abstractmethod
+    def monitors(self) -> list[dict]: ...
+
+    @abstractmethod
+    def grab(self, area: dict): ...
+
+    def layout(self) -> list[dict]:
+        """Current monitor boxes, bypassing any cache; the fixed `monitors` by default."""
+        return self.monitors
+
+    def close(self) -> None:
+        pass
+
+
+class MssBackend(CaptureBackend):
+    """XGetImage/XShm through mss — by far the cheapest option on X11."""
+
+    name = "mss"
+
+    def __init__(self) -> None:
+        self._sct = mss.mss()
+
+    @property
+    def monitors(self) -> list[dict]:
+        return self._sct.monitors
+
+    def grab(self, area: dict):
+        return self._sct.grab(area)
+
+    def layout(self) -> list[dict]:
+        # mss caches its monitor list for the life of the session; a fresh one re-asks XRandR
+        with mss.mss() as probe:
+            return probe.monitors
+
+    def close(self) -> None:
+        self._sct.close()
+
+
+class CommandBackend(CaptureBackend):
+    """
+    One external tool run per grab: grim (Wayland), ImageMagick `import` or
+    `xwd`. A fork plus an image decode per frame, so only picked when mss
+    is unusable. The tools know nothing of monitors, so the whole output is
+    reported as a single monitor.
+    """
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        full = self.grab(None)
+        desktop = {"left": 0, "top": 0, "width": full.width, "height": full.height}
+        self._monitors = [desktop, dict(desktop)]
+
+    @property
+    def monitors(self) -> list[dict]:
+        return self._monitors
+
+    def _command(self, area: Optional[dict]) -> list[str]:
+        if self.name == "grim":
+            box = ["-g", "{left},{top} {width}x{height}".format(**area)] if area else []
+            return ["grim", "-t", "ppm", *box, "-"]
+        if self.name == "import":
+            box = ["-crop", "{width}x{height}+{left}+{top}".format(**area)] if area else []
+            return ["import", "-silent", "-window", "root", *box, "ppm:-"]
+        return ["xwd", "-root", "-silent"]  # no cropping option; cut out below
+
+    @staticmethod
+    def _decode_xwd(data: bytes) -> np.ndarray:
+        header = struct.unpack(">25I", data[:100])
+        header_size, _, pixmap_format, _, width, height, _, byte_order = header[:8]
+        bits_per_pixel, bytes_per_line, ncolors = header[11], header[12], header[19]
+        if pixmap_format != 2 or bits_per_pixel != 32:
+            raise RuntimeError(f"unsupported xwd image ({bits_per_pixel} bpp, format {pixmap_format})")
+        rows = np.frombuffer(data, np.uint8, bytes_per_line * height, header_size + ncolors * 12)
+        pixels = rows.reshape(height, bytes_per_line)[:, :width * 4].reshape(height, width, 4)
+        return pixels[..., ::-1] if byte_order == 1 else pixels  # MSBFirst is XRGB
+
+    def grab(self, area: Optional[dict]):
+        data, err = commands.run_binary(self._command(area), timeout=10)
+        if not data:
+            raise RuntimeError(f"{self.name}: {err or 'no output'}")
+        if self.name == "xwd":
+            pixels = self._decode_xwd(data)
+            if area:
+                pixels = pixels[area["top"]:area["top"] + area["height"],
+                                area["left"]:area["left"] + area["width"]]
+            return Frame(pixels)
+        rgb = np.asarray(Image.open(io.BytesIO(data)).convert("RGB"))
+        bgra = np.empty(rgb.shape[:2] + (4,), np.uint8)
+        bgra[..., :3] = rgb[..., ::-1]
+        bgra[..., 3] = 255
+        return Frame(bgra)
+
+
+class SyntheticBackend(CaptureBackend):
+    """
+    In-memory frame generator for benchmarks on headless machines and CI.
+    Every frame is a fixed patterned desktop with a box that moves one step
+    per grab ("moving") or one step every SYNTHETIC_IDLE_EVERY grabs ("idle",
+    a mostly still screen), so content — and with it encode cost and output
+    size — is the same on every run.
+    """
+
+    name = "synthetic"
+
+    def __init__(self, size: str = SYNTHETIC_SIZE, count: int = SYNTHETIC_MONITORS,
+                 scene: str = SYNTHETIC_SCENE) -> None:
+        if scene not in SYNTHETIC_SCENES:
+            raise ValueError(f"unknown synthetic scene {scene!r}, expected one of {', '.join(SYNTHETIC_SCENES)}")
+        self._every = SYNTHETIC_IDLE_EVERY if scene == "idle" else 1
+        width, height = (int(v) for v in size.lower().split("x"))
+        count = max(1, count)
+        self._monitors = [{"left": 0, "top": 0, "width": width * count, "height": height}]
+        self._monitors += [{"left": width * i, "top": 0, "width": width, "height": height} for i in range(count)]
+
+        y, x = np.mgrid[0:height, 0:width * count]
+        self._desktop = np.empty((height, width * count, 4), np.uint8)
+        self._desktop[..., 0] = x * 255 // max(1, width * count - 1)
+        self._desktop[..., 1] = y * 255 // max(1, height - 1)
+        self._desktop[..., 2] = np.where((x // 64 + y // 64) % 2, 200, 40)  # window-like tiles
+        self._desktop[..., 3] = 255
+        # Text-like detail so encoders have some high-frequency content to chew on
+        detail = self._desktop[::16, ::8, 1]
+        detail[:] = np.random.default_rng(0).integers(0, 2, detail.shape, dtype=np.uint8) * 255
+        self._frame = 0
+
+    @property
+    def monitors(self) -> list[dict]:
+        return self._monitors
+
+    def grab(self, area: dict):
+        top, left = area["top"], area["left"]
+        pixels = self._desktop[top:top + area["height"], left:left + area["width"]].copy()
+        # 160 px box bouncing across the desktop, one step per frame (or per `_every` frames)
+        desk_h, desk_w = self._desktop.shape[:2]
+        span_x, span_y = max(1, desk_w - 160), max(1, desk_h - 160)
+        step = self._frame // self._every
+        bx = abs((step * 24) % (2 * span_x) - span_x)
+        by = abs((step * 14) % (2 * span_y) - span_y)
+        self._frame += 1
+        x0, y0 = max(bx - left, 0), max(by - top, 0)
+        x1, y1 = min(bx + 160 - left, pixels.shape[1]), min(by + 160 - top, pixels.shape[0])
+        if x0 < x1 and y0 < y1:
+            pixels[y0:y1, x0:x1, :3] = (40, 220, 255)
+        return Frame(pixels)
+
+
+CAPTURE_BACKENDS: dict[str, Callable[[], CaptureBackend]] = {
+    "mss":       MssBackend,
+    "grim":      lambda: CommandBackend("grim"),
+    "import":    lambda: CommandBackend("import"),
+    "xwd":       lambda: CommandBackend("xwd"),
+    "synthetic": SyntheticBackend,
+}
+X11_CAPTURE = ("mss", "xwd", "import")  # under Wayland these only see XWayland clients
+
+
+def _is_blank(frame) -> bool:
+    """True for a frame of one colour, such as the black XWayland root window."""
+    pixels = np.frombuffer(frame.raw, dtype=np.uint32)[::97] & 0x00FFFFFF  # sampled, alpha ignored
+    return bool((pixels == pixels[0]).all())
+
+
+def select_capture_backend() -> str:
+    """
+    DM_BOT_CAPTURE_BACKEND if set, else the fastest backend this host offers:
+    each candidate grabs monitor 1 once and the quickest one whose frame is
+    not blank wins. On Wayland, grim beats the X11 backends whatever their
+    speed. The choice is kept with the host capabilities, so the race only
+    runs after a change.
+    """
+    if CAPTURE_BACKEND in CAPTURE_BACKENDS:
+        return CAPTURE_BACKEND
+    if CAPTURE_BACKEND != "auto":
+        log.warning("DM-Bot: unknown capture backend '%s' — picking one automatically.", CAPTURE_BACKEND)
+    caps = get_capabilities()
+    if caps.get("capture_backend") in caps["capture"]:
+        return caps["capture_backend"]
+
+    timings, blank = {}, set()
+    for name in caps["capture"]:
+        backend = None
+        try:
+            t0 = time.perf_counter()
+            backend = CAPTURE_BACKENDS[name]()
+            frame = backend.grab(backend.monitors[1])
+            timings[name] = time.perf_counter() - t0
+            if _is_blank(frame):
+                blank.add(name)
+        except Exception as exc:
+            log.info("DM-Bot: capture backend %s unusable (%s).", name, exc)
+        finally:
+            if backend is not None:
+                backend.close()
+    if not timings:
+        return "mss"  # let the first grab report the real problem
+    usable = [name for name in timings if name not in blank] or list(timings)
+    if caps["session"] == "wayland":
+        usable = [name for name in usable if name not in X11_CAPTURE] or usable
+    choice = min(usable, key=timings.get)
+    log.info("DM-Bot: capture backend %s (%s).", choice,
+             ", ".join(f"{n} {t * 1000:.0f} ms{' blank' if n in blank else ''}"
+                       for n, t in sorted(timings.items(), key=lambda kv: kv[1])))
+    update_capabilities(capture_backend=choice)
+    return choice
+
+
+class CaptureService:
+    """
+    Long-lived screen grabber. One capture backend (for mss, one X
+    connection) lives on a dedicated thread, so every caller is serialized
+    through it and the session is never shared across threads. Monitor
+    geometry is cached and the session is rebuilt when a hotplug is
+    detected or a grab fails.
+    """
+
+    def __init__(self, backend: Optional[str] = None) -> None:
+        self._executor  = ThreadPoolExecutor(max_workers=1, thread_name_prefix="dm-bot-capture")
+        self.backend    = backend
+        self._sct       = None
+        self._signature = None
+        self._checked   = 0.0
+
+    # -- owner-thread internals ------------------------------------------------
+
+    def _reset(self) -> None:
+        if self._sct is not None:
+            try:
+                self._sct.close()
+            except Exception:
+                pass
+        self._sct = None
+
+    def _session(self):
+        now = time.monotonic()
+        if self._sct is not None and now - self._checked >= DISPLAY_CHECK_INTERVAL:
+            self._checked = now
+            if _display_signature(self._sct) != self._signature:
+                log.info("DM-Bot: display layout changed — refreshing monitors.")
+                self._reset()
+        if self._sct is None:
+            if self.backend is None:
+                self.backend = select_capture_backend()
+            self._sct       = CAPTURE_BACKENDS[self.backend]()
+            self._signature = _display_signature(self._sct)
+            self._checked   = now
+        return self._sct
+
+    @staticmethod
+    def _area(sct, target) -> dict:
+        """A monitor index, or a desktop rectangle clipped to the screen."""
+        if isinstance(target, int):
+            return sct.monitors[target]
+        desktop = sct.monitors[0]
+        left    = max(target["left"], desktop["left"])
+        top     = max(target["top"], desktop["top"])
+        right   = min(target["left"] + target["width"], desktop["left"] + desktop["width"])
+        bottom  = min(target["top"] + target["height"], desktop["top"] + desktop["height"])
+        if right <= left or bottom <= top:
+            raise ValueError("region is outside the screen")
+        return {"left": left, "top": top, "width": right - left, "height": bottom - top}
+
+    def _grab(self, target):
+        try:
+            sct = self._session()
+            return sct.grab(self._area(sct, target))
+        except (IndexError, KeyError, ValueError):
+            raise
+        except Exception:
+            # Stale geometry or a dropped X connection: reconnect and retry once
+            self._reset()
+            sct = self._session()
+            return sct.grab(self._area(sct, target))
+
+    def _grab_array(self, monitor: int, out: Optional[np.ndarray]) -> np.ndarray:
+        sct_img = self._grab(monitor)
+        shape = (sct_img.height, sct_img.width, 4)
+        src = np.frombuffer(sct_img.raw, dtype=np.uint8).reshape(shape)
+        if out is None or out.shape != shape:
+            return src.copy()
+        np.copyto(out, src)
+        return out
+
+    # -- public API (any thread) ----------------------------------------------
+
+    def monitors(self) -> list[dict]:
+        """All monitors as mss reports them; index 0 is the whole desktop."""
+        return self._executor.submit(lambda: list(self._session().monitors)).result()
+
+    def grab(self, monitor: int = 1):
+        """Raw mss ScreenShot of `monitor`."""
+        return self._executor.submit(self._grab, monitor).result()
+
+    def grab_image(self, monitor: int = 1) -> Image.Image:
+        return _to_image(self.grab(monitor))
+
+    def grab_region(self, region: dict) -> Image.Image:
+        """Only the pixels of `region` ({left, top, width, height} in desktop coordinates)."""
+        return _to_image(self._executor.submit(self._grab, region).result())
+
+    def grab_images(self, monitors: list[int]) -> list[Image.Image]:
+        """Grab several monitors back to back in a single hop to the capture thread."""
+        shots = self._executor.submit(lambda: [self._grab(m) for m in monitors]).result()
+        return [_to_image(shot) for shot in shots]
+
+    def grab_array(self, monitor: int = 1, out: Optional[np.ndarray] = None) -> np.ndarray:
+        """BGRA frame as an (h, w, 4) array, written into `out` when its shape still fits."""
+        return self._executor.submit(self._grab_array, monitor, out).result()
+
+    def close(self) -> None:
+        self._executor.submit(self._reset).result()
+        self._executor.shutdown(wait=False)
+
+
+def _to_image(sct_img) -> Image.Image:
+    return Image.frombuffer("RGB", sct_img.size, sct_img.raw, "raw", "BGRX", 0, 1)
+
+
+def get_capture() -> CaptureService:
+    """The capture service created by run(); created on demand for benchmarks."""
+    global capture
+    if capture is None:
+        capture = CaptureService()
+    return capture
+
 # ─────────────────────────────────────────────────────────────────────────────
 # Screenshot
 # ─────────────────────────────────────────────────────────────────────────────
 
-def take_screenshot() -> tuple[Optional[str], Optional[str]]:
+encode_pool = ThreadPoolExecutor(max_workers=ENCODE_WORKERS, thread_name_prefix="dm-bot-encode")
+
+
+def grab_screen(monitor: int = 1) -> Image.Image:
+    """Grab one monitor into an RGB image without touching the disk."""
+    return get_capture().grab_image(monitor)
+
+
+def encode_image(img: Image.Image, fmt: str = SCREENSHOT_FORMAT,
+                 quality: Optional[int] = None) -> bytes:
+    """Encode an image in memory. `quality` is the zlib level for PNG, 1-100 otherwise."""
+    buf = io.BytesIO()
+    if fmt == "png":
+        level = SCREENSHOT_PNG_LEVEL if quality is None else quality
+        img.save(buf, format="PNG", compress_level=max(0, min(level, 9)))
+    elif fmt == "jpeg":
+        q = SCREENSHOT_QUALITY if quality is None else quality
+        img.save(buf, format="JPEG", quality=max(1, min(q, 100)))
+    elif fmt == "webp":
+        q = SCREENSHOT_QUALITY if quality is None else quality
+        img.save(buf, format="WEBP", quality=max(1, min(q, 100)), method=2)
+    else:
+        raise ValueError(f"unsupported format '{fmt}'")
+    return buf.getvalue()
+
+
+def parse_image_format(arg: str) -> Optional[tuple[str, Optional[int]]]:
+    """Parse `png`, `jpeg:70`, `webp:50`... Returns None if `arg` is not a format spec."""
+    name, _, level = arg.lower().partition(":")
+    name = "jpeg" if name == "jpg" else name
+    if name not in SCREENSHOT_FORMATS:
+        return None
+    if not level:
+        return name, None
+    return (name, int(level)) if level.isdigit() else None
+
+
+def monitor_count() -> int:
+    return len(get_capture().monitors()) - 1
+
+
+def take_screenshot(fmt: str = SCREENSHOT_FORMAT, quality: Optional[int] = None,
+                    monitor: int = 1) -> tuple[Optional[bytes], Optional[str]]:
+    try:
+        if monitor < 1:
+            raise IndexError(monitor)
+        return encode_image(grab_screen(monitor), fmt, quality), None
+    except IndexError:
+        return None, f"DM-Bot: no monitor {monitor} (found {monitor_count()})."
+    except Exception as exc:
+        return None, f"DM-Bot screenshot error: {exc}"
+
+
+def take_screenshots(fmt: str = SCREENSHOT_FORMAT,
+                     quality: Optional[int] = None) -> tuple[Optional[list[bytes]], Optional[str]]:
+    """One encoded image per monitor. Grabs are cheap; the encodes run in parallel."""
     try:
-        with mss.mss() as sct:
-            monitor = sct.monitors[1]
-            sct_img = sct.grab(monitor)
-            outfile = str(DATA_DIR / f"dm-bot-screenshot-{int(time.time())}.png")
-            mss.tools.to_png(sct_img.rgb, sct_img.size, output=outfile)
-            return outfile, None
+        images = get_capture().grab_images(list(range(1, monitor_count() + 1)))
+        return list(encode_pool.map(lambda img: encode_image(img, fmt, quality), images)), None
     except Exception as exc:
         return None, f"DM-Bot screenshot error: {exc}"
 
+
+def take_overview(fmt: str = SCREENSHOT_FORMAT,
+                  quality: Optional[int] = None) -> tuple[Optional[bytes], Optional[str]]:
+    """All monitors stitched by their desktop position and downscaled into one image."""
+    try:
+        cap      = get_capture()
+        monitors = cap.monitors()
+        desktop  = monitors[0]
+        scale    = min(1.0, OVERVIEW_MAX_WIDTH / desktop["width"])
+        images   = cap.grab_images(list(range(1, len(monitors))))
+
+        def shrink(img: Image.Image) -> Image.Image:
+            size = (max(1, round(img.width * scale)), max(1, round(img.height * scale)))
+            return img.resize(size, Image.BILINEAR, reducing_gap=2.0) if scale < 1 else img
+
+        canvas = Image.new("RGB", (round(desktop["width"] * scale), round(desktop["height"] * scale)))
+        for mon, small in zip(monitors[1:], encode_pool.map(shrink, images)):
+            canvas.paste(small, (round((mon["left"] - desktop["left"]) * scale),
+                                 round((mon["top"] - desktop["top"]) * scale)))
+        return encode_image(canvas, fmt, quality), None
+    except Exception as exc:
+        return None, f"DM-Bot screenshot error: {exc}"
+
+
+def parse_region(arg: str) -> Optional[dict]:
+    """Parse `x,y,w,h` into an mss bounding box. Returns None if malformed."""
+    parts = arg.split(",")
+    if len(parts) != 4 or not all(p.strip().lstrip("-").isdigit() for p in parts):
+        return None
+    x, y, w, h = (int(p) for p in parts)
+    if w <= 0 or h <= 0:
+        return None
+    return {"left": x, "top": y, "width": w, "height": h}
+
+
+def take_region(region: dict, fmt: str = SCREENSHOT_FORMAT,
+                quality: Optional[int] = None) -> tuple[Optional[bytes], Optional[str]]:
+    """Grab and encode just one rectangle, so cost scales with its area, not the desktop's."""
+    try:
+        return encode_image(get_capture().grab_region(region), fmt, quality), None
+    except ValueError as exc:
+        return None, f"DM-Bot: {exc}."
+    except Exception as exc:
+        return None, f"DM-Bot screenshot error: {exc}"
+
+
+def resolve_window(spec: str) -> Optional[dict]:
+    """A window by ID (`0x3a00007` or decimal) or, failing that, by title substring."""
+    wins = windows.current()
+    try:
+        wid = int(spec, 0)
+    except ValueError:
+        wid = None
+    if wid is not None and (window := windows.get(wid)) is not None:
+        return window
+    needle = spec.lower()
+    return next((w for w in wins if needle in w["title"].lower()), None)
+
+
+def take_window_screenshot(spec: str, fmt: str = SCREENSHOT_FORMAT, quality: Optional[int] = None
+                           ) -> tuple[Optional[bytes], Optional[dict], Optional[str]]:
+    """Screenshot of one window's on-screen rectangle. Returns (data, window, err)."""
+    window = resolve_window(spec)
+    if window is None:
+        return None, None, f"DM-Bot: no window matching '{spec}'."
+    if window["width"] is None:
+        return None, window, "DM-Bot: window geometry unknown — install wmctrl or run under X11."
+    region = {k: window[k] for k in ("width", "height")}
+    region.update(left=window["x"], top=window["y"])
+    data, err = take_region(region, fmt, quality)
+    return data, window, err
+
 # ─────────────────────────────────────────────────────────────────────────────
 # Screen recording
 # ─────────────────────────────────────────────────────────────────────────────
 
-def record_screen(duration: int = VIDEO_DEFAULT_DURATION) -> tuple[Optional[str], Optional[str]]:
-    global VIDEO_RECORDING
-    duration = max(1, min(duration, VIDEO_MAX_DURATION))
-    VIDEO_RECORDING = True
-    outfile = str(DATA_DIR / f"dm-bot-record-{int(time.time())}.mp4")
-    try:
-        with mss.mss() as sct:
-            monitor = sct.monitors[1]
-            writer  = imageio.get_writer(
-                outfile, fps=15, codec="libx264",
-                output_params=["-crf", "28"],
+class FrameClock:
+    """
+    Paces a capture loop at a fixed rate. Each output slot is due at
+    start + n / fps; the loop sleeps until the next slot, and when a capture
+    overruns, the slots it missed are filled by repeating the last frame so
+    the output duration always matches the wall-clock duration.
+    """
+
+    def __init__(self, fps: int, total_frames: int) -> None:
+        self.interval  = 1.0 / fps
+        self.total     = total_frames
+        self.written   = 0   # output slots filled
+        self.captured  = 0   # fresh frames grabbed
+        self.start     = time.monotonic()
+        self._cpu0     = time.process_time()
+
+    @property
+    def done(self) -> bool:
+        return self.written >= self.total
+
+    def wait(self) -> None:
+        delay = self.start + self.written * self.interval - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    def tick(self) -> int:
+        """Account for one fresh frame; return how many copies of it to write."""
+        self.captured += 1
+        due = int((time.monotonic() - self.start) / self.interval) + 1
+        copies = max(1, min(due - self.written, self.total - self.written))
+        self.written += copies
+        return copies
+
+    def stats(self) -> dict:
+        elapsed = max(time.monotonic() - self.start, 1e-6)
+        return {
+            "frames":   self.written,
+            "captured": self.captured,
+            "dropped":  self.written - self.captured,
+            "fps":      self.captured / elapsed,
+            "cpu":      time.process_time() - self._cpu0,
+        }
+
+
+class FrameEncoder:
+    """
+    Encoding half of the recording pipeline. A worker thread pipes raw BGRA
+    frames into ffmpeg while the caller keeps capturing. Frames live in a
+    fixed pool of `depth` reusable buffers: the capture side fills a free
+    buffer, submits it, and gets it back once ffmpeg has consumed it, so
+    memory is bounded and no per-frame array is allocated or converted.
+    """
+
+    def __init__(self, path: str, size: tuple[int, int], fps: int,
+                 output_params: list[str], depth: int = RECORD_QUEUE_DEPTH) -> None:
+        self.path   = path
+        self.size   = size
+        self.fps    = fps
+        self.error: Optional[Exception] = None
+        self._output_params = output_params
+        self._depth   = max(1, depth)
+        self._buffers = 0
+        self._free    = queue.Queue()
+        self._pending = queue.Queue()
+        self._thread  = threading.Thread(target=self._run, name="dm-bot-encoder", daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        gen = None
+        try:
+            gen = imageio_ffmpeg.write_frames(
+                self.path, self.size, pix_fmt_in="bgra", fps=self.fps,
+                codec="libx264", quality=None, output_params=self._output_params,
+                macro_block_size=1, ffmpeg_log_level="error",
             )
-            start = time.time()
-            while time.time() - start < duration and VIDEO_RECORDING:
-                frame = np.array(sct.grab(monitor))
-                writer.append_data(frame[:, :, [2, 1, 0]])  # BGRA → RGB
-            writer.close()
-        return outfile, None
+            gen.send(None)
+            while (item := self._pending.get()) is not None:
+                buf, copies = item
+                for _ in range(copies):
+                    gen.send(buf)
+                self._free.put(buf)
+        except Exception as exc:
+            self.error = exc
+            # Keep recycling buffers so the capture side never blocks on a dead encoder
+            while (item := self._pending.get()) is not None:
+                self._free.put(item[0])
+        finally:
+            if gen is not None:
+                gen.close()
+
+    def acquire(self) -> np.ndarray:
+        """A free (h, w, 4) frame buffer; blocks while all `depth` buffers are queued."""
+        if self.error:
+            raise self.error
+        try:
+            return self._free.get_nowait()
+        except queue.Empty:
+            if self._buffers < self._depth:
+                self._buffers += 1
+                return np.empty((self.size[1], self.size[0], 4), dtype=np.uint8)
+        return self._free.get()
+
+    def submit(self, buf: np.ndarray, copies: int = 1) -> None:
+        self._pending.put((buf, copies))
+
+    def release(self, buf: np.ndarray) -> None:
+        """Return an acquired buffer without encoding it."""
+        self._free.put(buf)
+
+    def close(self) -> None:
+        """Flush queued frames, wait for ffmpeg to finish, re-raise encoder errors."""
+        self._pending.put(None)
+        self._thread.join()
+        if self.error:
+            raise self.error
+
+
+def plan_encoding(duration: int, size: tuple[int, int], fps: int,
+                  height: Optional[int] = None, preset: Optional[str] = None) -> dict:
+    """
+    Choose bitrate, output size and x264 preset so a `duration`-second clip
+    fits VIDEO_MAX_BYTES. The rate is capped with VBV (maxrate/bufsize), so
+    the file can exceed bitrate * duration by at most one buffer.
+    """
+    budget_bits = VIDEO_MAX_BYTES * VIDEO_SIZE_BUDGET * 8
+    bitrate = int(min(VIDEO_MAX_BITRATE, budget_bits / (duration + 1)))  # +1 s for the VBV buffer
+
+    w, h = size
+    if height is None:
+        # Largest standard height that still gets enough bits per pixel
+        candidates = [c for c in VIDEO_HEIGHTS if c < h]
+        height = h
+        for cand in [h] + candidates:
+            height = cand
+            if bitrate / (cand * cand * w / h * fps) >= VIDEO_MIN_BPP:
+                break
+    height = min(height, h) // 2 * 2
+    width  = round(w * height / h / 2) * 2
+
+    if preset is None:
+        # Spend CPU only where the host can afford it while keeping up with capture
+        per_core = width * height * fps / (os.cpu_count() or 1)
+        preset = ("ultrafast" if per_core > 20e6 else
+                  "superfast" if per_core > 8e6 else
+                  "veryfast"  if per_core > 3e6 else "faster")
+    return {"bitrate": bitrate, "width": width, "height": height, "preset": preset}
+
+
+def encoder_params(plan: dict) -> list[str]:
+    return [
+        "-preset",  plan["preset"],
+        "-b:v",     str(plan["bitrate"]),
+        "-maxrate", str(plan["bitrate"]),
+        "-bufsize", str(plan["bitrate"]),
+        "-vf",      f"scale={plan['width']}:{plan['height']}",
+    ]
+
+
+def fit_video(path: str, duration: float) -> Optional[str]:
+    """Re-encode `path` in place if it is over the upload limit. Returns an error or None."""
+    size = Path(path).stat().st_size
+    if size <= VIDEO_MAX_BYTES:
+        return None
+    bitrate = int(VIDEO_MAX_BYTES * VIDEO_SIZE_BUDGET * 8 / (duration + 1) * VIDEO_MAX_BYTES / size)
+    log.warning("DM-Bot: %s is %d MB — re-encoding at %d kbit/s.", path, size >> 20, bitrate // 1000)
+    tmp = f"{path}.fit.mp4"
+    _, err = run_command([
+        imageio_ffmpeg.get_ffmpeg_exe(), "-y", "-loglevel", "error", "-i", path,
+        "-c:v", "libx264", "-preset", "veryfast", "-b:v", str(bitrate),
+        "-maxrate", str(bitrate), "-bufsize", str(bitrate), tmp,
+    ], timeout=max(60, int(duration) * 4))
+    if err or not Path(tmp).exists():
+        Path(tmp).unlink(missing_ok=True)
+        return f"DM-Bot: recording too large to upload ({err or 'ffmpeg failed'})."
+    Path(tmp).replace(path)
+    size = Path(path).stat().st_size
+    if size > VIDEO_MAX_BYTES:
+        return (f"DM-Bot: recording still {size / 2**20:.0f} MB after re-encoding — over the "
+                f"{VIDEO_MAX_BYTES >> 20} MB upload limit.")
+    return None
+
+
+class DamageTracker:
+    """
+    Cheap "has anything changed?" test for VFR recording. Every
+    DAMAGE_ROW_STRIDE-th row of the frame is compared with the same rows of
+    the last frame that was kept; a one-pixel-wide caret still spans
+    several sampled rows, while the comparison touches a fraction of memory.
+    """
+
+    def __init__(self) -> None:
+        self._last: Optional[np.ndarray] = None
+
+    def changed(self, frame: np.ndarray) -> bool:
+        rows = frame[::DAMAGE_ROW_STRIDE]
+        if self._last is not None and self._last.shape == rows.shape:
+            if np.array_equal(rows, self._last):
+                return False
+            np.copyto(self._last, rows)
+        else:
+            self._last = rows.copy()
+        return True
+
+
+_MP4_CONTAINERS = {b"moov", b"trak", b"mdia", b"minf", b"stbl", b"edts"}
+
+
+def _mp4_boxes(data: bytes, start: int, end: int):
+    """Yield (type, offset, header_len, size) for the boxes in data[start:end]."""
+    pos = start
+    while pos + 8 <= end:
+        size, kind = struct.unpack_from(">I4s", data, pos)
+        header = 8
+        if size == 1:
+            size, header = struct.unpack_from(">Q", data, pos + 8)[0], 16
+        elif size == 0:
+            size = end - pos
+        yield kind, pos, header, size
+        pos += size
+
+
+def retime_mp4(path: str, holds: list[int]) -> bool:
+    """
+    Turn a CFR MP4 of unique frames into VFR by rewriting its time-to-sample
+    table: sample n lasts holds[n] frame intervals. Only the moov box is
+    rewritten; ffmpeg places it after mdat, so chunk offsets stay valid.
+    Expects a single video track without B-frames. Returns False (file left
+    unchanged) if it does not look like that.
+    """
+    kinds, moov, moov_at = [], b"", 0
+    end = os.path.getsize(path)
+    with open(path, "rb") as f:
+        pos = 0
+        while pos + 8 <= end:  # walk top-level headers only; mdat is never read
+            f.seek(pos)
+            size, kind = struct.unpack(">I4s", f.read(8))
+            if size == 1:
+                size = struct.unpack(">Q", f.read(8))[0]
+            elif size == 0:
+                size = end - pos
+            if size < 8:
+                return False
+            kinds.append(kind)
+            if kind == b"moov":
+                f.seek(pos)
+                moov, moov_at = f.read(size), pos
+            pos += size
+    if b"moov" not in kinds or b"mdat" not in kinds or kinds.index(b"moov") < kinds.index(b"mdat"):
+        return False
+
+    info: dict = {}
+
+    def scan(start: int, end: int) -> None:
+        for kind, pos, header, size in _mp4_boxes(moov, start, end):
+            body = moov[pos + header:pos + size]
+            if kind in _MP4_CONTAINERS:
+                scan(pos + header, pos + size)
+            elif kind in (b"mvhd", b"mdhd"):
+                info[kind] = struct.unpack_from(">I", body, 20 if body[0] == 1 else 12)[0]
+            elif kind == b"stts":
+                runs = [struct.unpack_from(">II", body, 8 + 8 * i)
+                        for i in range(struct.unpack_from(">I", body, 4)[0])]
+                info["samples"] = sum(n for n, _ in runs)
+                info["delta"]   = runs[0][1] if runs else 0
+
+    def set_duration(body: bytearray, v0_at: int, v1_at: int, value: int) -> None:
+        if body[0] == 1:
+            struct.pack_into(">Q", body, v1_at, value)
+        else:
+            struct.pack_into(">I", body, v0_at, min(value, 0xFFFFFFFF))
+
+    def stts() -> bytes:
+        runs: list[list[int]] = []
+        for hold in holds:
+            if runs and runs[-1][1] == hold * info["delta"]:
+                runs[-1][0] += 1
+            else:
+                runs.append([1, hold * info["delta"]])
+        return struct.pack(">II", 0, len(runs)) + b"".join(struct.pack(">II", *r) for r in runs)
+
+    def rebuild(start: int, end: int) -> bytes:
+        out = []
+        for kind, pos, header, size in _mp4_boxes(moov, start, end):
+            body = bytearray(moov[pos + header:pos + size])
+            if kind in _MP4_CONTAINERS:
+                body = rebuild(pos + header, pos + size)
+            elif kind == b"stts":
+                body = stts()
+            elif kind == b"mdhd":
+                set_duration(body, 16, 24, media_ticks)
+            elif kind == b"mvhd":
+                set_duration(body, 16, 24, movie_ticks)
+            elif kind == b"tkhd":
+                set_duration(body, 20, 28, movie_ticks)
+            elif kind == b"elst" and struct.unpack_from(">I", body, 4)[0] == 1:
+                set_duration(body, 8, 8, movie_ticks)
+            out.append(struct.pack(">I4s", 8 + len(body), kind) + bytes(body))
+        return b"".join(out)
+
+    try:
+        scan(0, len(moov))
+        if info.get("samples") != len(holds) or not info.get("delta"):
+            raise ValueError(f"{info.get('samples')} samples for {len(holds)} frames")
+        media_ticks = sum(holds) * info["delta"]
+        movie_ticks = media_ticks * info[b"mvhd"] // info[b"mdhd"]
+        new_moov = rebuild(0, len(moov))
+    except (ValueError, KeyError, struct.error) as exc:
+        log.warning("DM-Bot: could not retime %s — %s", path, exc)
+        return False
+    with open(path, "r+b") as f:
+        f.seek(moov_at)
+        f.write(new_moov)
+        f.truncate()
+    return True
+
+
+def segment_params(seconds: int, list_file: Path) -> list[str]:
+    """ffmpeg segment muxer: a keyframe every `seconds`, finished parts appended to `list_file`."""
+    return [
+        "-force_key_frames", f"expr:gte(t,n_forced*{seconds})",
+        "-f", "segment", "-segment_time", str(seconds), "-segment_format", "mp4",
+        "-reset_timestamps", "1",
+        "-segment_list", str(list_file), "-segment_list_type", "flat",
+    ]
+
+
+class SegmentUploader:
+    """
+    Follows ffmpeg's segment list and hands each finished part to `send`
+    while capture continues. A part is deleted once it has been sent (or
+    moved aside by UploadManager if it could not be), so disk use is
+    bounded by the upload backlog (`pending`).
+    """
+
+    POLL_INTERVAL = 0.5
+
+    def __init__(self, list_file: Path, seconds: int, send: Callable[[str, int], None]) -> None:
+        self.list_file = list_file
+        self.seconds   = seconds
+        self.send      = send
+        self.sent      = 0
+        self.pending   = 0
+        self._stop     = threading.Event()
+        self._thread   = threading.Thread(target=self._run, name="dm-bot-uploader", daemon=True)
+        self._thread.start()
+
+    def _finished(self) -> list[str]:
+        try:
+            return self.list_file.read_text().split()
+        except FileNotFoundError:
+            return []
+
+    def _drain(self) -> None:
+        names = self._finished()
+        self.pending = len(names) - self.sent
+        for name in names[self.sent:]:
+            path = str(self.list_file.parent / name)
+            try:
+                err = fit_video(path, self.seconds)
+                if err:
+                    log.error("DM-Bot: segment %s skipped — %s", name, err)
+                else:
+                    self.send(path, self.sent + 1)
+            except Exception as exc:
+                log.error("DM-Bot: segment %s upload failed — %s", name, exc)
+            finally:
+                Path(path).unlink(missing_ok=True)
+                self.sent   += 1
+                self.pending = len(names) - self.sent
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.POLL_INTERVAL):
+            self._drain()
+
+    def close(self) -> None:
+        """Upload whatever ffmpeg finished after the encoder was closed, then stop."""
+        self._stop.set()
+        self._thread.join()
+        self._drain()
+        self.list_file.unlink(missing_ok=True)
+
+
+def format_record_stats(stats: dict) -> str:
+    plan = stats["plan"]
+    return (f"{stats['fps']:.1f}/{VIDEO_FPS} fps · {stats['dropped']} dropped "
+            f"of {stats['frames']} · CPU {stats['cpu']:.1f}s\n"
+            f"{plan['height']}p · {plan['bitrate'] / 1e6:.1f} Mbit/s · {plan['preset']}"
+            + (f" · VFR, {stats['unique']} unique frames" if "unique" in stats else ""))
+
+
+def record_screen(duration: int = VIDEO_DEFAULT_DURATION, height: Optional[int] = None,
+                  preset: Optional[str] = None,
+                  on_segment: Optional[Callable[[str, int], None]] = None,
+                  job: Optional["RecordingJob"] = None, vfr: bool = VIDEO_VFR,
+                  ) -> tuple[Optional[str], Optional[dict], Optional[str]]:
+    """
+    Record the primary monitor within the upload limit. Returns (path, stats, error).
+
+    With `on_segment`, ffmpeg cuts the video into SEGMENT_DURATION parts that
+    are passed to `on_segment(path, part_no)` as soon as each one is finished;
+    the returned path is then None. A stopped `job` ends capture early and
+    the partial video is finalized and returned as usual.
+
+    With `vfr` (single-file recordings only), frames identical to the last
+    kept one are not encoded at all; the kept frame's duration is stretched
+    instead, so idle screens cost almost nothing to encode or upload.
+    """
+    limit    = VIDEO_MAX_SEGMENTED_DURATION if on_segment else VIDEO_MAX_DURATION
+    duration = max(1, min(duration, limit))
+    # Job ID (or a random tag) so concurrent recordings never share a file
+    stamp   = f"{int(time.time())}-{job.id if job else secrets.token_hex(4)}"
+    outfile = str(DATA_DIR / f"dm-bot-record-{stamp}.mp4")
+    uploader: Optional[SegmentUploader] = None
+    try:
+        cap     = get_capture()
+        monitor = cap.monitors()[1]
+        size    = (monitor["width"], monitor["height"])
+        if on_segment:
+            plan     = plan_encoding(SEGMENT_DURATION, size, VIDEO_FPS, height, preset)
+            outfile  = str(DATA_DIR / f"dm-bot-record-{stamp}-%03d.mp4")
+            seglist  = DATA_DIR / f"dm-bot-record-{stamp}.segments"
+            params   = encoder_params(plan) + segment_params(SEGMENT_DURATION, seglist)
+            uploader = SegmentUploader(seglist, SEGMENT_DURATION, on_segment)
+        else:
+            plan     = plan_encoding(duration, size, VIDEO_FPS, height, preset)
+            params   = encoder_params(plan) + (["-bf", "0"] if vfr else [])
+        tracker = DamageTracker() if vfr and not on_segment else None
+        holds: list[int] = []  # VFR: output slots covered by each encoded frame
+        encoder = FrameEncoder(outfile, size, VIDEO_FPS, output_params=params)
+        clock = FrameClock(VIDEO_FPS, duration * VIDEO_FPS)
+        if job:
+            job.clock, job.state = clock, "recording"
+        try:
+            while not clock.done and not (job and job.stopped):
+                if uploader and uploader.pending > SEGMENT_MAX_PENDING:
+                    log.warning("DM-Bot: upload backlog of %d segments — stopping recording.",
+                                uploader.pending)
+                    break
+                clock.wait()
+                buf   = encoder.acquire()
+                frame = cap.grab_array(1, out=buf)
+                if frame is not buf:
+                    log.warning("DM-Bot: monitor geometry changed — stopping recording early.")
+                    encoder.submit(buf, 0)
+                    break
+                copies = clock.tick()
+                if tracker is None:
+                    encoder.submit(frame, copies)
+                elif tracker.changed(frame) or not holds:
+                    encoder.submit(frame, 1)
+                    holds.append(copies)
+                else:
+                    holds[-1] += copies
+                    encoder.release(frame)
+            stats = clock.stats()
+            if job:
+                job.state = "encoding"
+        finally:
+            encoder.close()
+        stats["plan"] = plan
+        if uploader:
+            uploader.close()
+            stats["segments"] = uploader.sent
+            uploader = None
+            log.info("DM-Bot: recorded %ds in segments — %s", clock.written // VIDEO_FPS,
+                     format_record_stats(stats))
+            return None, stats, None
+        if tracker:
+            stats["unique"] = len(holds)
+            if not retime_mp4(outfile, holds):
+                return None, None, "DM-Bot recording error: could not write VFR timestamps."
+        err = fit_video(outfile, clock.written / VIDEO_FPS)
+        if err:
+            Path(outfile).unlink(missing_ok=True)
+            return None, None, err
+        log.info("DM-Bot: recorded %ds — %s", clock.written // VIDEO_FPS, format_record_stats(stats))
+        return outfile, stats, None
     except Exception as exc:
-        return None, f"DM-Bot recording error: {exc}"
+        return None, None, f"DM-Bot recording error: {exc}"
     finally:
-        VIDEO_RECORDING = False
+        if uploader:
+            uploader.close()
 
 # ─────────────────────────────────────────────────────────────────────────────
-# System commands
+# Instant replay
+# ─────────────────────────────────────────────────────────────────────────────
+
+class ReplayBuffer:
+    """
+    Background capture of the last `seconds` at a low frame rate. Frames are
+    downscaled by an integer stride (no resampling cost) to BGR and kept in
+    one ring array allocated up front, so memory never exceeds `max_bytes`;
+    if the ceiling is lower than the requested window, the window shrinks.
+    """
+
+    def __init__(self, seconds: int = REPLAY_SECONDS, fps: int = REPLAY_FPS,
+                 height: int = REPLAY_HEIGHT, max_bytes: int = REPLAY_MAX_MB << 20) -> None:
+        self.seconds   = seconds
+        self.fps       = fps
+        self.height    = height
+        self.max_bytes = max_bytes
+        self._lock     = threading.Lock()
+        self._stop     = threading.Event()
+        self._ring: Optional[np.ndarray] = None
+        self._holds: Optional[np.ndarray] = None  # output slots covered by each ring entry
+        self._next     = 0
+        self._count    = 0
+        self._stride   = 1
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    @property
+    def window(self) -> float:
+        """Seconds currently held."""
+        with self._lock:
+            if self._holds is None:
+                return 0.0
+            return float(self._holds.sum()) / self.fps
+
+    def _allocate(self, monitor_shape: tuple) -> None:
+        h, w = monitor_shape[:2]
+        self._stride = max(1, -(-h // self.height))
+        out_h = (h // self._stride) // 2 * 2  # yuv420p needs even sizes
+        out_w = (w // self._stride) // 2 * 2
+        frame_bytes = out_h * out_w * 3
+        capacity = max(1, min(self.seconds * self.fps, self.max_bytes // frame_bytes))
+        self._ring  = np.empty((capacity, out_h, out_w, 3), dtype=np.uint8)
+        self._holds = np.zeros(capacity, dtype=np.int64)
+        self._next = self._count = 0
+        log.info("DM-Bot: replay buffer %dx%d @ %d fps, %.0fs, %d MB.", out_w, out_h, self.fps,
+                 capacity / self.fps, self._ring.nbytes >> 20)
+
+    def _run(self) -> None:
+        cap   = get_capture()
+        clock = FrameClock(self.fps, sys.maxsize)
+        frame = None
+        while not self._stop.is_set():
+            clock.wait()
+            try:
+                frame = cap.grab_array(1, out=frame)
+            except Exception as exc:
+                log.warning("DM-Bot: replay capture failed — %s", exc)
+                self._stop.wait(1.0)
+                continue
+            copies = clock.tick()
+            with self._lock:
+                k = self._stride
+                if self._ring is None or frame.shape[0] // k // 2 * 2 != self._ring.shape[1] \
+                        or frame.shape[1] // k // 2 * 2 != self._ring.shape[2]:
+                    self._allocate(frame.shape)
+                    k = self._stride
+                h, w = self._ring.shape[1:3]
+                np.copyto(self._ring[self._next], frame[:h * k:k, :w * k:k, :3])
+                self._holds[self._next] = copies
+                self._next  = (self._next + 1) % len(self._ring)
+                self._count = min(self._count + 1, len(self._ring))
+
+    def start(self) -> None:
+        if self.running:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="dm-bot-replay", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        with self._lock:
+            self._ring = self._holds = None  # release the memory
+            self._count = 0
+
+    def save(self, seconds: Optional[int] = None) -> tuple[Optional[str], Optional[str]]:
+        """Encode the last `seconds` to an MP4. Capture pauses while the window is encoded."""
+        outfile = str(DATA_DIR / f"dm-bot-replay-{int(time.time())}-{secrets.token_hex(4)}.mp4")
+        slots = (seconds or self.seconds) * self.fps
+        with self._lock:
+            if not self._count:
+                return None, "DM-Bot: the replay buffer is empty."
+            size = len(self._ring)
+            picked, covered = [], 0
+            for back in range(1, self._count + 1):
+                i = (self._next - back) % size
+                picked.append(i)
+                covered += int(self._holds[i])
+                if covered >= slots:
+                    break
+            h, w = self._ring.shape[1:3]
+            try:
+                gen = imageio_ffmpeg.write_frames(
+                    outfile, (w, h), pix_fmt_in="bgr24", fps=self.fps, codec="libx264",
+                    quality=None, output_params=["-preset", "veryfast", "-crf", "28"],
+                    macro_block_size=1, ffmpeg_log_level="error",
+                )
+                gen.send(None)
+                for i in reversed(picked):
+                    for _ in range(int(self._holds[i])):
+                        gen.send(self._ring[i])
+                gen.close()
+            except Exception as exc:
+                Path(outfile).unlink(missing_ok=True)
+                return None, f"DM-Bot replay error: {exc}"
+        err = fit_video(outfile, covered / self.fps)
+        if err:
+            Path(outfile).unlink(missing_ok=True)
+            return None, err
+        return outfile, None
+
+
+def get_replay() -> ReplayBuffer:
+    global replay
+    if replay is None:
+        replay = ReplayBuffer()
+    return replay
+
 # ─────────────────────────────────────────────────────────────────────────────
+# Recording jobs
+# ─────────────────────────────────────────────────────────────────────────────
+
+class RecordingJob:
+    """One /record run. The capture loop polls `stopped` and exposes its clock for progress."""
+
+    def __init__(self, job_id: int, chat_id: int, duration: int) -> None:
+        self.id       = job_id
+        self.chat_id  = chat_id
+        self.duration = duration
+        self.state    = "starting"   # starting → recording → encoding → uploading → done | failed
+        self.clock: Optional[FrameClock] = None
+        self._stop    = threading.Event()
+
+    @property
+    def stopped(self) -> bool:
+        return self._stop.is_set()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    @property
+    def progress(self) -> int:
+        if self.clock is None:
+            return 0
+        return int(100 * self.clock.written / max(self.clock.total, 1))
+
+    def describe(self) -> str:
+        stopping = " (stopping)" if self.stopped and self.state == "recording" else ""
+        return f"#{self.id} · {self.duration}s · {self.state}{stopping} · {self.progress}%"
+
+
+class RecordingManager:
+    """Admits up to `limit` concurrent recordings and tracks them by ID."""
+
+    def __init__(self, limit: int) -> None:
+        self.limit   = max(1, limit)
+        self._lock   = threading.Lock()
+        self._jobs: dict[int, RecordingJob] = {}
+        self._next   = 1
+
+    def start(self, chat_id: int, duration: int,
+              target: Callable[[RecordingJob], None]) -> Optional[RecordingJob]:
+        """Register and launch a job, or return None if all slots are busy."""
+        with self._lock:
+            if len(self._jobs) >= self.limit:
+                return None
+            job = RecordingJob(self._next, chat_id, duration)
+            self._jobs[job.id] = job
+            self._next += 1
+
+        def run_job() -> None:
+            try:
+                target(job)
+                job.state = "done"
+            except Exception as exc:
+                job.state = "failed"
+                log.error("DM-Bot: recording #%d failed — %s", job.id, exc)
+            finally:
+                with self._lock:
+                    self._jobs.pop(job.id, None)
+
+        threading.Thread(target=run_job, name=f"dm-bot-record-{job.id}", daemon=True).start()
+        return job
+
+    def get(self, job_id: int) -> Optional[RecordingJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def active(self, chat_id: Optional[int] = None) -> list[RecordingJob]:
+        with self._lock:
+            return [j for j in self._jobs.values() if chat_id is None or j.chat_id == chat_id]
+
+    def stop_all(self) -> None:
+        for job in self.active():
+            job.stop()
+
+
+recordings = RecordingManager(MAX_RECORDINGS)
+
+
+def stop_button(job: RecordingJob) -> types.InlineKeyboardMarkup:
+    markup = types.InlineKeyboardMarkup()
+    markup.add(types.InlineKeyboardButton("⏹ Stop", callback_data=f"rec_stop:{job.id}"))
+    return markup
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Host capabilities
+# ─────────────────────────────────────────────────────────────────────────────
+
+def _session_key() -> dict:
+    """Environment the capabilities depend on; any change triggers rediscovery."""
+    key = {var: os.environ.get(var, "") for var in
+           ("PATH", "DISPLAY", "WAYLAND_DISPLAY", "XDG_SESSION_TYPE", "XDG_CURRENT_DESKTOP")}
+    key["format"] = CAPABILITIES_FORMAT  # bumped when discovery changes, to drop stale caches
+    return key
+
+
+def discover_capabilities() -> dict:
+    """Probe the display server and the tools DM-Bot can use, without running any of them."""
+    if os.environ.get("WAYLAND_DISPLAY") or os.environ.get("XDG_SESSION_TYPE") == "wayland":
+        session = "wayland"
+    elif os.environ.get("DISPLAY"):
+        session = "x11"
+    else:
+        session = "none"
+    # Under XWayland an X display exists too, so X11 tools still work for X clients
+    has_x = bool(os.environ.get("DISPLAY"))
+
+    window_tools = []
+    if has_x and ctypes.util.find_library("xcb"):
+        window_tools.append("x11")
+    window_tools += [tool for tool in ("wmctrl", "xdotool") if has_x and shutil.which(tool)]
+
+    # Native Wayland capture first: X11 grabs there see only XWayland clients
+    capture = ["grim"] if session == "wayland" and shutil.which("grim") else []
+    capture += [tool for tool in X11_CAPTURE if has_x and (tool == "mss" or shutil.which(tool))]
 
-def run_command(cmd: list[str], timeout: int = 10) -> tuple[str, str]:
-    """Run a system command safely. Returns (stdout, stderr)."""
     try:
-        result = subprocess.run(
-            cmd, capture_output=True, text=True, timeout=timeout,
-        )
-        return result.stdout.strip(), result.stderr.strip()
-    except subprocess.TimeoutExpired:
-        return "", "Command timed out."
-    except FileNotFoundError:
-        return "", f"Command not found: {cmd[0]}"
+        ffmpeg = imageio_ffmpeg.get_ffmpeg_exe()
+    except RuntimeError:
+        ffmpeg = None
+
+    return {
+        "key":          _session_key(),
+        "session":      session,
+        "lockers":      [cmd[0] for cmd in SCREEN_LOCKERS if shutil.which(cmd[0])],
+        "locker":       None,  # the one that last worked, tried first
+        "window_tools": window_tools,
+        "capture":      capture,
+        "ffmpeg":       ffmpeg if ffmpeg and os.access(ffmpeg, os.X_OK) else None,
+        "capture_backend": None,  # picked by select_capture_backend()
+    }
+
+
+def save_capabilities() -> None:
+    try:
+        with CAPABILITIES_LOCK:
+            tmp = CAPABILITIES_FILE.with_suffix(".tmp")
+            with open(tmp, "w") as f:
+                json.dump(CAPABILITIES, f, indent=2)
+            os.replace(tmp, CAPABILITIES_FILE)
     except Exception as exc:
-        return "", str(exc)
+        log.error("Failed to save capabilities: %s", exc)
+
+
+def update_capabilities(**changes) -> None:
+    """Set learned keys (picked backend, working locker) and persist them in one step."""
+    with CAPABILITIES_LOCK:
+        get_capabilities().update(changes)
+        save_capabilities()
+
+
+def load_capabilities() -> dict:
+    """Capabilities from DATA_DIR if PATH and the session are unchanged, else a fresh probe."""
+    global CAPABILITIES
+    with CAPABILITIES_LOCK:
+        try:
+            with open(CAPABILITIES_FILE, "r") as f:
+                cached = json.load(f)
+            if cached.get("key") == _session_key():
+                CAPABILITIES = cached
+                return CAPABILITIES
+        except (FileNotFoundError, json.JSONDecodeError):
+            pass
+        CAPABILITIES = discover_capabilities()
+        save_capabilities()
+    log.info("DM-Bot: host capabilities — session %s, windows %s, lockers %s, capture %s.",
+             CAPABILITIES["session"], CAPABILITIES["window_tools"] or "none",
+             CAPABILITIES["lockers"] or "none", CAPABILITIES["capture"] or "none")
+    return CAPABILITIES
+
+
+def get_capabilities() -> dict:
+    """The capabilities loaded by run(); loaded on demand for benchmarks."""
+    with CAPABILITIES_LOCK:
+        return CAPABILITIES or load_capabilities()
+
+
+def has_tool(kind: str, name: str) -> bool:
+    return name in get_capabilities()[kind]
+
+# ─────────────────────────────────────────────────────────────────────────────
+# X11 windows
+# ─────────────────────────────────────────────────────────────────────────────
+
+class _Cookie(ctypes.Structure):
+    _fields_ = [("sequence", ctypes.c_uint)]
+
+
+class _ScreenIterator(ctypes.Structure):
+    _fields_ = [("data", ctypes.POINTER(ctypes.c_uint32)), ("rem", ctypes.c_int),
+                ("index", ctypes.c_int)]
+
+
+class _AtomReply(ctypes.Structure):
+    _fields_ = [("response_type", ctypes.c_uint8), ("pad0", ctypes.c_uint8),
+                ("sequence", ctypes.c_uint16), ("length", ctypes.c_uint32),
+                ("atom", ctypes.c_uint32)]
+
+
+class _PropertyReply(ctypes.Structure):
+    _fields_ = [("response_type", ctypes.c_uint8), ("format", ctypes.c_uint8),
+                ("sequence", ctypes.c_uint16), ("length", ctypes.c_uint32),
+                ("type", ctypes.c_uint32), ("bytes_after", ctypes.c_uint32),
+                ("value_len", ctypes.c_uint32), ("pad0", ctypes.c_uint8 * 12)]
+
+
+class _GeometryReply(ctypes.Structure):
+    _fields_ = [("response_type", ctypes.c_uint8), ("depth", ctypes.c_uint8),
+                ("sequence", ctypes.c_uint16), ("length", ctypes.c_uint32),
+                ("root", ctypes.c_uint32), ("x", ctypes.c_int16), ("y", ctypes.c_int16),
+                ("width", ctypes.c_uint16), ("height", ctypes.c_uint16),
+                ("border_width", ctypes.c_uint16), ("pad0", ctypes.c_uint8 * 2)]
+
+
+class _TranslateReply(ctypes.Structure):
+    _fields_ = [("response_type", ctypes.c_uint8), ("same_screen", ctypes.c_uint8),
+                ("sequence", ctypes.c_uint16), ("length", ctypes.c_uint32),
+                ("child", ctypes.c_uint32), ("dst_x", ctypes.c_int16), ("dst_y", ctypes.c_int16)]
+
+
+class X11Windows:
+    """
+    EWMH window access over one persistent XCB connection, via ctypes so no
+    extra dependency is needed. Listing issues every property, geometry and
+    translate request first and only then collects the replies, so N windows
+    cost one round trip instead of N subprocess forks. Actions are EWMH
+    client messages sent to the root window, exactly what wmctrl sends.
+    """
+
+    _EVENT_MASK = (1 << 19) | (1 << 20)  # SubstructureNotify | SubstructureRedirect
+    _CW_EVENT_MASK = 1 << 11
+    _WATCH_ROOT    = (1 << 22)              # PropertyChange: _NET_CLIENT_LIST, ...
+    _WATCH_WINDOW  = (1 << 22) | (1 << 17)  # PropertyChange | StructureNotify: title, geometry, unmap
+    _ATOMS = ("_NET_CLIENT_LIST", "_NET_WM_NAME", "WM_NAME", "UTF8_STRING", "_NET_WM_PID",
+              "_NET_WM_DESKTOP", "_NET_ACTIVE_WINDOW", "_NET_CLOSE_WINDOW", "_NET_WM_STATE",
+              "_NET_WM_STATE_MAXIMIZED_VERT", "_NET_WM_STATE_MAXIMIZED_HORZ", "WM_CHANGE_STATE")
+
+    def __init__(self, display: Optional[str] = None) -> None:
+        name = ctypes.util.find_library("xcb")
+        if not name:
+            raise OSError("libxcb not found")
+        self._xcb  = xcb = ctypes.CDLL(name)
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c"))
+        self._libc.free.argtypes = [ctypes.c_void_p]
+        self._lock = threading.Lock()
+
+        ptr, u8, u16, u32, i16 = ctypes.c_void_p, ctypes.c_uint8, ctypes.c_uint16, ctypes.c_uint32, ctypes.c_int16
+        err = ctypes.POINTER(ctypes.c_void_p)
+        signatures = {
+            "xcb_connect":                   ([ctypes.c_char_p, ctypes.POINTER(ctypes.c_int)], ptr),
+            "xcb_connection_has_error":      ([ptr], ctypes.c_int),
+            "xcb_disconnect":                ([ptr], None),
+            "xcb_flush":                     ([ptr], ctypes.c_int),
+            "xcb_get_setup":                 ([ptr], ptr),
+            "xcb_setup_roots_iterator":      ([ptr], _ScreenIterator),
+            "xcb_screen_next":               ([ctypes.POINTER(_ScreenIterator)], None),
+            "xcb_intern_atom":               ([ptr, u8, u16, ctypes.c_char_p], _Cookie),
+            "xcb_intern_atom_reply":         ([ptr, _Cookie, err], ctypes.POINTER(_AtomReply)),
+            "xcb_get_property":              ([ptr, u8, u32, u32, u32, u32, u32], _Cookie),
+            "xcb_get_property_reply":        ([ptr, _Cookie, err], ctypes.POINTER(_PropertyReply)),
+            "xcb_get_property_value":        ([ptr], ptr),
+            "xcb_get_property_value_length": ([ptr], ctypes.c_int),
+            "xcb_get_geometry":              ([ptr, u32], _Cookie),
+            "xcb_get_geometry_reply":        ([ptr, _Cookie, err], ctypes.POINTER(_GeometryReply)),
+            "xcb_translate_coordinates":     ([ptr, u32, u32, i16, i16], _Cookie),
+            "xcb_translate_coordinates_reply": ([ptr, _Cookie, err], ctypes.POINTER(_TranslateReply)),
+            "xcb_send_event":                ([ptr, u8, u32, u32, ctypes.c_char_p], _Cookie),
+            "xcb_change_window_attributes":  ([ptr, u32, u32, ctypes.POINTER(u32)], _Cookie),
+            "xcb_poll_for_event":            ([ptr], ctypes.POINTER(u8)),
+        }
+        for fn, (args, res) in signatures.items():
+            getattr(xcb, fn).argtypes = args
+            getattr(xcb, fn).restype  = res
+
+        screen = ctypes.c_int(0)
+        display = display or os.environ.get("DISPLAY")
+        self._conn = xcb.xcb_connect(display.encode() if display else None, ctypes.byref(screen))
+        if not self._conn or xcb.xcb_connection_has_error(self._conn):
+            raise OSError(f"cannot connect to X display {display!r}")
+        it = xcb.xcb_setup_roots_iterator(xcb.xcb_get_setup(self._conn))
+        for _ in range(screen.value):
+            xcb.xcb_screen_next(ctypes.byref(it))
+        self.root = it.data[0]  # xcb_screen_t.root is the first field
+
+        cookies = {a: xcb.xcb_intern_atom(self._conn, 0, len(a), a.encode()) for a in self._ATOMS}
+        self.atoms = {}
+        for atom, cookie in cookies.items():
+            reply = self._reply("xcb_intern_atom_reply", cookie)
+            self.atoms[atom] = reply.contents.atom if reply else 0
+            self._free(reply)
+        self._watch(self.root, self._WATCH_ROOT)
+        xcb.xcb_flush(self._conn)
+
+    # -- low level --------------------------------------------------------------
+
+    def _free(self, reply) -> None:
+        if reply:
+            self._libc.free(ctypes.cast(reply, ctypes.c_void_p))
+
+    def _reply(self, fn: str, cookie: _Cookie):
+        error = ctypes.c_void_p()
+        reply = getattr(self._xcb, fn)(self._conn, cookie, ctypes.byref(error))
+        if error.value:
+            self._libc.free(error)
+        return reply if reply else None
+
+    def _property_cookie(self, window: int, atom: str) -> _Cookie:
+        return self._xcb.xcb_get_property(self._conn, 0, window, self.atoms[atom], 0, 0, 1 << 16)
+
+    def _property(self, cookie: _Cookie) -> tuple[int, bytes]:
+        """(format, raw value) of a property reply; (0, b"") if missing."""
+        reply = self._reply("xcb_get_property_reply", cookie)
+        if not reply:
+            return 0, b""
+        try:
+            length = self._xcb.xcb_get_property_value_length(reply)
+            value  = ctypes.string_at(self._xcb.xcb_get_property_value(reply), length)
+            return reply.contents.format, value
+        finally:
+            self._free(reply)
+
+    def _watch(self, window: int, mask: int) -> None:
+        value = ctypes.c_uint32(mask)
+        self._xcb.xcb_change_window_attributes(self._conn, window, self._CW_EVENT_MASK, ctypes.byref(value))
+
+    @staticmethod
+    def _cardinals(value: bytes) -> list[int]:
+        return list(struct.unpack(f"={len(value) // 4}I", value[:len(value) // 4 * 4]))
+
+    # -- public API -----------------------------------------------------------------
+
+    @property
+    def alive(self) -> bool:
+        return bool(self._conn) and not self._xcb.xcb_connection_has_error(self._conn)
+
+    def list(self) -> list[dict]:
+        """Managed windows: id, title, pid, desktop and absolute geometry."""
+        with self._lock:
+            _, raw = self._property(self._property_cookie(self.root, "_NET_CLIENT_LIST"))
+            wids = self._cardinals(raw)
+            xcb, conn = self._xcb, self._conn
+            pending = [(
+                wid,
+                self._property_cookie(wid, "_NET_WM_NAME"),
+                self._property_cookie(wid, "WM_NAME"),
+                self._property_cookie(wid, "_NET_WM_PID"),
+                self._property_cookie(wid, "_NET_WM_DESKTOP"),
+                xcb.xcb_get_geometry(conn, wid),
+                xcb.xcb_translate_coordinates(conn, wid, self.root, 0, 0),
+            ) for wid in wids]
+            for wid in wids:
+                self._watch(wid, self._WATCH_WINDOW)
+            xcb.xcb_flush(conn)
+
+            windows = []
+            for wid, net_name, wm_name, pid, desktop, geom, origin in pending:
+                _, title = self._property(net_name)
+                _, legacy = self._property(wm_name)
+                _, pid_raw = self._property(pid)
+                _, desk_raw = self._property(desktop)
+                g = self._reply("xcb_get_geometry_reply", geom)
+                o = self._reply("xcb_translate_coordinates_reply", origin)
+                if g:
+                    windows.append({
+                        "id":      wid,
+                        "title":   (title or legacy).decode("utf-8", errors="replace"),
+                        "pid":     (self._cardinals(pid_raw) or [None])[0],
+                        "desktop": (self._cardinals(desk_raw) or [None])[0],
+                        "x":       o.contents.dst_x if o else g.contents.x,
+                        "y":       o.contents.dst_y if o else g.contents.y,
+                        "width":   g.contents.width,
+                        "height":  g.contents.height,
+                    })
+                self._free(g)
+                self._free(o)
+            return windows
+
+    def changed(self) -> bool:
+        """Drain queued X events; True if any window was added, removed, renamed or moved."""
+        seen = False
+        with self._lock:
+            while True:
+                event = self._xcb.xcb_poll_for_event(self._conn)
+                if not event:
+                    return seen
+                seen = True  # only property/structure events are selected
+                self._free(event)
+
+    def _client_message(self, window: int, message: str, *data: int) -> None:
+        words = (list(data) + [0] * 5)[:5]
+        # xcb_client_message_event_t: type 33, format 32, sequence, window, message type, 5 longs
+        event = struct.pack("=BBHII5I", 33, 32, 0, window, self.atoms[message], *words)
+        with self._lock:
+            self._xcb.xcb_send_event(self._conn, 0, self.root, self._EVENT_MASK, event)
+            self._xcb.xcb_flush(self._conn)
+
+    def activate(self, window: int) -> None:
+        self._client_message(window, "_NET_ACTIVE_WINDOW", 2, 0, 0)
+
+    def close(self, window: int) -> None:
+        self._client_message(window, "_NET_CLOSE_WINDOW", 0, 2)
+
+    def maximize(self, window: int) -> None:
+        self._client_message(window, "_NET_WM_STATE", 1, self.atoms["_NET_WM_STATE_MAXIMIZED_VERT"],
+                             self.atoms["_NET_WM_STATE_MAXIMIZED_HORZ"], 2)
+
+    def minimize(self, window: int) -> None:
+        self._client_message(window, "WM_CHANGE_STATE", 3)  # ICCCM IconicState
+
+    def disconnect(self) -> None:
+        with self._lock:
+            if self._conn:
+                self._xcb.xcb_disconnect(self._conn)
+                self._conn = None
+
+
+_x11: Optional[X11Windows] = None
+_x11_failed_at = 0.0
+X11_RETRY_INTERVAL = 60  # seconds before reconnecting after a failure
+
+
+def get_x11() -> Optional[X11Windows]:
+    """Shared X11 connection, or None (then callers fall back to wmctrl/xdotool)."""
+    global _x11, _x11_failed_at
+    if _x11 is not None and _x11.alive:
+        return _x11
+    if not has_tool("window_tools", "x11"):
+        return None
+    if time.monotonic() - _x11_failed_at < X11_RETRY_INTERVAL:
+        return None
+    try:
+        _x11 = X11Windows()
+        return _x11
+    except OSError as exc:
+        log.info("DM-Bot: native X11 window backend unavailable (%s) — using wmctrl/xdotool.", exc)
+        _x11, _x11_failed_at = None, time.monotonic()
+        return None
+
+# ─────────────────────────────────────────────────────────────────────────────
+# System commands
+# ─────────────────────────────────────────────────────────────────────────────
+
+class CommandRunner:
+    """
+    Central executor for external commands. At most `workers` run at once;
+    each gets its own process group, so a timeout kills the command and
+    everything it spawned. stdout/stderr are read incrementally and capped
+    at `max_output` bytes. Callers either block on run(), or submit() and
+    get a Future / callback, so a slow command never ties up a handler.
+    """
+
+    def __init__(self, workers: int = COMMAND_WORKERS, max_output: int = COMMAND_OUTPUT_MAX) -> None:
+        self.max_output = max_output
+        self._executor  = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="dm-bot-cmd")
+        self._lock      = threading.Lock()
+        self._running: set[subprocess.Popen] = set()
+
+    @staticmethod
+    def _kill(proc: subprocess.Popen) -> None:
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            pass
+        proc.wait()
+
+    def _read(self, proc: subprocess.Popen, deadline: float,
+              max_output: int) -> Optional[tuple[bytes, bytes]]:
+        """Drain both pipes until the command exits; None on timeout."""
+        out = {proc.stdout: bytearray(), proc.stderr: bytearray()}
+        with selectors.DefaultSelector() as sel:
+            for pipe in out:
+                sel.register(pipe, selectors.EVENT_READ)
+            while sel.get_map():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                events = sel.select(min(remaining, 0.1))
+                for key, _ in events:
+                    chunk = os.read(key.fd, 65536)
+                    if not chunk:
+                        sel.unregister(key.fileobj)
+                        continue
+                    buf = out[key.fileobj]
+                    buf += chunk[:max(0, max_output - len(buf))]
+                # A daemonizing child (e.g. a screen locker) may keep the pipes open
+                if not events and proc.poll() is not None:
+                    break
+        return bytes(out[proc.stdout]), bytes(out[proc.stderr])
+
+    def _execute(self, cmd: list[str], timeout: float, max_output: int) -> tuple[bytes, str]:
+        try:
+            proc = subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                                    stderr=subprocess.PIPE, start_new_session=True)
+        except FileNotFoundError:
+            return b"", f"Command not found: {cmd[0]}"
+        except Exception as exc:
+            return b"", str(exc)
+
+        with self._lock:
+            self._running.add(proc)
+        try:
+            deadline = time.monotonic() + timeout
+            result = self._read(proc, deadline, max_output)
+            if result is not None:
+                try:
+                    proc.wait(max(0.0, deadline - time.monotonic()))
+                except subprocess.TimeoutExpired:
+                    result = None
+            if result is None:
+                log.warning("DM-Bot: %s timed out after %ss — killing its process group.", cmd[0], timeout)
+                self._kill(proc)
+                return b"", "Command timed out."
+            stdout, stderr = result
+            return stdout, stderr.decode("utf-8", errors="replace").strip()
+        finally:
+            proc.stdout.close()
+            proc.stderr.close()
+            with self._lock:
+                self._running.discard(proc)
+
+    def _execute_text(self, cmd: list[str], timeout: float) -> tuple[str, str]:
+        stdout, err = self._execute(cmd, timeout, self.max_output)
+        return stdout.decode("utf-8", errors="replace").strip(), err
+
+    def submit(self, cmd: list[str], timeout: float = COMMAND_TIMEOUT,
+               callback: Optional[Callable[[str, str], None]] = None) -> Future:
+        """Queue a command. The Future yields (stdout, stderr); `callback` gets them too."""
+        future = self._executor.submit(self._execute_text, cmd, timeout)
+        if callback is not None:
+            def done(f: Future) -> None:
+                try:
+                    callback(*f.result())
+                except Exception as exc:
+                    log.error("DM-Bot: callback for %s failed: %s", cmd[0], exc)
+            future.add_done_callback(done)
+        return future
+
+    def run(self, cmd: list[str], timeout: float = COMMAND_TIMEOUT) -> tuple[str, str]:
+        return self.submit(cmd, timeout).result()
+
+    def run_binary(self, cmd: list[str], timeout: float = COMMAND_TIMEOUT,
+                   max_output: int = 1 << 30) -> tuple[bytes, str]:
+        """Raw stdout (e.g. an image) and stderr text, through the same worker limit."""
+        return self._executor.submit(self._execute, cmd, timeout, max_output).result()
+
+    def close(self) -> None:
+        """Kill whatever is still running and drop queued commands."""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        with self._lock:
+            running = list(self._running)
+        for proc in running:
+            self._kill(proc)
+
+
+commands = CommandRunner()
+
+
+def run_command(cmd: list[str], timeout: int = COMMAND_TIMEOUT) -> tuple[str, str]:
+    """Run a system command safely through the shared runner. Returns (stdout, stderr)."""
+    return commands.run(cmd, timeout)
 
 
 def shutdown_pc() -> str:
@@ -316,100 +2094,1009 @@ def reboot_pc() -> str:
     return err or "DM-Bot: reboot initiated."
 
 
-def lock_screen() -> str:
-    """Try common Linux screen lockers in order of preference."""
-    lockers = [
-        ["loginctl", "lock-session"],
-        ["xdg-screensaver", "lock"],
-        ["gnome-screensaver-command", "--lock"],
-        ["xscreensaver-command", "--lock"],
-        ["i3lock"],
-    ]
-    for cmd in lockers:
-        _, err = run_command(cmd, timeout=5)
-        if not err:
-            return f"🔒 Screen locked via {cmd[0]}."
-    return "❌ Could not lock screen — no supported locker found."
+SCREEN_LOCKERS = [
+    ["loginctl", "lock-session"],
+    ["xdg-screensaver", "lock"],
+    ["gnome-screensaver-command", "--lock"],
+    ["xscreensaver-command", "--lock"],
+    ["i3lock"],
+]
+
+
+def lock_screen(done: Callable[[str], None], candidates: Optional[list[list[str]]] = None) -> None:
+    """
+    Try the screen lockers found on this host, the one that worked last time
+    first. Each attempt is chained from the previous one's callback, so no
+    thread waits on them; `done` receives the outcome.
+    """
+    if candidates is None:
+        caps = get_capabilities()
+        candidates = [cmd for cmd in SCREEN_LOCKERS if cmd[0] in caps["lockers"]]
+        candidates.sort(key=lambda cmd: cmd[0] != caps["locker"])
+    if not candidates:
+        done("❌ Could not lock screen — no supported locker found.")
+        return
+    cmd, rest = candidates[0], candidates[1:]
 
+    def next_locker(_, err: str) -> None:
+        if err:
+            lock_screen(done, rest)
+            return
+        if get_capabilities().get("locker") != cmd[0]:
+            update_capabilities(locker=cmd[0])
+        done(f"🔒 Screen locked via {cmd[0]}.")
+
+    commands.submit(cmd, timeout=5, callback=next_locker)
+
+
+def _scan_windows() -> tuple[list[dict], Optional[X11Windows]]:
+    """
+    Window inventory from X11 directly, else `wmctrl -lpG`, else xdotool.
+    Also returns the X11 connection if it was used, as a change-event source.
+    """
+    x11 = get_x11()
+    if x11:
+        try:
+            return x11.list(), x11
+        except Exception as exc:
+            log.warning("DM-Bot: X11 window listing failed (%s) — falling back.", exc)
 
-def list_windows() -> list[str]:
-    """List open windows using wmctrl (preferred) or xdotool as fallback."""
-    stdout, _ = run_command(["wmctrl", "-l"])
+    stdout = run_command(["wmctrl", "-lpG"])[0] if has_tool("window_tools", "wmctrl") else ""
     if stdout:
-        titles = []
+        found = []
         for line in stdout.splitlines():
-            parts = line.split(None, 3)
-            if len(parts) >= 4:
-                titles.append(parts[3])
-        return titles
+            # id desktop pid x y w h host title
+            parts = line.split(None, 8)
+            if len(parts) >= 8:
+                found.append({
+                    "id": int(parts[0], 16), "title": parts[8] if len(parts) > 8 else "",
+                    "pid": int(parts[2]) or None, "desktop": int(parts[1]),
+                    "x": int(parts[3]), "y": int(parts[4]), "width": int(parts[5]), "height": int(parts[6]),
+                })
+        return found, None
 
     # Fallback: xdotool
-    stdout, _ = run_command(["xdotool", "search", "--name", ""])
-    if stdout:
-        names = []
-        for wid in stdout.splitlines()[:20]:
-            name, _ = run_command(["xdotool", "getwindowname", wid])
-            if name:
-                names.append(f"{wid}: {name}")
-        return names
-
-    return []
+    stdout = run_command(["xdotool", "search", "--name", ""])[0] if has_tool("window_tools", "xdotool") else ""
+    found = []
+    for wid in stdout.splitlines()[:20]:
+        name, _ = run_command(["xdotool", "getwindowname", wid])
+        if name:
+            found.append({"id": int(wid), "title": name, "pid": None, "desktop": None,
+                          "x": None, "y": None, "width": None, "height": None})
+    return found, None
+
+
+class WindowInventory:
+    """
+    Open windows keyed by X window ID. With the native X11 backend the cache
+    is dropped as soon as a property/structure event arrives; with the
+    wmctrl/xdotool fallback it simply expires after `ttl` seconds.
+    """
+
+    def __init__(self, ttl: float = WINDOW_CACHE_TTL) -> None:
+        self.ttl      = ttl
+        self._lock    = threading.Lock()
+        self._windows: dict[int, dict] = {}
+        self._source: Optional[X11Windows] = None
+        self._fetched = 0.0
+
+    def _stale(self) -> bool:
+        if not self._fetched:
+            return True
+        if self._source is not None and self._source.alive:
+            return self._source.changed()
+        return time.monotonic() - self._fetched > self.ttl
+
+    def current(self) -> list[dict]:
+        with self._lock:
+            if self._stale():
+                found, self._source = _scan_windows()
+                self._windows = {w["id"]: w for w in found}
+                self._fetched = time.monotonic()
+            return list(self._windows.values())
+
+    def get(self, wid: int) -> Optional[dict]:
+        """Cached entry for a window ID — no rescan, so buttons stay cheap."""
+        with self._lock:
+            return self._windows.get(wid)
+
+    def find(self, title: str) -> list[dict]:
+        needle = title.lower()
+        return [w for w in self.current() if needle in w["title"].lower()]
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._fetched = 0.0
+
+
+windows = WindowInventory()
+
+WINDOW_ACTIONS = ("minimize", "maximize", "close", "activate")
+
+
+def window_action(action: str, window: dict) -> Optional[str]:
+    """Apply an action to one window by ID. Returns an error string or None."""
+    wid = window["id"]
+    x11 = get_x11()
+    try:
+        if x11:
+            try:
+                getattr(x11, action)(wid)
+                return None
+            except Exception as exc:
+                log.warning("DM-Bot: X11 window action failed (%s) — falling back.", exc)
+
+        tool = "xdotool" if action == "minimize" else "wmctrl"
+        if not has_tool("window_tools", tool):
+            return f"{tool} is not installed."
+        if action == "minimize":
+            _, err = run_command(["xdotool", "windowminimize", str(wid)])
+        else:
+            hex_id = f"0x{wid:08x}"
+            action_map = {
+                "close":    ["wmctrl", "-i", "-c", hex_id],
+                "maximize": ["wmctrl", "-i", "-r", hex_id, "-b", "add,maximized_vert,maximized_horz"],
+                "activate": ["wmctrl", "-i", "-a", hex_id],
+            }
+            _, err = run_command(action_map[action])
+        return err or None
+    finally:
+        windows.invalidate()
 
 
 def manage_window(action: str, window_title: str) -> str:
     """Minimize / maximize / close / activate a window by title substring."""
+    if action not in WINDOW_ACTIONS:
+        return f"Unknown action '{action}'. Use: minimize | maximize | close | activate"
+
+    matches = windows.find(window_title)
+    if not matches:
+        return f"No window matching '{window_title}'."
+    # Minimize hits every match; the other actions hit the first one
+    for w in (matches if action == "minimize" else matches[:1]):
+        err = window_action(action, w)
+        if err:
+            return f"Error: {err}"
     if action == "minimize":
-        ids_out, _ = run_command(["xdotool", "search", "--name", window_title])
-        if not ids_out:
-            return f"No window matching '{window_title}'."
-        for wid in ids_out.splitlines():
-            run_command(["xdotool", "windowminimize", wid])
         return f"Minimized window(s) matching '{window_title}'."
+    return f"Action '{action}' applied to '{matches[0]['title']}'."
+
+# ─────────────────────────────────────────────────────────────────────────────
+# System metrics
+# ─────────────────────────────────────────────────────────────────────────────
 
-    action_map = {
-        "close":    ["wmctrl", "-c", window_title],
-        "maximize": ["wmctrl", "-r", window_title, "-b", "add,maximized_vert,maximized_horz"],
-        "activate": ["wmctrl", "-a", window_title],
+def _physical_disks() -> set[str]:
+    """Block devices backed by hardware — skips loop, ram, zram and device-mapper."""
+    return {d.name for d in Path("/sys/block").glob("*") if (d / "device").exists()}
+
+
+def _read_proc(name: str) -> str:
+    with open(f"/proc/{name}") as f:
+        return f.read()
+
+
+class MetricsCollector:
+    """
+    Reads /proc and statvfs directly instead of forking uptime/free/df/top.
+    CPU, network and disk-I/O rates are deltas against the previous sample,
+    which is cached, so a snapshot never has to sleep. The very first
+    snapshot falls back to averages since boot.
+    """
+
+    def __init__(self, mount: str = "/") -> None:
+        self.mount  = mount
+        self._lock  = threading.Lock()
+        self._prev: Optional[dict] = None
+        self._disks = _physical_disks()
+
+    def sample(self) -> dict:
+        """Raw counters at this instant."""
+        cpus = []
+        for line in _read_proc("stat").splitlines():
+            if not line.startswith("cpu"):
+                break
+            fields = [int(x) for x in line.split()[1:9]]
+            cpus.append((sum(fields), fields[3] + fields[4]))  # (total, idle + iowait)
+
+        mem = {}
+        for line in _read_proc("meminfo").splitlines():
+            key, _, rest = line.partition(":")
+            mem[key] = int(rest.split()[0]) * 1024
+
+        rx = tx = 0
+        for line in _read_proc("net/dev").splitlines()[2:]:
+            iface, _, rest = line.partition(":")
+            if iface.strip() == "lo":
+                continue
+            fields = rest.split()
+            rx += int(fields[0])
+            tx += int(fields[8])
+
+        rd = wr = 0
+        for line in _read_proc("diskstats").splitlines():
+            fields = line.split()
+            if fields[2] in self._disks:
+                rd += int(fields[5]) * 512
+                wr += int(fields[9]) * 512
+
+        st = os.statvfs(self.mount)
+        return {
+            "time":   time.monotonic(),
+            "uptime": float(_read_proc("uptime").split()[0]),
+            "load":   tuple(float(x) for x in _read_proc("loadavg").split()[:3]),
+            "cpus":   cpus,
+            "mem":    mem,
+            "net":    (rx, tx),
+            "io":     (rd, wr),
+            "disk":   (st.f_blocks * st.f_frsize, (st.f_blocks - st.f_bfree) * st.f_frsize),
+        }
+
+    def snapshot(self) -> dict:
+        """Current metrics, with rates computed since the previous snapshot."""
+        cur = self.sample()
+        with self._lock:
+            prev, self._prev = self._prev, cur
+        if prev is None:
+            # No previous sample yet: CPU since boot, I/O averaged over uptime
+            prev = {"time": cur["time"] - cur["uptime"], "net": (0, 0), "io": (0, 0),
+                    "cpus": [(0, 0)] * len(cur["cpus"])}
+        elapsed = max(cur["time"] - prev["time"], 1e-6)
+
+        def busy(now: tuple, before: tuple) -> float:
+            total = now[0] - before[0]
+            return 100.0 * (1 - (now[1] - before[1]) / total) if total > 0 else 0.0
+
+        usage = [busy(c, p) for c, p in zip(cur["cpus"], prev["cpus"])]
+        mem = cur["mem"]
+        return {
+            "uptime":     cur["uptime"],
+            "load":       cur["load"],
+            "cpu":        usage[0],
+            "cores":      usage[1:],
+            "mem_total":  mem.get("MemTotal", 0),
+            "mem_used":   mem.get("MemTotal", 0) - mem.get("MemAvailable", mem.get("MemFree", 0)),
+            "swap_total": mem.get("SwapTotal", 0),
+            "swap_used":  mem.get("SwapTotal", 0) - mem.get("SwapFree", 0),
+            "disk_total": cur["disk"][0],
+            "disk_used":  cur["disk"][1],
+            "net_rx":     (cur["net"][0] - prev["net"][0]) / elapsed,
+            "net_tx":     (cur["net"][1] - prev["net"][1]) / elapsed,
+            "io_read":    (cur["io"][0] - prev["io"][0]) / elapsed,
+            "io_write":   (cur["io"][1] - prev["io"][1]) / elapsed,
+        }
+
+
+metrics = MetricsCollector()
+
+
+def derived_metrics(snap: dict) -> dict:
+    """Flatten a snapshot into the scalar series used by /stats and alert rules."""
+    return {
+        "cpu":      snap["cpu"],
+        "mem":      100.0 * snap["mem_used"] / max(snap["mem_total"], 1),
+        "swap":     100.0 * snap["swap_used"] / snap["swap_total"] if snap["swap_total"] else 0.0,
+        "disk":     100.0 * snap["disk_used"] / max(snap["disk_total"], 1),
+        "load":     snap["load"][0],
+        "net_rx":   snap["net_rx"],
+        "net_tx":   snap["net_tx"],
+        "io_read":  snap["io_read"],
+        "io_write": snap["io_write"],
     }
-    if action not in action_map:
-        return f"Unknown action '{action}'. Use: minimize | maximize | close | activate"
 
-    _, err = run_command(action_map[action])
-    return f"Error: {err}" if err else f"Action '{action}' applied to '{window_title}'."
+
+class MetricsHistory:
+    """
+    Fixed-size time series: one float32 column per metric plus a timestamp
+    column, used as a ring. Memory is allocated once — `nbytes` is known
+    before the first sample.
+    """
+
+    SERIES = ("cpu", "mem", "disk", "load", "net_rx", "net_tx", "io_read", "io_write")
+
+    def __init__(self, slots: int) -> None:
+        self._data  = np.full((slots, len(self.SERIES)), np.nan, dtype=np.float32)
+        self._times = np.zeros(slots, dtype=np.float64)
+        self._next  = 0
+        self._count = 0
+        self._lock  = threading.Lock()
+
+    @property
+    def nbytes(self) -> int:
+        return self._data.nbytes + self._times.nbytes
+
+    def append(self, when: float, values: dict) -> None:
+        row = tuple(values[name] for name in self.SERIES)
+        with self._lock:
+            self._data[self._next]  = row
+            self._times[self._next] = when
+            self._next  = (self._next + 1) % len(self._times)
+            self._count = min(self._count + 1, len(self._times))
+
+    def window(self, seconds: float) -> tuple[np.ndarray, dict]:
+        """(timestamps, {series: values}) of the last `seconds`, oldest first."""
+        with self._lock:
+            order = (np.arange(self._count) + self._next - self._count) % len(self._times)
+            times, data = self._times[order], self._data[order]
+        keep = times >= time.time() - seconds
+        return times[keep], {name: data[keep, i] for i, name in enumerate(self.SERIES)}
+
+
+class MetricsSampler:
+    """
+    Background thread appending one snapshot per `interval` to a
+    MetricsHistory. Each sample is also passed to every `listeners` callback
+    as (timestamp, derived_metrics) — the alert engine hooks in there.
+    """
+
+    def __init__(self, interval: int = STATS_INTERVAL, hours: int = STATS_HOURS) -> None:
+        self.interval  = max(1, interval)  # 0 would spin and divide by zero below
+        self.history   = MetricsHistory(max(1, hours * 3600 // self.interval))
+        self.collector = MetricsCollector()  # own delta state, independent of /sysinfo
+        self.listeners: list[Callable[[float, dict], None]] = []
+        self._stop     = threading.Event()
+        self._thread   = threading.Thread(target=self._run, name="dm-bot-sampler", daemon=True)
+
+    def _run(self) -> None:
+        self.collector.snapshot()
+        while not self._stop.wait(self.interval):
+            now = time.time()
+            try:
+                values = derived_metrics(self.collector.snapshot())
+            except OSError as exc:
+                log.warning("DM-Bot: metrics sample failed — %s", exc)
+                continue
+            self.history.append(now, values)
+            for listener in self.listeners:
+                try:
+                    listener(now, values)
+                except Exception as exc:
+                    log.error("DM-Bot: metrics listener failed — %s", exc)
+
+    def start(self) -> None:
+        self._thread.start()
+        log.info("DM-Bot: metrics history %dh @ %ds (%d KB).",
+                 STATS_HOURS, self.interval, self.history.nbytes >> 10)
+
+    def stop(self) -> None:
+        self._stop.set()
+
+
+sampler: Optional[MetricsSampler] = None
+
+
+class AlertRule:
+    """
+    `metric` above `above` for at least `duration` seconds fires once; the
+    rule re-arms only after the value drops below `clear` (hysteresis), and
+    never fires again within `cooldown` seconds. State is updated per sample
+    in O(1) — no history is rescanned.
+    """
+
+    def __init__(self, name: str, metric: str, above: float, clear: Optional[float] = None,
+                 duration: int = 0, cooldown: int = ALERT_COOLDOWN) -> None:
+        self.name     = name
+        self.metric   = metric
+        self.above    = above
+        self.clear    = above if clear is None else clear
+        self.duration = duration
+        self.cooldown = cooldown
+        self.firing   = False
+        self._since: Optional[float] = None
+        self._last_fired = float("-inf")
+
+    def update(self, when: float, value: float) -> Optional[str]:
+        """Feed one sample; return "fire", "clear" or None."""
+        if self.firing:
+            if value < self.clear:
+                self.firing, self._since = False, None
+                return "clear"
+            return None
+        if value <= self.above:
+            self._since = None
+            return None
+        if self._since is None:
+            self._since = when
+        if when - self._since >= self.duration and when - self._last_fired >= self.cooldown:
+            self.firing, self._last_fired = True, when
+            return "fire"
+        return None
+
+    def describe(self) -> str:
+        hold = f" for {self.duration // 60}m" if self.duration >= 60 else ""
+        state = "🔴 firing" if self.firing else "🟢 ok"
+        return f"{state} · {self.name}: {self.metric} > {self.above:g}{hold} (clears < {self.clear:g})"
+
+
+def default_alert_rules() -> list[AlertRule]:
+    cores = os.cpu_count() or 1
+    return [
+        AlertRule("CPU busy",    "cpu",  90, clear=80, duration=300),
+        AlertRule("Memory full", "mem",  95, clear=90, duration=120),
+        AlertRule("Disk / full", "disk", 95, clear=92),
+        AlertRule("High load",   "load", cores * 2, clear=cores * 1.5, duration=300),
+    ]
+
+
+def load_alert_rules() -> list[AlertRule]:
+    """Rules from alerts.json (a list of AlertRule keyword dicts), else the defaults."""
+    try:
+        with open(ALERTS_FILE) as f:
+            rules = [AlertRule(**spec) for spec in json.load(f)]
+        log.info("Loaded %d alert rule(s).", len(rules))
+        return rules
+    except FileNotFoundError:
+        return default_alert_rules()
+    except (json.JSONDecodeError, TypeError) as exc:
+        log.error("Invalid alerts.json (%s) — using default rules.", exc)
+        return default_alert_rules()
+
+
+class AlertEngine:
+    """
+    Evaluates every rule against each metrics sample. All transitions caused
+    by one sample are coalesced into a single message sent to every
+    authorized user.
+    """
+
+    def __init__(self, rules: list[AlertRule]) -> None:
+        self.rules = rules
+        self._lock = threading.Lock()
+
+    def feed(self, when: float, values: dict) -> None:
+        events = []
+        with self._lock:
+            for rule in self.rules:
+                if rule.metric not in values:
+                    continue
+                value = values[rule.metric]
+                event = rule.update(when, value)
+                if event == "fire":
+                    events.append(f"🔴 {rule.name}: {rule.metric} at {value:.1f} (> {rule.above:g})")
+                elif event == "clear":
+                    events.append(f"🟢 {rule.name} recovered: {rule.metric} at {value:.1f}")
+        if events:
+            self.notify("🚨 DM-Bot alert\n" + "\n".join(events))
+
+    @staticmethod
+    def notify(text: str) -> None:
+        log.warning("DM-Bot: %s", text.replace("\n", " | "))
+
+        def report(future: Future, tid: str) -> None:
+            if future.exception() is not None:
+                log.error("DM-Bot: alert to %s failed — %s", tid, future.exception())
+
+        for tid in list(AUTHORIZED_USERS):  # queued for all users at once, paced per chat
+            bot.send_later(int(tid), text, OUTBOX_NOTIFY).add_done_callback(partial(report, tid=tid))
+
+
+alerts: Optional[AlertEngine] = None
+
+
+def format_metric(value: float, fmt: Optional[str]) -> str:
+    """One /stats figure: `fmt` or a B/s rate, "–" for a missing (NaN) sample."""
+    if np.isnan(value):
+        return "–"
+    return fmt.format(value) if fmt else _human(float(value), "B/s")
+
+
+def _nanpeak(values: np.ndarray) -> float:
+    return float(np.nanmax(values)) if np.any(~np.isnan(values)) else np.nan
+
+
+def sparkline(values: np.ndarray, width: int = 30) -> str:
+    """Bucket-average `values` into `width` block characters scaled to their maximum."""
+    if not len(values) or np.all(np.isnan(values)):
+        return ""
+    buckets = [b for b in np.array_split(values, min(width, len(values))) if len(b)]
+    means = np.array([np.nanmean(b) if not np.all(np.isnan(b)) else np.nan for b in buckets])
+    top = np.nanmax(means) or 1.0
+    idx = np.clip(np.nan_to_num(means / top * (len(SPARK_CHARS) - 1), nan=0), 0, len(SPARK_CHARS) - 1)
+    return "".join(" " if np.isnan(m) else SPARK_CHARS[int(round(i))] for m, i in zip(means, idx))
+
+
+def render_stats_chart(times: np.ndarray, series: dict, seconds: float) -> bytes:
+    """Small multi-panel line chart drawn with Pillow straight from the history arrays."""
+    panels = [
+        ("CPU %",  [("cpu", (90, 170, 250))], 100.0, "{:.0f}%"),
+        ("RAM %",  [("mem", (120, 220, 140))], 100.0, "{:.0f}%"),
+        ("Disk %", [("disk", (200, 140, 230))], 100.0, "{:.0f}%"),
+        ("Load",   [("load", (250, 190, 80))], None, "{:.2f}"),
+        ("Net rx/tx", [("net_rx", (90, 170, 250)), ("net_tx", (250, 110, 110))], None, None),
+    ]
+    width, panel_h, pad = 720, 110, 8
+    img  = Image.new("RGB", (width, len(panels) * panel_h), (24, 26, 30))
+    draw = ImageDraw.Draw(img)
+    end  = time.time()
+    x    = (times - (end - seconds)) / seconds * (width - 2 * pad) + pad
+    for n, (title, lines, vmax, fmt) in enumerate(panels):
+        top, bottom = n * panel_h + 22, (n + 1) * panel_h - pad
+        draw.rectangle((pad, top, width - pad, bottom), outline=(70, 74, 80))
+        peak = max((_nanpeak(series[k]) for k, _ in lines if np.any(~np.isnan(series[k]))), default=np.nan)
+        scale = vmax or (np.nan_to_num(peak) * 1.1 or 1.0)
+        for key, colour in lines:
+            values = series[key]
+            y = bottom - np.clip(values / scale, 0, 1) * (bottom - top)
+            points = [(float(px), float(py)) for px, py, v in zip(x, y, values) if not np.isnan(v)]
+            if len(points) > 1:
+                draw.line(points, fill=colour, width=2)
+        label = " / ".join(format_metric(series[k][-1], fmt) for k, _ in lines if len(series[k]))
+        draw.text((pad, n * panel_h + 6), f"{title}  {label}  (max {format_metric(peak, fmt)})",
+                  fill=(220, 220, 220))
+    buf = io.BytesIO()
+    img.save(buf, format="PNG", compress_level=6)
+    return buf.getvalue()
+
+
+def parse_window(arg: str) -> Optional[int]:
+    """`30m`, `6h`, `1d` → seconds."""
+    units = {"m": 60, "h": 3600, "d": 86400}
+    if len(arg) > 1 and arg[-1] in units and arg[:-1].isdigit():
+        return int(arg[:-1]) * units[arg[-1]]
+    return None
+
+
+class ProcessScanner:
+    """
+    /proc/<pid>/stat scanner for /top. The previous CPU jiffies (and I/O
+    bytes) of every PID are cached, so CPU% is a delta since the last scan
+    rather than a sampled sleep; on the first scan it is the lifetime average.
+    Entries are keyed by (pid, starttime) so a reused PID never inherits
+    another process's counters. Each process costs one read (two for `io`).
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._prev: dict = {}
+        self._prev_time = 0.0
+
+    @staticmethod
+    def _read(path: str) -> Optional[bytes]:
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except OSError:
+            return None
+        try:
+            return os.read(fd, 4096)
+        except OSError:
+            return None
+        finally:
+            os.close(fd)
+
+    @classmethod
+    def _io_bytes(cls, pid: str) -> Optional[int]:
+        raw = cls._read(f"/proc/{pid}/io")
+        if raw is None:
+            return None  # other users' processes are unreadable without root
+        total = 0
+        for line in raw.split(b"\n"):
+            if line.startswith((b"read_bytes:", b"write_bytes:")):
+                total += int(line.split()[1])
+        return total
+
+    def scan(self, with_io: bool = False) -> list[dict]:
+        uptime = float(_read_proc("uptime").split()[0])
+        now = time.monotonic()
+        with self._lock:
+            elapsed = now - self._prev_time if self._prev else 0.0
+            current, procs = {}, []
+            for entry in os.scandir("/proc"):
+                if not entry.name.isdigit():
+                    continue
+                raw = self._read(f"/proc/{entry.name}/stat")
+                if not raw:
+                    continue
+                head, _, tail = raw.rpartition(b")")
+                fields = tail.split()
+                jiffies = int(fields[11]) + int(fields[12])
+                start   = int(fields[19])
+                key     = (entry.name, start)
+                io      = self._io_bytes(entry.name) if with_io else None
+                current[key] = (jiffies, io)
+
+                prev = self._prev.get(key) if elapsed > 0 else None
+                age  = max(uptime - start / CLK_TCK, 1e-3)
+                if prev:
+                    cpu = 100.0 * (jiffies - prev[0]) / (elapsed * CLK_TCK)
+                else:
+                    cpu = 100.0 * jiffies / CLK_TCK / age
+                if io is None:
+                    io_rate = None
+                elif prev and prev[1] is not None:
+                    io_rate = (io - prev[1]) / elapsed
+                else:
+                    io_rate = io / age
+                procs.append({
+                    "pid":   int(entry.name),
+                    "start": start,
+                    "name":  head.partition(b"(")[2].decode(errors="replace"),
+                    "cpu":   cpu,
+                    "rss":   int(fields[21]) * PAGE_SIZE,
+                    "io":    io_rate,
+                })
+            self._prev, self._prev_time = current, now
+        return procs
+
+    def top(self, n: int = TOP_DEFAULT, key: str = "cpu") -> list[dict]:
+        procs = self.scan(with_io=key == "io")
+        sort_key = {"cpu": lambda p: p["cpu"], "mem": lambda p: p["rss"],
+                    "io": lambda p: p["io"] or 0.0}[key]
+        return sorted(procs, key=sort_key, reverse=True)[:n]
+
+
+processes = ProcessScanner()
+
+
+def _human(n: float, suffix: str = "B") -> str:
+    """SI units, as `free -h --si` prints them."""
+    for unit in ("", "k", "M", "G", "T"):
+        if abs(n) < 1000:
+            return f"{n:.1f} {unit}{suffix}" if unit else f"{n:.0f} {suffix}"
+        n /= 1000
+    return f"{n:.1f} P{suffix}"
+
+
+def _human_uptime(seconds: float) -> str:
+    minutes = int(seconds // 60)
+    days, minutes  = divmod(minutes, 1440)
+    hours, minutes = divmod(minutes, 60)
+    parts = [f"{v} {name}{'s' if v != 1 else ''}"
+             for v, name in ((days, "day"), (hours, "hour"), (minutes, "minute")) if v]
+    return "up " + (", ".join(parts) or "0 minutes")
 
 
 def get_system_info() -> str:
     """Return a brief system status block."""
-    lines = [f"🖥  *DM-Bot — System Info*\n"]
+    try:
+        m = metrics.snapshot()
+    except OSError as exc:
+        log.error("DM-Bot: reading /proc failed — %s", exc)
+        return "Could not retrieve system info."
+
+    cores = m["cores"]
+    if len(cores) <= 16:
+        per_core = " · ".join(f"{c:.0f}" for c in cores)
+    else:
+        per_core = f"min {min(cores):.0f} · max {max(cores):.0f}"
+    lines = [
+        "🖥  *DM-Bot — System Info*\n",
+        f"⏱ Uptime: {_human_uptime(m['uptime'])}",
+        f"🧠 RAM: {_human(m['mem_used'])} used / {_human(m['mem_total'])} total",
+    ]
+    if m["swap_total"]:
+        lines.append(f"🔁 Swap: {_human(m['swap_used'])} used / {_human(m['swap_total'])} total")
+    lines += [
+        f"💾 Disk ({metrics.mount}): {_human(m['disk_used'])} used / {_human(m['disk_total'])} total",
+        f"🔲 CPU: {m['cpu']:.1f}% ({len(cores)} cores: {per_core})",
+        f"📈 Load: {m['load'][0]:.2f} {m['load'][1]:.2f} {m['load'][2]:.2f}",
+        f"🌐 Net: ↓ {_human(m['net_rx'], 'B/s')} · ↑ {_human(m['net_tx'], 'B/s')}",
+        f"📀 Disk I/O: read {_human(m['io_read'], 'B/s')} · write {_human(m['io_write'], 'B/s')}",
+    ]
+    return "\n".join(lines)
 
-    uptime, _ = run_command(["uptime", "-p"])
-    if uptime:
-        lines.append(f"⏱ Uptime: {uptime}")
+# ─────────────────────────────────────────────────────────────────────────────
+# Media uploads
+# ─────────────────────────────────────────────────────────────────────────────
 
-    mem, _ = run_command(["free", "-h", "--si"])
-    for line in (mem or "").splitlines():
-        if line.startswith("Mem:"):
-            parts = line.split()
-            lines.append(f"🧠 RAM: {parts[2]} used / {parts[1]} total")
+def make_http_session(pool_size: int = HTTP_POOL_SIZE) -> requests.Session:
+    """
+    One keep-alive session shared by every thread that talks to the Bot API.
+    Left alone, telebot gives each thread a session of its own, so every
+    lane worker opens (and TLS-handshakes) its own connection. Retries are
+    left to UploadManager, which knows which calls are safe to repeat.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_size, max_retries=0)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def media_key(kind: str, payload) -> str:
+    """Cache key for bytes or a file: the send method plus a hash of the encoded content."""
+    digest = hashlib.blake2b(digest_size=16)
+    if isinstance(payload, bytes):
+        digest.update(payload)
+    else:
+        with open(payload, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+    return f"{kind}:{digest.hexdigest()}"
 
-    disk, _ = run_command(["df", "-h", "--output=used,size,target", "/"])
-    for line in (disk or "").splitlines()[1:]:
-        parts = line.split()
-        if len(parts) >= 3:
-            lines.append(f"💾 Disk (/): {parts[0]} used / {parts[1]} total")
 
-    cpu, _ = run_command(["top", "-bn1"])
-    for line in (cpu or "").splitlines():
-        if "%Cpu" in line or "Cpu(s)" in line:
-            lines.append(f"🔲 CPU: {line.strip()}")
-            break
+def message_file_id(message) -> Optional[str]:
+    """file_id of the media a sent message carries (largest photo size)."""
+    if message is None:
+        return None
+    for media in (message.photo[-1] if message.photo else None, message.video,
+                  message.animation, message.document):
+        if media is not None:
+            return media.file_id
+    return None
+
+
+class FileIdCache:
+    """
+    LRU map of media_key() → the file_id Telegram returned for that upload,
+    so byte-identical media (an unchanged screen, the same video sent to a
+    second chat) is re-sent by reference instead of uploaded again. Entries
+    expire after `ttl` seconds; the map is saved to DATA_DIR on every change.
+    """
+
+    def __init__(self, path: Path = FILE_ID_CACHE_FILE, size: int = FILE_ID_CACHE_SIZE,
+                 ttl: int = FILE_ID_CACHE_TTL) -> None:
+        self.path    = path
+        self.size    = size
+        self.ttl     = ttl
+        self.hits    = 0
+        self.misses  = 0
+        self._lock   = threading.Lock()
+        self._entries: OrderedDict[str, tuple[str, float]] = OrderedDict()  # oldest use first
+
+    def load(self) -> None:
+        try:
+            with open(self.path) as f:
+                entries = json.load(f)
+        except FileNotFoundError:
+            return
+        except Exception as exc:
+            log.error("Failed to load the file_id cache: %s", exc)
+            return
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            self._entries = OrderedDict((key, (file_id, stored)) for key, (file_id, stored) in entries.items()
+                                        if stored > cutoff)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+        log.info("DM-Bot: %d cached file_id(s) loaded.", len(self._entries))
+
+    def _save(self) -> None:
+        try:
+            tmp = self.path.with_suffix(".tmp")
+            with open(tmp, "w") as f:
+                json.dump(self._entries, f)
+            tmp.replace(self.path)
+        except Exception as exc:
+            log.error("Failed to save the file_id cache: %s", exc)
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] < time.time() - self.ttl:
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: str, file_id: Optional[str]) -> None:
+        if not file_id or self.size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (file_id, time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+            self._save()
+
+    def discard(self, key: str) -> None:
+        with self._lock:
+            if self._entries.pop(key, None) is not None:
+                self._save()
+
+    def describe(self) -> str:
+        with self._lock:
+            return f"{len(self._entries)}/{self.size} cached, {self.hits} hits, {self.misses} misses"
+
+
+file_ids = FileIdCache()
+
+
+class UploadManager:
+    """
+    Sends photos, videos and documents with retries. Network errors, 429s
+    and 5xx answers are retried with full-jitter exponential backoff (a 429
+    waits the retry_after Telegram asks for). The Bot API cannot resume an
+    upload, so each attempt re-sends the whole file; if all of them fail
+    the file is moved to `spool` and offered for a retry until it expires,
+    instead of being deleted. Size, time and throughput of every delivered
+    upload are recorded. Media already in `file_ids` is sent by reference.
+    """
+
+    MAGIC = ((b"\x89PNG", ".png"), (b"\xff\xd8", ".jpg"), (b"RIFF", ".webp"))  # kept bytes → file suffix
+
+    def __init__(self, spool: Path = UPLOAD_DIR, attempts: int = UPLOAD_ATTEMPTS,
+                 backoff: float = UPLOAD_BACKOFF, keep: int = UPLOAD_KEEP, window: int = 50,
+                 file_ids: Optional[FileIdCache] = None) -> None:
+        self.spool    = spool
+        self.attempts = max(1, attempts)
+        self.backoff  = backoff
+        self.keep     = keep
+        self.file_ids = file_ids
+        self.kept     = 0
+        self.reused   = 0
+        self.history  = deque(maxlen=window)  # one dict per delivered upload
+        self._lock    = threading.Lock()
+
+    def delay(self, exc: Exception, attempt: int) -> Optional[float]:
+        """Seconds to wait after failed attempt `attempt` (0-based), or None if retrying won't help."""
+        if isinstance(exc, telebot.apihelper.ApiTelegramException):
+            if exc.error_code == 429:
+                return float(exc.result_json.get("parameters", {}).get("retry_after", self.backoff))
+            if exc.error_code < 500:
+                return None
+        elif isinstance(exc, telebot.apihelper.ApiHTTPException):
+            if exc.result.status_code < 500:
+                return None
+        elif not isinstance(exc, RequestException):
+            return None
+        return random.uniform(0, min(UPLOAD_BACKOFF_MAX, self.backoff * 2 ** attempt))
+
+    def call(self, fn: Callable, *args, **kwargs) -> tuple:
+        """Run a Bot API call under the retry policy: (result, attempts), or the last error is raised."""
+        for attempt in range(self.attempts):
+            try:
+                return fn(*args, **kwargs), attempt + 1
+            except Exception as exc:
+                delay = self.delay(exc, attempt)
+                if delay is None or attempt + 1 == self.attempts:
+                    raise
+                log.warning("DM-Bot: upload attempt %d/%d failed (%s) — retrying in %.1fs.",
+                            attempt + 1, self.attempts, exc, delay)
+                time.sleep(delay)
+
+    def send(self, chat_id: int, kind: str, payload, caption: Optional[str] = None, **kwargs) -> bool:
+        """
+        Upload `payload` — bytes, or the path of a file the manager takes
+        over — with bot.send_<kind>. A delivered file is deleted; one that
+        could not be delivered is kept and the chat gets a retry button.
+        """
+        self.expire()
+        method = getattr(bot, f"send_{kind}")
+        size   = len(payload) if isinstance(payload, bytes) else os.path.getsize(payload)
+        key    = media_key(kind, payload) if self.file_ids is not None else None
+        if key and self.resend(key, method, chat_id, caption=caption, **kwargs):
+            if not isinstance(payload, bytes):
+                Path(payload).unlink(missing_ok=True)
+            return True
+
+        def attempt():
+            bot.pace(chat_id)
+            if isinstance(payload, bytes):
+                return method(chat_id, payload, caption=caption, **kwargs)
+            with open(payload, "rb") as f:  # reopened per attempt: a failed one leaves it half-read
+                return method(chat_id, f, caption=caption, **kwargs)
+
+        t0 = time.monotonic()
+        try:
+            message, attempts = self.call(attempt)
+        except Exception as exc:
+            log.error("DM-Bot: %s upload to %s failed — %s", kind, chat_id, exc)
+            self._offer_retry(chat_id, self._keep(chat_id, kind, payload, caption, kwargs), exc)
+            return False
+        self.record(kind, size, time.monotonic() - t0, attempts)
+        if key:
+            self.file_ids.put(key, message_file_id(message))
+        if not isinstance(payload, bytes):
+            Path(payload).unlink(missing_ok=True)
+        return True
+
+    def resend(self, key: str, method: Callable, chat_id: int, **kwargs) -> bool:
+        """Send cached media by file_id; False (and the entry dropped if Telegram refused it) on a miss."""
+        file_id = self.file_ids.get(key)
+        if file_id is None:
+            return False
+
+        def attempt():
+            bot.pace(chat_id)
+            return method(chat_id, file_id, **kwargs)
 
-    return "\n".join(lines) if len(lines) > 1 else "Could not retrieve system info."
+        try:
+            self.call(attempt)
+        except Exception as exc:
+            log.info("DM-Bot: re-sending %s by file_id failed (%s) — uploading it.", key.split(":")[0], exc)
+            if isinstance(exc, telebot.apihelper.ApiTelegramException) and exc.error_code == 400:
+                self.file_ids.discard(key)
+            return False
+        with self._lock:
+            self.reused += 1
+        return True
+
+    def retry(self, upload_id: str) -> Optional[bool]:
+        """Re-send a kept upload; None if it has expired or is already being retried."""
+        self.expire()
+        meta_file = self.spool / f"{upload_id}.json"
+        with self._lock:
+            try:
+                meta = json.loads(meta_file.read_text())
+                meta_file.unlink()
+            except (OSError, ValueError):
+                return None
+        return self.send(meta["chat_id"], meta["kind"], meta["file"], meta["caption"], **meta["kwargs"])
+
+    def expire(self) -> None:
+        """Delete kept uploads older than `keep` seconds."""
+        cutoff = time.time() - self.keep
+        for meta_file in self.spool.glob("*.json"):
+            try:
+                meta = json.loads(meta_file.read_text())
+                if meta["kept"] > cutoff:
+                    continue
+                Path(meta["file"]).unlink(missing_ok=True)
+                meta_file.unlink(missing_ok=True)
+                log.info("DM-Bot: kept upload %s expired.", meta_file.stem)
+            except (OSError, ValueError, KeyError):
+                continue
+
+    def _keep(self, chat_id: int, kind: str, payload, caption: Optional[str], kwargs: dict) -> Optional[str]:
+        upload_id = secrets.token_hex(4)
+        try:
+            self.spool.mkdir(parents=True, exist_ok=True)
+            if isinstance(payload, bytes):
+                suffix = next((ext for magic, ext in self.MAGIC if payload.startswith(magic)), ".bin")
+                path = self.spool / f"{upload_id}{suffix}"
+                path.write_bytes(payload)
+            else:
+                path = self.spool / f"{upload_id}{Path(payload).suffix}"
+                shutil.move(payload, path)
+            meta = {"chat_id": chat_id, "kind": kind, "file": str(path), "caption": caption,
+                    "kwargs": kwargs, "kept": time.time()}
+            (self.spool / f"{upload_id}.json").write_text(json.dumps(meta))
+        except OSError as exc:
+            log.error("DM-Bot: could not keep the failed upload — %s", exc)
+            return None
+        with self._lock:
+            self.kept += 1
+        log.info("DM-Bot: failed %s upload kept as %s for %ds.", kind, path.name, self.keep)
+        return upload_id
+
+    def _offer_retry(self, chat_id: int, upload_id: Optional[str], exc: Exception) -> None:
+        markup = None
+        text   = f"❌ DM-Bot: upload failed ({exc})."
+        if upload_id:
+            markup = types.InlineKeyboardMarkup()
+            markup.add(types.InlineKeyboardButton("🔁 Retry upload", callback_data=f"upl:{upload_id}"))
+            text += f" The file is kept for {self.keep // 60} min."
+        try:
+            bot.send_message(chat_id, text, reply_markup=markup)
+        except Exception as err:
+            log.warning("DM-Bot: could not report the failed upload (%s).", err)
+
+    def record(self, kind: str, size: int, seconds: float, attempts: int) -> None:
+        with self._lock:
+            self.history.append({"kind": kind, "bytes": size, "seconds": seconds, "attempts": attempts})
+        log.info("DM-Bot: %s upload, %s in %.2fs — %s%s.", kind, _human(size), seconds,
+                 _human(size / max(seconds, 1e-6), "B/s"),
+                 f" ({attempts} attempts)" if attempts > 1 else "")
+
+    def describe(self) -> str:
+        with self._lock:
+            history, kept, reused = list(self.history), self.kept, self.reused
+        if not history:
+            return f"none uploaded, {reused} re-sent by file ID, {kept} kept" if kept or reused else "no uploads yet"
+        size    = sum(h["bytes"] for h in history)
+        seconds = sum(h["seconds"] for h in history)
+        retried = sum(h["attempts"] > 1 for h in history)
+        last    = history[-1]
+        return (f"last {_human(last['bytes'])} at {_human(last['bytes'] / max(last['seconds'], 1e-6), 'B/s')}; "
+                f"last {len(history)} avg {_human(size / max(seconds, 1e-6), 'B/s')}, "
+                f"{retried} retried, {kept} kept, {reused} re-sent by file ID")
+
+
+uploads = UploadManager(file_ids=file_ids)
 
 # ─────────────────────────────────────────────────────────────────────────────
 # Bot command handlers
 # ─────────────────────────────────────────────────────────────────────────────
 
+def command_args(message: types.Message) -> list[str]:
+    """Arguments after a /command. Menu buttons reuse the handlers and carry none."""
+    text = message.text or ""
+    return text.split()[1:] if text.startswith("/") else []
+
+
 def cmd_start(message: types.Message) -> None:
     tid = str(message.from_user.id)
     if is_authorized(tid):
@@ -432,10 +3119,17 @@ def cmd_help(message: types.Message) -> None:
         "/auth — Authorize (requires access to the machine)\n"
         "/deauth — Revoke your own authorization\n\n"
         "*Screen*\n"
-        "/screenshot — Take a screenshot\n"
-        "/record \\[sec\\] — Record screen (default 10s, max 60s)\n\n"
+        "/screenshot \\[all|overview|n] \\[png|jpeg|webp\\[:q]] — Take a screenshot\n"
+        "/screenshot window <id|title> / region x,y,w,h — Just one window or rectangle\n"
+        "/record \\[sec] \\[720p] \\[preset] \\[vfr] — Record screen (default 10s; over 60s is sent in parts)\n"
+        "/stop \\[id] — Stop a recording and send what was captured\n"
+        "/recordings — Recordings in progress\n"
+        "/replay \\[sec] — Send the last seconds (/replay on|off)\n\n"
         "*System*\n"
         "/sysinfo — CPU, RAM, disk, uptime\n"
+        "/stats \\[1h|6h|24h] \\[text] — Metrics history chart\n"
+        "/top \\[n] \\[cpu|mem|io] — Top processes (with kill buttons)\n"
+        "/alerts — Alert rules and their state\n"
         "/lock — Lock screen\n"
         "/shutdown — Shut down PC (asks confirmation)\n"
         "/reboot — Reboot PC\n\n"
@@ -452,7 +3146,15 @@ def cmd_help(message: types.Message) -> None:
 
 
 def cmd_version(message: types.Message) -> None:
-    bot.reply_to(message, f"*DM-Bot* v{__version__}", parse_mode="Markdown")
+    text = f"*DM-Bot* v{__version__}"
+    if latency:
+        text += f"\nUpdates via {latency.mode}: {latency.describe()}"
+        text += "\nHandler lanes:\n" + "\n".join(f"• {line}" for line in lanes.describe())
+    text += f"\nUploads: {uploads.describe()}"
+    text += f"\nFile ID cache: {file_ids.describe()}"
+    if bot.outbox is not None:
+        text += f"\nOutbox: {bot.outbox.describe()}"
+    bot.reply_to(message, text, parse_mode="Markdown")
 
 
 def cmd_auth(message: types.Message) -> None:
@@ -526,51 +3228,275 @@ def cmd_deauth(message: types.Message) -> None:
     log.info("DM-Bot: user %s deauthorized themselves.", tid)
 
 
+def send_image(chat_id: int, data: bytes, fmt: str, caption: str) -> None:
+    if len(data) > PHOTO_MAX_BYTES:
+        # Too large for a photo — send it uncompressed as a document instead
+        uploads.send(chat_id, "document", data, caption,
+                     visible_file_name=f"dm-bot-screenshot-{int(time.time())}.{fmt}")
+        return
+    uploads.send(chat_id, "photo", data, caption)
+
+
+def send_album(chat_id: int, images: list[bytes], fmt: str) -> None:
+    """Deliver per-monitor screenshots as one album (documents if any is too large)."""
+    as_docs = any(len(data) > PHOTO_MAX_BYTES for data in images)
+    keys    = [media_key("document" if as_docs else "photo", data) for data in images]
+
+    def send_group(start: int, cached: bool) -> int:
+        """Send one album; returns the bytes actually uploaded."""
+        bot.pace(chat_id)
+        media = []  # rebuilt per attempt: a failed one leaves the BytesIO streams consumed
+        uploaded = 0
+        for n, data in enumerate(images[start:start + ALBUM_MAX_PHOTOS], start + 1):
+            caption = f"📸 DM-Bot — monitor {n}"
+            file_id = file_ids.get(keys[n - 1]) if cached else None
+            uploaded += 0 if file_id else len(data)
+            if as_docs:
+                media.append(types.InputMediaDocument(
+                    file_id or types.InputFile(io.BytesIO(data), file_name=f"dm-bot-monitor-{n}.{fmt}"),
+                    caption=caption,
+                ))
+            else:
+                media.append(types.InputMediaPhoto(file_id or data, caption=caption))
+        sent = bot.send_media_group(chat_id, media)
+        for key, message in zip(keys[start:start + ALBUM_MAX_PHOTOS], sent):
+            file_ids.put(key, message_file_id(message))
+        return uploaded
+
+    for start in range(0, len(images), ALBUM_MAX_PHOTOS):
+        t0 = time.monotonic()
+        try:
+            try:
+                uploaded, attempts = uploads.call(send_group, start, True)
+            except telebot.apihelper.ApiTelegramException as exc:
+                if exc.error_code != 400:
+                    raise
+                # Most likely a stale cached file_id — upload the whole group instead
+                uploaded, attempts = uploads.call(send_group, start, False)
+        except Exception as exc:
+            # One upload per image instead: those keep what still fails for a retry
+            log.warning("DM-Bot: album upload failed (%s) — sending the images one by one.", exc)
+            for n, data in enumerate(images[start:start + ALBUM_MAX_PHOTOS], start + 1):
+                send_image(chat_id, data, fmt, f"📸 DM-Bot — monitor {n}")
+            continue
+        if uploaded:
+            uploads.record("album", uploaded, time.monotonic() - t0, attempts)
+
+
+SCREENSHOT_USAGE = ("Usage: /screenshot [all|overview|<monitor>|window <id|title>|region x,y,w,h] "
+                    "[png|jpeg|webp[:quality]]")
+
+
 @authorized
 def cmd_screenshot(message: types.Message) -> None:
+    fmt, quality = SCREENSHOT_FORMAT, None
+    target = "1"
+    args = command_args(message)
+    if args and args[0].lower() in ("window", "region") and len(args) > 2:
+        # A window title may contain spaces, so only the last word can be a format
+        spec = parse_image_format(args[-1])
+        if spec is not None:
+            fmt, quality = spec
+            args.pop()
+
+    if args and args[0].lower() == "window":
+        if len(args) < 2:
+            bot.reply_to(message, SCREENSHOT_USAGE)
+            return
+        bot.send_chat_action(message.chat.id, "upload_photo")
+        data, window, err = take_window_screenshot(" ".join(args[1:]), fmt, quality)
+        if err:
+            bot.reply_to(message, f"❌ {err}")
+            return
+        send_image(message.chat.id, data, fmt, f"📸 DM-Bot — {window['title'] or hex(window['id'])}")
+        return
+
+    if args and args[0].lower() == "region":
+        region = parse_region(args[1]) if len(args) == 2 else None
+        if region is None:
+            bot.reply_to(message, SCREENSHOT_USAGE)
+            return
+        bot.send_chat_action(message.chat.id, "upload_photo")
+        data, err = take_region(region, fmt, quality)
+        if err:
+            bot.reply_to(message, f"❌ {err}")
+            return
+        send_image(message.chat.id, data, fmt, "📸 DM-Bot — region {left},{top} {width}×{height}".format(**region))
+        return
+
+    for arg in args:
+        spec = parse_image_format(arg)
+        if spec is not None:
+            fmt, quality = spec
+        elif arg.lower() in ("all", "overview") or arg.isdigit():
+            target = arg.lower()
+        else:
+            bot.reply_to(message, SCREENSHOT_USAGE)
+            return
+    # Monitor 0 is the whole virtual desktop in mss; that is what `overview` is for
+    if target.isdigit() and not 1 <= int(target) <= monitor_count():
+        bot.reply_to(message, f"❌ DM-Bot: no monitor {target} (found {monitor_count()}).\n{SCREENSHOT_USAGE}")
+        return
+
     bot.send_chat_action(message.chat.id, "upload_photo")
-    path, err = take_screenshot()
+    if target == "all":
+        images, err = take_screenshots(fmt, quality)
+        if err:
+            bot.reply_to(message, f"❌ {err}")
+        elif len(images) == 1:
+            send_image(message.chat.id, images[0], fmt, "📸 DM-Bot screenshot")
+        else:
+            send_album(message.chat.id, images, fmt)
+        return
+
+    if target == "overview":
+        data, err = take_overview(fmt, quality)
+        caption = "📸 DM-Bot — all monitors"
+    else:
+        data, err = take_screenshot(fmt, quality, monitor=int(target))
+        caption = "📸 DM-Bot screenshot" if target == "1" else f"📸 DM-Bot — monitor {target}"
     if err:
         bot.reply_to(message, f"❌ {err}")
         return
-    try:
-        with open(path, "rb") as f:
-            bot.send_photo(message.chat.id, f, caption="📸 DM-Bot screenshot")
-    finally:
-        Path(path).unlink(missing_ok=True)
+    send_image(message.chat.id, data, fmt, caption)
+
+
+RECORD_USAGE = "Usage: /record [seconds] [720p] [ultrafast|veryfast|fast|...] [vfr|cfr]"
 
 
 @authorized
 def cmd_record(message: types.Message) -> None:
-    global VIDEO_RECORDING
-    if VIDEO_RECORDING:
-        bot.reply_to(message, "⚠️ DM-Bot: a recording is already in progress.")
+    duration, height, preset, vfr = VIDEO_DEFAULT_DURATION, None, None, VIDEO_VFR
+    for arg in command_args(message):
+        arg = arg.lower()
+        if arg.isdigit():
+            duration = int(arg)
+        elif arg.endswith("p") and arg[:-1].isdigit():
+            height = int(arg[:-1])
+        elif arg in X264_PRESETS:
+            preset = arg
+        elif arg in ("vfr", "cfr"):
+            vfr = arg == "vfr"
+        else:
+            bot.reply_to(message, RECORD_USAGE)
+            return
+    if height is not None and height < VIDEO_MIN_HEIGHT:
+        bot.reply_to(message, f"❌ DM-Bot: the lowest recording height is {VIDEO_MIN_HEIGHT}p.\n{RECORD_USAGE}")
         return
 
-    args = message.text.split()
-    duration = VIDEO_DEFAULT_DURATION
-    if len(args) > 1:
-        try:
-            duration = int(args[1])
-        except ValueError:
-            bot.reply_to(message, "Usage: /record [seconds]")
-            return
+    segmented = duration > VIDEO_MAX_DURATION
+    duration  = max(1, min(duration, VIDEO_MAX_SEGMENTED_DURATION))
 
-    bot.reply_to(message, f"🎬 *DM-Bot:* recording for {duration}s — please wait.", parse_mode="Markdown")
+    def send_segment(path: str, part: int) -> None:
+        bot.send_chat_action(message.chat.id, "upload_video")
+        uploads.send(message.chat.id, "video", path, f"🎬 DM-Bot — part {part}")
 
-    def do_record():
-        path, err = record_screen(duration)
+    def do_record(job: RecordingJob) -> None:
+        path, stats, err = record_screen(duration, height, preset,
+                                         on_segment=send_segment if segmented else None,
+                                         job=job, vfr=vfr)
         if err:
             bot.send_message(message.chat.id, f"❌ {err}")
+            raise RuntimeError(err)
+        recorded = stats["frames"] // VIDEO_FPS
+        if path is None:
+            bot.send_message(message.chat.id, f"🎬 DM-Bot — {recorded}s recording finished "
+                                              f"({stats['segments']} parts)\n{format_record_stats(stats)}")
             return
-        try:
-            bot.send_chat_action(message.chat.id, "upload_video")
-            with open(path, "rb") as f:
-                bot.send_video(message.chat.id, f, caption=f"🎬 DM-Bot — {duration}s recording")
-        finally:
-            Path(path).unlink(missing_ok=True)
+        job.state = "uploading"
+        bot.send_chat_action(message.chat.id, "upload_video")
+        if not uploads.send(message.chat.id, "video", path, f"🎬 DM-Bot — {recorded}s recording\n"
+                                                            f"{format_record_stats(stats)}"):
+            raise RuntimeError("upload failed; the video is kept for a retry")
+
+    job = recordings.start(message.chat.id, duration, do_record)
+    if job is None:
+        bot.reply_to(message, f"⚠️ DM-Bot: {recordings.limit} recording(s) already in progress.")
+        return
+
+    if segmented:
+        text = (f"🎬 *DM-Bot:* recording #{job.id} for {duration}s — parts of "
+                f"{SEGMENT_DURATION}s will arrive while recording.")
+    else:
+        text = f"🎬 *DM-Bot:* recording #{job.id} for {duration}s — please wait."
+    bot.reply_to(message, text, parse_mode="Markdown", reply_markup=stop_button(job))
+
+
+@authorized
+def cmd_stop(message: types.Message) -> None:
+    args = command_args(message)
+    if args and not args[0].lstrip("#").isdigit():
+        bot.reply_to(message, "Usage: /stop [recording id]")
+        return
+    if args:
+        job  = recordings.get(int(args[0].lstrip("#")))
+        jobs = [job] if job else []
+    else:
+        jobs = recordings.active(message.chat.id)
+    if not jobs:
+        bot.reply_to(message, "ℹ️ DM-Bot: no recording to stop.")
+        return
+    for job in jobs:
+        job.stop()
+    bot.reply_to(message, "⏹ DM-Bot: stopping " + ", ".join(f"#{j.id}" for j in jobs)
+                 + " — the partial video will be sent shortly.")
+
 
-    threading.Thread(target=do_record, daemon=True).start()
+@authorized
+def cmd_recordings(message: types.Message) -> None:
+    jobs = recordings.active()
+    if not jobs:
+        bot.reply_to(message, "ℹ️ DM-Bot: no recordings in progress.")
+        return
+    for job in jobs:
+        bot.send_message(message.chat.id, f"🎬 {job.describe()}", reply_markup=stop_button(job))
+
+
+@authorized
+def cmd_replay(message: types.Message) -> None:
+    args = command_args(message)
+    buf  = get_replay()
+    if args and args[0].lower() in ("on", "off"):
+        if args[0].lower() == "on":
+            buf.start()
+            bot.reply_to(message, f"⏺ DM-Bot: replay buffer on — keeping the last {buf.seconds}s "
+                                  f"at {buf.fps} fps.")
+        else:
+            buf.stop()
+            bot.reply_to(message, "⏹ DM-Bot: replay buffer off.")
+        return
+    if args and not args[0].isdigit():
+        bot.reply_to(message, "Usage: /replay [seconds] | /replay on | /replay off")
+        return
+    if not buf.running:
+        bot.reply_to(message, "ℹ️ DM-Bot: the replay buffer is off. Turn it on with /replay on.")
+        return
+
+    bot.send_chat_action(message.chat.id, "upload_video")
+    path, err = buf.save(int(args[0]) if args else None)
+    if err:
+        bot.reply_to(message, f"❌ {err}")
+        return
+    uploads.send(message.chat.id, "video", path, "⏪ DM-Bot — instant replay")
+
+
+@authorized
+def on_stop_button(call: types.CallbackQuery) -> None:
+    job = recordings.get(int(call.data.split(":", 1)[1]))
+    if job is None:
+        bot.answer_callback_query(call.id, "Recording already finished.")
+        return
+    job.stop()
+    bot.answer_callback_query(call.id, f"Stopping recording #{job.id}…")
+    bot.edit_message_reply_markup(call.message.chat.id, call.message.message_id, reply_markup=None)
+
+
+@authorized
+def on_upload_retry(call: types.CallbackQuery) -> None:
+    bot.answer_callback_query(call.id, "Retrying the upload…")
+    bot.edit_message_reply_markup(call.message.chat.id, call.message.message_id, reply_markup=None)
+    if uploads.retry(call.data.split(":", 1)[1]) is None:
+        bot.send_message(call.message.chat.id, "ℹ️ DM-Bot: that upload has expired.")
 
 
 @authorized
@@ -578,9 +3504,117 @@ def cmd_sysinfo(message: types.Message) -> None:
     bot.reply_to(message, get_system_info(), parse_mode="Markdown")
 
 
+@authorized
+def cmd_stats(message: types.Message) -> None:
+    seconds, as_text = 3600, False
+    for arg in command_args(message):
+        if arg.lower() == "text":
+            as_text = True
+        elif parse_window(arg.lower()):
+            seconds = min(parse_window(arg.lower()), STATS_HOURS * 3600)
+        else:
+            bot.reply_to(message, "Usage: /stats [1h|6h|24h] [text]")
+            return
+    if sampler is None:
+        bot.reply_to(message, "ℹ️ DM-Bot: metrics history is not running.")
+        return
+
+    times, series = sampler.history.window(seconds)
+    span = f"{seconds // 3600}h" if seconds >= 3600 else f"{seconds // 60}m"
+    if len(times) < 2:
+        bot.reply_to(message, f"ℹ️ DM-Bot: not enough samples yet (one every {sampler.interval}s).")
+        return
+    if as_text:
+        rows = [
+            ("CPU ", series["cpu"], "{:.0f}%"),
+            ("RAM ", series["mem"], "{:.0f}%"),
+            ("Disk", series["disk"], "{:.0f}%"),
+            ("Load", series["load"], "{:.2f}"),
+            ("Net↓", series["net_rx"], None),
+            ("Net↑", series["net_tx"], None),
+        ]
+        lines = [f"📈 DM-Bot — last {span}", "```"]
+        for label, values, fmt in rows:
+            lines.append(f"{label} {sparkline(values)} {format_metric(values[-1], fmt)} "
+                         f"(max {format_metric(_nanpeak(values), fmt)})")
+        lines.append("```")
+        bot.reply_to(message, "\n".join(lines), parse_mode="Markdown")
+        return
+    bot.send_chat_action(message.chat.id, "upload_photo")
+    uploads.send(message.chat.id, "photo", render_stats_chart(times, series, seconds),
+                 f"📈 DM-Bot — last {span}")
+
+
+@authorized
+def cmd_alerts(message: types.Message) -> None:
+    if alerts is None:
+        bot.reply_to(message, "ℹ️ DM-Bot: alerting is not running.")
+        return
+    lines = [f"🚨 DM-Bot — alert rules (checked every {sampler.interval}s)"]
+    lines += [rule.describe() for rule in alerts.rules]
+    bot.reply_to(message, "\n".join(lines))
+
+
+@authorized
+def cmd_top(message: types.Message) -> None:
+    n, key = TOP_DEFAULT, "cpu"
+    for arg in command_args(message):
+        arg = arg.lower()
+        if arg.isdigit():
+            n = max(1, min(int(arg), TOP_MAX))
+        elif arg in ("cpu", "mem", "io"):
+            key = arg
+        else:
+            bot.reply_to(message, "Usage: /top [n] [cpu|mem|io]")
+            return
+
+    try:
+        procs = processes.top(n, key)
+    except OSError as exc:
+        bot.reply_to(message, f"❌ DM-Bot: could not read /proc — {exc}")
+        return
+    lines = [f"📊 *DM-Bot — top {len(procs)} by {key}*", "```",
+             f"{'PID':>7} {'CPU%':>6} {'RSS':>9} {'IO/s':>9}  NAME"]
+    for p in procs:
+        io = _human(p["io"], "B") if p["io"] is not None else "-"
+        lines.append(f"{p['pid']:>7} {p['cpu']:>6.1f} {_human(p['rss']):>9} {io:>9}  {p['name'][:24]}")
+    lines.append("```")
+
+    markup = types.InlineKeyboardMarkup(row_width=2)
+    for p in procs[:TOP_BUTTONS]:
+        markup.add(
+            types.InlineKeyboardButton(f"TERM {p['pid']} {p['name'][:12]}",
+                                       callback_data=f"sig:TERM:{p['pid']}:{p['start']}"),
+            types.InlineKeyboardButton(f"KILL {p['pid']}",
+                                       callback_data=f"sig:KILL:{p['pid']}:{p['start']}"),
+        )
+    bot.reply_to(message, "\n".join(lines), parse_mode="Markdown", reply_markup=markup)
+
+
+@authorized
+def on_signal_button(call: types.CallbackQuery) -> None:
+    _, name, pid, start = call.data.split(":")
+    try:
+        # Make sure the PID still belongs to the process that was listed
+        stat = Path(f"/proc/{pid}/stat").read_bytes()
+        if int(stat.rpartition(b")")[2].split()[19]) != int(start):
+            raise ProcessLookupError
+        os.kill(int(pid), signal.SIGTERM if name == "TERM" else signal.SIGKILL)
+    except (FileNotFoundError, ProcessLookupError):
+        bot.answer_callback_query(call.id, f"Process {pid} is gone.")
+        return
+    except PermissionError:
+        bot.answer_callback_query(call.id, f"No permission to signal {pid}.", show_alert=True)
+        return
+    log.warning("DM-Bot: SIG%s sent to %s by Telegram user %s.", name, pid, call.from_user.id)
+    bot.answer_callback_query(call.id, f"SIG{name} sent to {pid}.")
+
+
 @authorized
 def cmd_lock(message: types.Message) -> None:
-    bot.reply_to(message, lock_screen())
+    # Runs on a CommandRunner worker: queue the reply rather than wait for the outbox there
+    lock_screen(lambda result: bot.send_later(message.chat.id, result, OUTBOX_REPLY,
+                                              reply_parameters=types.ReplyParameters(message.message_id)))
 
 
 @authorized
@@ -610,19 +3644,80 @@ def cmd_reboot(message: types.Message) -> None:
     reboot_pc()
 
 
+def window_keyboard(wins: list[dict]) -> types.InlineKeyboardMarkup:
+    markup = types.InlineKeyboardMarkup(row_width=1)
+    for w in wins[:WINDOW_BUTTONS]:
+        markup.add(types.InlineKeyboardButton(w["title"][:48] or f"0x{w['id']:08x}",
+                                              callback_data=f"win:{w['id']}"))
+    return markup
+
+
+def window_action_keyboard(window: dict) -> types.InlineKeyboardMarkup:
+    wid = window["id"]
+    markup = types.InlineKeyboardMarkup(row_width=2)
+    markup.add(*(types.InlineKeyboardButton(action.capitalize(), callback_data=f"win:{wid}:{action}")
+                 for action in WINDOW_ACTIONS))
+    markup.add(types.InlineKeyboardButton("« Back", callback_data="win:list"))
+    return markup
+
+
+def _windows_text(count: int) -> str:
+    return f"🪟 *DM-Bot — {count} open window(s).*\nTap one to choose an action."
+
+
 @authorized
 def cmd_windows(message: types.Message) -> None:
-    wins = list_windows()
+    wins = windows.current()
     if not wins:
         bot.reply_to(
             message,
             "❌ *DM-Bot:* no open windows found.\n"
-            "Make sure wmctrl or xdotool is installed.",
+            "Make sure an X11 session is running, or wmctrl or xdotool is installed.",
             parse_mode="Markdown",
         )
         return
-    text = "🪟 *DM-Bot — Open windows:*\n\n" + "\n".join(f"• {w}" for w in wins[:30])
-    bot.reply_to(message, text, parse_mode="Markdown")
+    bot.reply_to(message, _windows_text(len(wins)), parse_mode="Markdown",
+                 reply_markup=window_keyboard(wins))
+
+
+def _show_window_list(chat_id: int, message_id: int) -> None:
+    wins = windows.current()
+    bot.edit_message_text(_windows_text(len(wins)), chat_id, message_id,
+                          parse_mode="Markdown", reply_markup=window_keyboard(wins))
+
+
+@authorized
+def on_window_button(call: types.CallbackQuery) -> None:
+    chat_id, message_id = call.message.chat.id, call.message.message_id
+    parts = call.data.split(":")
+    if parts[1] == "list":
+        bot.answer_callback_query(call.id)
+        _show_window_list(chat_id, message_id)
+        return
+
+    window = windows.get(int(parts[1]))
+    if window is None:
+        bot.answer_callback_query(call.id, "That window is gone — refreshing the list.")
+        _show_window_list(chat_id, message_id)
+        return
+
+    if len(parts) == 2:
+        bot.answer_callback_query(call.id)
+        bot.edit_message_text(f"🪟 {window['title']}\nChoose an action:", chat_id, message_id,
+                              reply_markup=window_action_keyboard(window))
+        return
+
+    action = parts[2]
+    if action not in WINDOW_ACTIONS:
+        bot.answer_callback_query(call.id, f"Unknown action '{action}'.")
+        return
+    err = window_action(action, window)
+    log.info("DM-Bot: window %s '%s' %s by Telegram user %s.", hex(window["id"]), window["title"],
+             action, call.from_user.id)
+    bot.answer_callback_query(call.id, f"Error: {err}" if err else f"{action.capitalize()}: {window['title'][:40]}",
+                              show_alert=bool(err))
+    if action == "close" and not err:
+        _show_window_list(chat_id, message_id)
 
 
 @authorized
@@ -711,7 +3806,13 @@ def register_handlers() -> None:
     bot.message_handler(commands=["deauth"])(cmd_deauth)
     bot.message_handler(commands=["screenshot"])(cmd_screenshot)
     bot.message_handler(commands=["record"])(cmd_record)
+    bot.message_handler(commands=["stop"])(cmd_stop)
+    bot.message_handler(commands=["recordings"])(cmd_recordings)
+    bot.message_handler(commands=["replay"])(cmd_replay)
     bot.message_handler(commands=["sysinfo"])(cmd_sysinfo)
+    bot.message_handler(commands=["stats"])(cmd_stats)
+    bot.message_handler(commands=["top"])(cmd_top)
+    bot.message_handler(commands=["alerts"])(cmd_alerts)
     bot.message_handler(commands=["lock"])(cmd_lock)
     bot.message_handler(commands=["shutdown"])(cmd_shutdown)
     bot.message_handler(commands=["reboot"])(cmd_reboot)
@@ -719,6 +3820,541 @@ def register_handlers() -> None:
     bot.message_handler(commands=["win_action"])(cmd_win_action)
     bot.message_handler(commands=["cleardata"])(cmd_cleardata)
     bot.message_handler(func=lambda m: m.text in BUTTON_MAP)(handle_text)
+    bot.callback_query_handler(func=lambda c: (c.data or "").startswith("rec_stop:"))(on_stop_button)
+    bot.callback_query_handler(func=lambda c: (c.data or "").startswith("sig:"))(on_signal_button)
+    bot.callback_query_handler(func=lambda c: (c.data or "").startswith("win:"))(on_window_button)
+    bot.callback_query_handler(func=lambda c: (c.data or "").startswith("upl:"))(on_upload_retry)
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Handler lanes
+# ─────────────────────────────────────────────────────────────────────────────
+
+handler_thread = threading.local()  # .lane is set on lane workers: their sends are replies
+
+
+class HandlerLane:
+    """
+    One bounded worker pool for handlers. Tracks how deep its queue is and
+    how long tasks waited in it before a worker picked them up.
+    """
+
+    def __init__(self, name: str, workers: int, max_queued: int = 0, window: int = 500) -> None:
+        self.name      = name
+        self.workers   = max(1, workers)
+        self.rejected  = 0
+        self.done      = 0
+        self.running   = 0
+        self.waits     = deque(maxlen=window)  # seconds spent queued
+        self._queue    = queue.Queue(maxsize=max(0, max_queued))
+        self._lock     = threading.Lock()
+        self._threads: list[threading.Thread] = []
+
+    def _start(self) -> None:
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"dm-bot-{self.name}-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _work(self) -> None:
+        handler_thread.lane = self.name
+        while True:
+            queued_at, task, args, kwargs = self._queue.get()
+            with self._lock:
+                self.waits.append(time.monotonic() - queued_at)
+                self.running += 1
+            try:
+                task(*args, **kwargs)
+            except Exception:
+                log.exception("DM-Bot: handler failed in the %s lane.", self.name)
+            finally:
+                with self._lock:
+                    self.running -= 1
+                    self.done += 1
+
+    def submit(self, task: Callable, *args, **kwargs) -> bool:
+        """Queue a task; False if the lane is full."""
+        with self._lock:
+            if not self._threads:
+                self._start()
+        try:
+            self._queue.put_nowait((time.monotonic(), task, args, kwargs))
+            return True
+        except queue.Full:
+            with self._lock:
+                self.rejected += 1
+            return False
+
+    def stats(self) -> dict:
+        with self._lock:
+            waits = sorted(self.waits)
+            running, done, rejected = self.running, self.done, self.rejected
+        pct = lambda q: waits[min(len(waits) - 1, int(len(waits) * q))] if waits else 0.0
+        return {"queued": self._queue.qsize(), "running": running, "workers": self.workers,
+                "done": done, "rejected": rejected, "wait_p50": pct(0.5), "wait_p95": pct(0.95),
+                "wait_max": waits[-1] if waits else 0.0}
+
+
+class HandlerLanes:
+    """Routes each update to the lane of the command, button or callback it carries."""
+
+    def __init__(self, config: dict = HANDLER_LANES) -> None:
+        self.lanes = {name: HandlerLane(name, workers, max_queued)
+                      for name, (workers, max_queued) in config.items()}
+
+    @staticmethod
+    def lane_for(update) -> str:
+        if isinstance(update, types.CallbackQuery):
+            return CALLBACK_LANES.get((update.data or "").split(":", 1)[0], "default")
+        if isinstance(update, types.Message) and update.text:
+            if update.text.startswith("/"):
+                command = update.text.split()[0][1:].split("@")[0].lower()
+                return COMMAND_LANES.get(command, "default")
+            handler = BUTTON_MAP.get(update.text)
+            if handler is not None:
+                return COMMAND_LANES.get(handler.__name__.removeprefix("cmd_"), "default")
+        return "default"
+
+    def submit(self, update, task: Callable, *args, **kwargs) -> bool:
+        lane = self.lanes.get(self.lane_for(update)) or self.lanes["default"]
+        return lane.submit(task, update, *args, **kwargs)
+
+    def describe(self) -> list[str]:
+        lines = []
+        for name, lane in self.lanes.items():
+            st = lane.stats()
+            lines.append(f"{name}: {st['running']}/{st['workers']} busy · {st['queued']} queued · "
+                         f"wait p50 {st['wait_p50'] * 1000:.1f} ms, p95 {st['wait_p95'] * 1000:.1f} ms"
+                         + (f" · {st['rejected']} rejected" if st["rejected"] else ""))
+        return lines
+
+
+lanes = HandlerLanes()
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Outgoing messages
+# ─────────────────────────────────────────────────────────────────────────────
+
+class TokenBucket:
+    """
+    `rate` tokens per second, at most `burst` saved up. Tokens may go
+    negative: taking one that isn't there yet reserves a later slot.
+    """
+
+    def __init__(self, rate: float, burst: float) -> None:
+        self.rate       = rate
+        self.burst      = burst
+        self.tokens     = float(burst)
+        self.stamp      = time.monotonic()
+        self.hold_until = 0.0  # set from a 429's retry_after
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp  = now
+
+    def ready_at(self, now: float) -> float:
+        self._refill(now)
+        ready = now if self.tokens >= 1 else now + (1 - self.tokens) / self.rate
+        return max(ready, self.hold_until)
+
+    def take(self, now: float) -> None:
+        self._refill(now)
+        self.tokens -= 1
+
+    def hold(self, until: float) -> None:
+        self.hold_until = max(self.hold_until, until)
+
+    @property
+    def idle(self) -> bool:
+        self._refill(time.monotonic())
+        return self.tokens >= self.burst and self.hold_until <= self.stamp
+
+
+class OutgoingMessage:
+    def __init__(self, seq: int, priority: int, chat_id: int, text: str, kwargs: dict) -> None:
+        self.seq      = seq
+        self.priority = priority
+        self.chat_id  = chat_id
+        self.text     = text
+        self.kwargs   = kwargs
+        self.attempts = 0
+        self.future   = Future()
+
+    @property
+    def order(self) -> tuple[int, int]:
+        return self.priority, self.seq
+
+    @property
+    def coalesce_key(self) -> Optional[list]:
+        """
+        Messages with equal keys may share one send; None if this one never
+        may. Only notifications and rejections without a reply target or
+        keyboard qualify: a reply's caller gets back its own Message.
+        """
+        if (self.priority == OUTBOX_REPLY or self.kwargs.get("reply_markup") is not None
+                or self.kwargs.get("reply_parameters") is not None):
+            return None
+        return sorted(self.kwargs.items())
+
+
+class Outbox:
+    """
+    Central queue for outgoing text messages, paced by a global token bucket
+    and one per chat. Messages go out by priority — replies from handlers,
+    then background notifications, then replies to unauthorized users — and
+    in order within a chat and priority. Consecutive queued notifications
+    for one chat with the same options are sent as a single message
+    (repeats of the same text collapse), and a 429 holds that chat for its
+    retry_after.
+    """
+
+    def __init__(self, deliver: Callable, senders: int = OUTBOX_SENDERS, rate: float = OUTBOX_RATE,
+                 chat_rate: float = OUTBOX_CHAT_RATE, chat_burst: int = OUTBOX_CHAT_BURST) -> None:
+        self.deliver    = deliver  # deliver(chat_id, text, **kwargs) -> Message
+        self.senders    = max(1, senders)
+        self.chat_rate  = chat_rate
+        self.chat_burst = chat_burst
+        self.sent       = 0  # Bot API calls made
+        self.coalesced  = 0  # messages folded into another one
+        self.limited    = 0  # 429s received
+        self.bucket     = TokenBucket(rate, max(1.0, rate))
+        self._chats: dict[int, TokenBucket] = {}
+        self._queues: dict[int, list[OutgoingMessage]] = {}
+        self._busy: set[int] = set()  # chats with a send in flight
+        self._seq       = 0
+        self._cond      = threading.Condition()
+        self._threads: list[threading.Thread] = []
+
+    def _chat(self, chat_id: int) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) > 256:  # forget chats that have been quiet long enough to refill
+                for old in [c for c, b in self._chats.items() if b.idle and c not in self._queues]:
+                    del self._chats[old]
+            bucket = self._chats[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    def submit(self, chat_id: int, text: str, priority: int = OUTBOX_NOTIFY, **kwargs) -> Future:
+        """Queue a message; the future resolves to the sent Message (shared if it was coalesced)."""
+        with self._cond:
+            if not self._threads:
+                for i in range(self.senders):
+                    thread = threading.Thread(target=self._run, name=f"dm-bot-outbox-{i}", daemon=True)
+                    thread.start()
+                    self._threads.append(thread)
+            self._seq += 1
+            message = OutgoingMessage(self._seq, priority, chat_id, text, kwargs)
+            self._queues.setdefault(chat_id, []).append(message)
+            self._cond.notify()
+        return message.future
+
+    def pace(self, chat_id: int) -> None:
+        """Block until a send to `chat_id` (e.g. a media upload) fits the same limits, and count it."""
+        with self._cond:
+            now   = time.monotonic()
+            ready = max(self.bucket.ready_at(now), self._chat(chat_id).ready_at(now))
+            self.bucket.take(now)
+            self._chat(chat_id).take(now)
+        if ready > now:
+            time.sleep(ready - now)
+
+    def _next_batch(self, now: float) -> tuple[Optional[list[OutgoingMessage]], Optional[float]]:
+        """Under the lock: the next messages to send as one, or how long until one may go."""
+        best, wake = None, None
+        for chat_id, queued in self._queues.items():
+            if chat_id in self._busy:
+                continue
+            ready = self._chat(chat_id).ready_at(now)
+            if ready > now:
+                wake = ready if wake is None else min(wake, ready)
+                continue
+            head = min(queued, key=lambda m: m.order)
+            if best is None or head.order < best.order:
+                best = head
+        if best is None:
+            return None, None if wake is None else wake - now
+        ready = self.bucket.ready_at(now)
+        if ready > now:
+            return None, ready - now
+
+        self.bucket.take(now)
+        self._chat(best.chat_id).take(now)
+        queued = sorted(self._queues.pop(best.chat_id), key=lambda m: m.order)
+        batch, length, key = [queued.pop(0)], len(best.text), best.coalesce_key
+        while queued and key is not None and queued[0].coalesce_key == key:
+            extra = 0 if queued[0].text == batch[-1].text else len(queued[0].text) + 2
+            if length + extra > TEXT_MAX_LENGTH:
+                break
+            length += extra
+            batch.append(queued.pop(0))
+        if queued:
+            self._queues[best.chat_id] = queued
+        self._busy.add(best.chat_id)
+        return batch, None
+
+    def _send(self, batch: list[OutgoingMessage]) -> None:
+        head  = batch[0]
+        texts = [head.text]
+        for message in batch[1:]:
+            if message.text != texts[-1]:
+                texts.append(message.text)
+        try:
+            result = self.deliver(head.chat_id, "\n\n".join(texts), **head.kwargs)
+        except Exception as exc:
+            retry_after = None
+            if isinstance(exc, telebot.apihelper.ApiTelegramException) and exc.error_code == 429:
+                retry_after = float(exc.result_json.get("parameters", {}).get("retry_after", 1))
+            with self._cond:
+                self._busy.discard(head.chat_id)
+                self.limited += retry_after is not None
+                head.attempts += 1
+                if retry_after is not None and head.attempts < OUTBOX_ATTEMPTS:
+                    log.warning("DM-Bot: rate limited in chat %s — holding it for %.0fs.", head.chat_id, retry_after)
+                    self._chat(head.chat_id).hold(time.monotonic() + retry_after)
+                    self._queues[head.chat_id] = batch + self._queues.get(head.chat_id, [])
+                    self._cond.notify_all()
+                    return
+                self._cond.notify_all()
+            for message in batch:
+                message.future.set_exception(exc)
+            return
+        with self._cond:
+            self._busy.discard(head.chat_id)
+            self.sent      += 1
+            self.coalesced += len(batch) - 1
+            self._cond.notify_all()
+        for message in batch:
+            message.future.set_result(result)
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                batch, wait = self._next_batch(time.monotonic())
+                while batch is None:
+                    self._cond.wait(wait)
+                    batch, wait = self._next_batch(time.monotonic())
+            self._send(batch)
+
+    def describe(self) -> str:
+        with self._cond:
+            queued = sum(len(q) for q in self._queues.values())
+            return (f"{queued} queued · {self.sent} sent · {self.coalesced} coalesced · "
+                    f"{self.limited} rate-limited")
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Update transport: long polling or webhook
+# ─────────────────────────────────────────────────────────────────────────────
+
+class UpdateLatency(BaseMiddleware):
+    """
+    Update → handler latency. Updates are stamped when they reach the bot
+    (the webhook request, or the getUpdates batch when polling); this class
+    middleware runs on the worker thread right before the handler and
+    records the difference. For messages it also keeps Telegram-date →
+    handler time, which includes any poll-cycle delay but has 1 s resolution.
+    """
+
+    def __init__(self, mode: str, window: int = 500) -> None:
+        super().__init__()
+        self.update_types = ["message", "callback_query"]
+        self.mode      = mode
+        self.dispatch  = deque(maxlen=window)  # seconds, arrival → handler
+        self.end2end   = deque(maxlen=window)  # seconds, Telegram date → handler
+        self._lock     = threading.Lock()
+        self._count    = 0
+
+    @staticmethod
+    def stamp(updates: list, received: float) -> None:
+        for update in updates:
+            for obj in (update.message, update.callback_query):
+                if obj is not None and not hasattr(obj, "dm_received"):
+                    obj.dm_received = received
+
+    def pre_process(self, message, data) -> None:
+        received = getattr(message, "dm_received", None)
+        if received is None:
+            return
+        with self._lock:
+            self.dispatch.append(time.monotonic() - received)
+            if isinstance(message, types.Message):
+                self.end2end.append(max(0.0, time.time() - message.date))
+            self._count += 1
+            report = self._count % LATENCY_REPORT_EVERY == 0
+        if report:
+            log.info("DM-Bot: update latency (%s) — %s", self.mode, self.describe())
+
+    def post_process(self, message, data, exception) -> None:
+        pass
+
+    def describe(self) -> str:
+        with self._lock:
+            dispatch, end2end = sorted(self.dispatch), sorted(self.end2end)
+        if not dispatch:
+            return "no updates yet"
+        pct = lambda xs, q: xs[min(len(xs) - 1, int(len(xs) * q))]
+        text = (f"arrival→handler p50 {pct(dispatch, 0.5) * 1000:.1f} ms, "
+                f"p95 {pct(dispatch, 0.95) * 1000:.1f} ms (n={len(dispatch)})")
+        if end2end:
+            text += f"; sent→handler p50 {pct(end2end, 0.5):.0f} s"
+        return text
+
+
+class DMBot(telebot.TeleBot):
+    """
+    TeleBot that stamps each update on arrival for UpdateLatency and runs
+    handlers on HandlerLanes instead of telebot's single shared pool. With
+    `paced`, text messages go through an Outbox instead of straight out.
+    """
+
+    def __init__(self, *args, handler_lanes: Optional[HandlerLanes] = None, paced: bool = False,
+                 **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.handler_lanes = handler_lanes or lanes
+        self.outbox = Outbox(partial(telebot.TeleBot.send_message, self)) if paced else None
+
+    def send_message(self, chat_id, text: str, priority: Optional[int] = None, **kwargs):
+        """Queued and paced when there is an outbox; sends from handler threads count as replies."""
+        if self.outbox is None:
+            return super().send_message(chat_id, text, **kwargs)
+        if priority is None:
+            priority = OUTBOX_REPLY if getattr(handler_thread, "lane", None) else OUTBOX_NOTIFY
+        return self.outbox.submit(chat_id, text, priority, **kwargs).result()
+
+    def send_later(self, chat_id, text: str, priority: int = OUTBOX_NOTIFY, **kwargs) -> Future:
+        """Like send_message, but returns a future instead of waiting for the send."""
+        if self.outbox is not None:
+            return self.outbox.submit(chat_id, text, priority, **kwargs)
+        future = Future()
+        try:
+            future.set_result(super().send_message(chat_id, text, **kwargs))
+        except Exception as exc:
+            future.set_exception(exc)
+        return future
+
+    def pace(self, chat_id) -> None:
+        """Wait for a slot under the outbox limits before a media send to `chat_id`."""
+        if self.outbox is not None:
+            self.outbox.pace(chat_id)
+
+    def process_new_updates(self, updates: list) -> None:
+        UpdateLatency.stamp(updates, time.monotonic())
+        super().process_new_updates(updates)
+
+    def _exec_task(self, task, *args, **kwargs) -> None:
+        update = args[0] if args else None
+        if self.handler_lanes.submit(update, task, *args[1:], **kwargs):
+            return
+        log.warning("DM-Bot: %s lane full — dropping an update.", self.handler_lanes.lane_for(update))
+        sender = getattr(update, "from_user", None)
+        if sender is None or not is_authorized(str(sender.id)):
+            return  # strangers' updates are dropped silently
+        try:
+            if isinstance(update, types.Message):
+                # Queued, not waited for: this runs on the thread dispatching every chat's updates
+                self.send_later(update.chat.id, "⏳ DM-Bot is busy with other media requests — try again in a moment.",
+                                OUTBOX_REJECT, reply_parameters=types.ReplyParameters(update.message_id))
+            elif isinstance(update, types.CallbackQuery):
+                self.answer_callback_query(update.id, "DM-Bot is busy — try again in a moment.")
+        except Exception as exc:
+            log.warning("DM-Bot: could not send the busy notice (%s).", exc)
+
+
+class WebhookServer(ThreadingHTTPServer):
+    """Embedded HTTP(S) endpoint Telegram posts updates to."""
+
+    daemon_threads = True
+
+    def __init__(self, address: tuple[str, int], target: telebot.TeleBot, secret: str, path: str,
+                 ssl_context: Optional[ssl.SSLContext] = None) -> None:
+        super().__init__(address, _WebhookHandler)
+        self.target = target
+        self.secret = secret
+        self.path   = path or "/"
+        if ssl_context is not None:
+            # Handshake lazily on the request thread, so a slow client cannot stall accept()
+            self.socket = ssl_context.wrap_socket(self.socket, server_side=True,
+                                                  do_handshake_on_connect=False)
+
+
+class _WebhookHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive: Telegram reuses its connections
+    timeout = 30
+
+    def _reply(self, code: int) -> None:
+        self.send_response(code)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+        if code != 200:
+            self.close_connection = True  # the body may be unread; don't reuse the stream
+
+    def do_POST(self) -> None:
+        received = time.monotonic()
+        server: WebhookServer = self.server
+        if self.path != server.path:
+            self._reply(404)
+            return
+        token = self.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+        if not hmac.compare_digest(token.encode(), server.secret.encode()):
+            log.warning("DM-Bot: webhook request from %s with a bad secret token.", self.client_address[0])
+            self._reply(403)
+            return
+        try:
+            length = int(self.headers.get("Content-Length", ""))
+        except ValueError:
+            self._reply(411)
+            return
+        if length > WEBHOOK_MAX_BODY:
+            self._reply(413)
+            return
+
+        # Read the body as it arrives, in bounded chunks, never past Content-Length
+        body = bytearray()
+        while len(body) < length:
+            chunk = self.rfile.read1(min(65536, length - len(body)))
+            if not chunk:
+                break
+            body += chunk
+        try:
+            update = types.Update.de_json(json.loads(body))
+        except Exception as exc:
+            log.warning("DM-Bot: malformed webhook update (%s).", exc)
+            self._reply(400)
+            return
+
+        self._reply(200)  # acknowledge first; handlers run on the bot's worker threads
+        UpdateLatency.stamp([update], received)
+        server.target.process_new_updates([update])
+
+    def log_message(self, fmt: str, *args) -> None:
+        log.debug("DM-Bot webhook: " + fmt, *args)
+
+
+def parse_listen(listen: str) -> tuple[str, int]:
+    host, _, port = listen.rpartition(":")
+    return host.strip("[]") or "0.0.0.0", int(port)
+
+
+def serve_webhook(url: str, listen: str = WEBHOOK_LISTEN) -> None:
+    """Register `url` with Telegram and serve updates on `listen` until interrupted."""
+    ssl_context = None
+    if WEBHOOK_CERT and WEBHOOK_KEY:
+        ssl_context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+        ssl_context.load_cert_chain(WEBHOOK_CERT, WEBHOOK_KEY)
+    secret = WEBHOOK_SECRET or secrets.token_urlsafe(32)
+    server = WebhookServer(parse_listen(listen), bot, secret, urlsplit(url).path, ssl_context)
+
+    certificate = open(WEBHOOK_CERT, "rb") if WEBHOOK_SELF_SIGNED and WEBHOOK_CERT else None
+    try:
+        bot.set_webhook(url=url, secret_token=secret, certificate=certificate,
+                        allowed_updates=["message", "callback_query"])
+    finally:
+        if certificate:
+            certificate.close()
+    log.info("DM-Bot: webhook %s registered, listening on %s (%s).", url, listen,
+             "HTTPS" if ssl_context else "HTTP")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
 
 # ─────────────────────────────────────────────────────────────────────────────
 # Graceful shutdown
@@ -728,19 +4364,34 @@ def handle_signal(sig, frame) -> None:
     log.info("DM-Bot: signal %s received — stopping.", sig)
     if bot:
         bot.stop_polling()
+    recordings.stop_all()
+    if replay:
+        replay.stop()
+    if sampler:
+        sampler.stop()
+    if capture:
+        capture.close()
+    commands.close()
     sys.exit(0)
 
 # ─────────────────────────────────────────────────────────────────────────────
 # Entry point
 # ─────────────────────────────────────────────────────────────────────────────
 
-def run() -> None:
-    global bot
+def run(webhook: Optional[str] = None, listen: str = WEBHOOK_LISTEN) -> None:
+    global bot, sampler, alerts, latency
 
     signal.signal(signal.SIGINT,  handle_signal)
     signal.signal(signal.SIGTERM, handle_signal)
 
     load_user_data()
+    load_capabilities()
+    file_ids.load()
+    uploads.expire()
+    get_capture()
+    metrics.snapshot()  # first /sysinfo gets real rates instead of boot averages
+    if REPLAY_ENABLED:
+        get_replay().start()
 
     # Token priority: env var → saved file → interactive prompt
     token = (
@@ -749,14 +4400,23 @@ def run() -> None:
         or prompt_for_token()
     )
 
+    telebot.apihelper.session = make_http_session()  # every thread shares one keep-alive pool
     try:
-        bot = telebot.TeleBot(token, parse_mode=None)
+        bot = DMBot(token, parse_mode=None, use_class_middlewares=True, paced=True)
         me  = bot.get_me()
         log.info("DM-Bot: authenticated as @%s (id=%s)", me.username, me.id)
     except Exception as exc:
         log.error("DM-Bot: failed to initialize — %s", exc)
         sys.exit(1)
 
+    # Only now: an alert fired before `bot` exists would be lost
+    sampler = MetricsSampler()
+    alerts  = AlertEngine(load_alert_rules())
+    sampler.listeners.append(alerts.feed)
+    sampler.start()
+
+    latency = UpdateLatency("webhook" if webhook else "polling")
+    bot.setup_middleware(latency)
     register_handlers()
 
     print("\n" + "═" * 60)
@@ -765,10 +4425,24 @@ def run() -> None:
     print(f"  Data dir     : {DATA_DIR}")
     print(f"  Log file     : dm-bot.log")
     print(f"  Token env    : DM_BOT_TOKEN")
+    print(f"  Updates      : {'webhook ' + webhook + ' on ' + listen if webhook else 'long polling'}")
     print("  Press Ctrl+C to stop.")
     print("═" * 60 + "\n")
 
+    if webhook:
+        log.info("DM-Bot v%s started. Serving webhook...", __version__)
+        try:
+            serve_webhook(webhook, listen)
+        except Exception as exc:
+            log.error("DM-Bot: webhook mode failed — %s", exc)
+            sys.exit(1)
+        return
+
     log.info("DM-Bot v%s started. Polling...", __version__)
+    try:
+        bot.remove_webhook()  # getUpdates is refused while a webhook from an earlier run is set
+    except Exception as exc:
+        log.warning("DM-Bot: could not clear a previous webhook (%s).", exc)
 
     reconnect_delay = 5
     while True:
@@ -788,4 +4462,17 @@ if __name__ == "__main__":
     if sys.platform.startswith("win"):
         print("DM-Bot is designed for Linux. Windows is not supported.")
         sys.exit(1)
-    run()
\ No newline at end of file
+    import argparse
+    parser = argparse.ArgumentParser(prog="dm-bot", description="Remote Linux PC control via Telegram.")
+    parser.add_argument("--webhook", nargs="?", const=WEBHOOK_URL, metavar="URL",
+                        help="receive updates via webhook at URL (default $DM_BOT_WEBHOOK_URL) instead of polling")
+    parser.add_argument("--listen", default=WEBHOOK_LISTEN, metavar="HOST:PORT",
+                        help=f"webhook listen address (default {WEBHOOK_LISTEN})")
+    parser.add_argument("--capture", choices=sorted(CAPTURE_BACKENDS),
+                        help="capture backend (default $DM_BOT_CAPTURE_BACKEND or auto-detect)")
+    cli = parser.parse_args()
+    if cli.capture:
+        CAPTURE_BACKEND = cli.capture
+    if cli.webhook == "":
+        parser.error("--webhook needs a URL or DM_BOT_WEBHOOK_URL")
+    run(cli.webhook, cli.listen)